@@ -2,7 +2,7 @@
     "name": "Hacienda - Costa Rica Electronic Invoicing",
     "summary": "Adds Costa Rican electronic invoicing support (XML 4.4) for Odoo 19.",
     "description": """Costa Rican localization helpers for electronic invoicing (XML schema 4.4).\nIncludes journals, taxes, products, partners and electronic document management.""",
-    "version": "19.0.1.0.1",
+    "version": "19.0.1.0.4",
     "category": "Accounting",
     "author": "OpenAI Assistant",
     "website": "https://www.hacienda.go.cr/",
@@ -28,9 +28,14 @@
         "views/res_partner_views.xml",
         "views/hacienda_config_views.xml",
         "views/hacienda_document_views.xml",
+        "views/hacienda_archive_views.xml",
         "views/hacienda_catalog_views.xml",
+        "views/hacienda_cabys_import_views.xml",
+        "views/hacienda_cabys_suggestion_views.xml",
+        "views/hacienda_geo_import_views.xml",
         "views/uom_uom_views.xml",
         "data/hacienda_menus.xml",
+        "data/hacienda_cron.xml",
     ],
     "application": True,
 }
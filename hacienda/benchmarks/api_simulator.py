@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Hacienda API, for load and soak tests of the send pipeline.
+
+It implements the endpoints the module calls, under any base path:
+
+* ``POST /token``: issues random access and refresh tokens;
+* ``POST /recepcion``: takes a signed XML, answers ``202`` and starts
+  "processing" it;
+* ``GET /recepcion/{clave}``: ``procesando`` until the processing time has
+  passed, then ``aceptado`` or ``rechazado`` with a ``MensajeHacienda``;
+* ``GET /identificacion/{id}``: a taxpayer record;
+* ``GET /stats``: counters of the simulator itself.
+
+Latency (log-normal around a median), processing time, the accepted ratio
+and the injection of ``429`` and ``5xx`` answers are configurable. The module
+only uses the standard library so it runs without Odoo::
+
+    python api_simulator.py --port 8765 --latency-median-ms 80 --latency-sigma 0.6 \\
+        --processing-seconds 2 --accept-ratio 0.95 --throttle-ratio 0.02 --server-error-ratio 0.01
+
+Point ``hacienda_api_base_url`` of a test company to ``http://127.0.0.1:8765/``.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+CLAVE_PATTERN = re.compile(rb"<(?:\w+:)?Clave>\s*([^<\s]+)\s*</(?:\w+:)?Clave>")
+SERVER_ERROR_STATUSES = (500, 502, 503)
+
+
+@dataclass
+class SimulatorConfig:
+    latency_median_ms: float = 50.0
+    # Sigma of the log-normal latency; 0 makes every answer take the median.
+    latency_sigma: float = 0.5
+    processing_seconds: float = 2.0
+    accept_ratio: float = 0.95
+    throttle_ratio: float = 0.0
+    server_error_ratio: float = 0.0
+    # Requests per second accepted on /recepcion before answering 429; 0 disables it.
+    rate_limit: float = 0.0
+    retry_after_seconds: int = 1
+    token_ttl_seconds: int = 300
+    refresh_ttl_seconds: int = 3600
+    seed: int = None
+
+
+class SimulatorState:
+    """Tokens, received documents and counters shared by the request threads."""
+
+    def __init__(self, config):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.refresh_tokens = set()
+        self.documents = {}
+        self.counters = Counter()
+        self.sequence = 0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    def draw(self):
+        with self.lock:
+            return self.random.random()
+
+    def choice(self, values):
+        with self.lock:
+            return self.random.choice(values)
+
+    def latency(self):
+        config = self.config
+        if config.latency_median_ms <= 0:
+            return 0.0
+        with self.lock:
+            factor = self.random.lognormvariate(0.0, config.latency_sigma) if config.latency_sigma > 0 else 1.0
+        return config.latency_median_ms * factor / 1000.0
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def over_rate_limit(self):
+        if self.config.rate_limit <= 0:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            return self.window_count > self.config.rate_limit
+
+    def issue_token(self):
+        access_token = secrets.token_hex(16)
+        refresh_token = secrets.token_hex(16)
+        with self.lock:
+            self.tokens[access_token] = time.monotonic() + self.config.token_ttl_seconds
+            self.refresh_tokens.add(refresh_token)
+        return {
+            "access_token": access_token,
+            "token_type": "bearer",
+            "expires_in": self.config.token_ttl_seconds,
+            "refresh_token": refresh_token,
+            "refresh_expires_in": self.config.refresh_ttl_seconds,
+        }
+
+    def is_authorized(self, header):
+        token = header[7:] if header and header.startswith("Bearer ") else None
+        with self.lock:
+            expires = self.tokens.get(token)
+        return expires is not None and expires > time.monotonic()
+
+    def receive(self, body):
+        match = CLAVE_PATTERN.search(body)
+        with self.lock:
+            self.sequence += 1
+            clave = match.group(1).decode() if match else f"SIM{self.sequence:047d}"
+            accepted = self.random.random() < self.config.accept_ratio
+            self.documents[clave] = (time.monotonic() + self.config.processing_seconds, accepted)
+        return clave
+
+    def status(self, clave):
+        with self.lock:
+            document = self.documents.get(clave)
+        if document is None:
+            return None
+        ready_at, accepted = document
+        if time.monotonic() < ready_at:
+            return {"clave": clave, "ind-estado": "procesando"}
+        state = "aceptado" if accepted else "rechazado"
+        detail = "Aceptado" if accepted else "Este comprobante fue rechazado por el simulador."
+        message = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<MensajeHacienda xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/mensajeHacienda">'
+            f"<Clave>{clave}</Clave><Mensaje>{1 if accepted else 3}</Mensaje>"
+            f"<DetalleMensaje>{detail}</DetalleMensaje></MensajeHacienda>"
+        )
+        return {
+            "clave": clave,
+            "fecha": datetime.now(timezone.utc).isoformat(),
+            "ind-estado": state,
+            "respuesta-xml": base64.b64encode(message.encode()).decode(),
+        }
+
+    def stats(self):
+        with self.lock:
+            return {
+                "config": asdict(self.config),
+                "counters": dict(self.counters),
+                "documents": len(self.documents),
+                "tokens": len(self.tokens),
+            }
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "HaciendaSimulator/1.0"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):  # noqa: A002 - signature of the base class
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        self.state.count(f"{self.command} {self._route()[0]} {status}")
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _route(self):
+        parts = [part for part in urlsplit(self.path).path.split("/") if part]
+        if parts and parts[-1] in {"token", "recepcion", "stats"}:
+            return parts[-1], None
+        if len(parts) >= 2 and parts[-2] in {"recepcion", "identificacion"}:
+            return parts[-2], parts[-1]
+        return None, None
+
+    def _injected_failure(self):
+        """Answer with an injected 429 or 5xx and return True, or return False."""
+        config = self.state.config
+        draw = self.state.draw()
+        if draw < config.throttle_ratio or (self._route()[0] == "recepcion" and self.state.over_rate_limit()):
+            self._send(429, {"message": "Too Many Requests"}, {"Retry-After": str(config.retry_after_seconds)})
+            return True
+        if draw < config.throttle_ratio + config.server_error_ratio:
+            self._send(self.state.choice(SERVER_ERROR_STATUSES), {"message": "Simulated failure"})
+            return True
+        return False
+
+    def do_POST(self):  # noqa: N802 - name imposed by BaseHTTPRequestHandler
+        route, _argument = self._route()
+        body = self._read_body()
+        time.sleep(self.state.latency())
+        if route == "token":
+            self._send(200, self.state.issue_token())
+        elif route == "recepcion":
+            if not self.state.is_authorized(self.headers.get("Authorization")):
+                self._send(401, {"message": "Token inválido o vencido"})
+            elif not self._injected_failure():
+                clave = self.state.receive(body)
+                self._send(202, headers={"Location": f"{self.path.rstrip('/')}/{clave}"})
+        else:
+            self._send(404, {"message": "Not found"})
+
+    def do_GET(self):  # noqa: N802 - name imposed by BaseHTTPRequestHandler
+        route, argument = self._route()
+        if route == "stats":
+            self._send(200, self.state.stats())
+            return
+        time.sleep(self.state.latency())
+        if route == "recepcion" and argument:
+            if not self.state.is_authorized(self.headers.get("Authorization")):
+                self._send(401, {"message": "Token inválido o vencido"})
+            elif not self._injected_failure():
+                status = self.state.status(argument)
+                self._send(200 if status else 404, status or {"message": "Comprobante no encontrado"})
+        elif route == "identificacion" and argument:
+            if not self._injected_failure():
+                self._send(
+                    200,
+                    {
+                        "nombre": f"CONTRIBUYENTE {argument}",
+                        "tipoIdentificacion": "02" if len(argument) == 10 else "01",
+                        "regimen": {"codigo": 1, "descripcion": "Régimen General"},
+                        "situacion": {"moroso": "NO", "omiso": "NO", "estado": "Inscrito"},
+                        "actividades": [{"estado": "A", "tipo": "P", "codigo": "620100", "descripcion": "SOFTWARE"}],
+                    },
+                )
+        else:
+            self._send(404, {"message": "Not found"})
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config, verbose=False):
+        super().__init__(address, SimulatorHandler)
+        self.state = SimulatorState(config)
+        self.verbose = verbose
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+
+def start_simulator(config=None, host="127.0.0.1", port=0, verbose=False):
+    """Serve the simulator from a daemon thread; ``port=0`` picks a free port. Returns the server."""
+    server = SimulatorServer((host, port), config or SimulatorConfig(), verbose=verbose)
+    threading.Thread(target=server.serve_forever, name="hacienda-simulator", daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    defaults = SimulatorConfig()
+    parser.add_argument("--latency-median-ms", type=float, default=defaults.latency_median_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--processing-seconds", type=float, default=defaults.processing_seconds)
+    parser.add_argument("--accept-ratio", type=float, default=defaults.accept_ratio)
+    parser.add_argument("--throttle-ratio", type=float, default=defaults.throttle_ratio)
+    parser.add_argument("--server-error-ratio", type=float, default=defaults.server_error_ratio)
+    parser.add_argument("--rate-limit", type=float, default=defaults.rate_limit)
+    parser.add_argument("--retry-after-seconds", type=int, default=defaults.retry_after_seconds)
+    parser.add_argument("--token-ttl-seconds", type=int, default=defaults.token_ttl_seconds)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_arguments(arguments):
+    return SimulatorConfig(
+        latency_median_ms=arguments.latency_median_ms,
+        latency_sigma=arguments.latency_sigma,
+        processing_seconds=arguments.processing_seconds,
+        accept_ratio=arguments.accept_ratio,
+        throttle_ratio=arguments.throttle_ratio,
+        server_error_ratio=arguments.server_error_ratio,
+        rate_limit=arguments.rate_limit,
+        retry_after_seconds=arguments.retry_after_seconds,
+        token_ttl_seconds=arguments.token_ttl_seconds,
+        seed=arguments.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true")
+    add_config_arguments(parser)
+    arguments = parser.parse_args(argv)
+    server = SimulatorServer((arguments.host, arguments.port), config_from_arguments(arguments), arguments.verbose)
+    print(f"Hacienda simulator listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Load driver for the send pipeline, meant to run against :mod:`api_simulator`.
+
+Two modes:
+
+* HTTP only, without Odoo: threads post synthetic invoices to ``recepcion``
+  and poll each one until its verdict, like the module does::
+
+      python load_driver.py --documents 5000 --concurrency 64 --simulate --processing-seconds 1
+
+  ``--simulate`` starts an in-process simulator (every simulator option is
+  accepted); otherwise ``--base-url`` points to a running one.
+
+* Through the module, from ``odoo-bin shell``: documents of a throwaway
+  company (created in a savepoint that is rolled back) go through
+  ``_send_to_hacienda_bulk`` and ``_poll_hacienda_status``::
+
+      from odoo.addons.hacienda.benchmarks.load_driver import run_pipeline
+      run_pipeline(env, documents=2000, output="/tmp/hacienda_load.json")
+
+Both report end-to-end throughput (documents that reached a verdict per
+second) and the latency percentiles of the upload and of the whole round
+trip, from the upload until the verdict.
+"""
+import argparse
+import json
+import math
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .api_simulator import SimulatorConfig, add_config_arguments, config_from_arguments, start_simulator
+except ImportError:  # run as a script
+    from api_simulator import SimulatorConfig, add_config_arguments, config_from_arguments, start_simulator
+
+TERMINAL_STATES = {"aceptado", "rechazado", "error"}
+XML_TEMPLATE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica">'
+    "<Clave>{clave}</Clave><NumeroConsecutivo>{sequence}</NumeroConsecutivo>{lines}"
+    "</FacturaElectronica>"
+)
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    if not values:
+        return {f"p{point}": 0.0 for point in points} | {"max": 0.0}
+    ordered = sorted(values)
+    result = {f"p{point}": ordered[max(math.ceil(point / 100.0 * len(ordered)) - 1, 0)] for point in points}
+    result["max"] = ordered[-1]
+    return result
+
+
+def make_clave(index, prefix="506"):
+    return f"{prefix}{index:047d}"
+
+
+def synthetic_invoice(index, lines=10):
+    detail = "".join(
+        f"<LineaDetalle><NumeroLinea>{line}</NumeroLinea><Cantidad>1</Cantidad></LineaDetalle>"
+        for line in range(1, lines + 1)
+    )
+    return XML_TEMPLATE.format(clave=make_clave(index), sequence=f"{index:020d}", lines=detail).encode()
+
+
+def _round_trip(session, base_url, token, index, lines, poll_interval, timeout):
+    """Post one invoice and poll it until its verdict. Returns the timings and outcome."""
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/xml"}
+    started = time.perf_counter()
+    try:
+        response = session.post(
+            f"{base_url}recepcion", data=synthetic_invoice(index, lines), headers=headers, timeout=60
+        )
+    except Exception as exc:  # noqa: BLE001 - every failure is reported, none aborts the run
+        return {"upload": time.perf_counter() - started, "status": type(exc).__name__, "state": None}
+    upload = time.perf_counter() - started
+    if response.status_code != 202:
+        return {"upload": upload, "status": response.status_code, "state": None}
+    url = f"{base_url}recepcion/{make_clave(index)}"
+    polls = 0
+    while time.perf_counter() - started < timeout:
+        time.sleep(poll_interval)
+        polls += 1
+        try:
+            answer = session.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=30)
+        except Exception:  # noqa: BLE001
+            continue
+        state = answer.json().get("ind-estado") if answer.status_code == 200 else None
+        if state in TERMINAL_STATES:
+            return {
+                "upload": upload,
+                "status": 202,
+                "state": state,
+                "round_trip": time.perf_counter() - started,
+                "polls": polls,
+            }
+    return {"upload": upload, "status": 202, "state": "timeout", "polls": polls}
+
+
+def run_http_load(base_url, documents=1000, concurrency=32, lines=10, poll_interval=0.5, timeout=120.0):
+    """Drive ``documents`` round trips through the API at ``base_url`` and return the report."""
+    import requests
+
+    return _run_http_load(requests, base_url, documents, concurrency, lines, poll_interval, timeout)
+
+
+def _run_http_load(requests, base_url, documents, concurrency, lines, poll_interval, timeout):
+    base_url = base_url.rstrip("/") + "/"
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    token = session.post(f"{base_url}token", json={"username": "load", "password": "load"}).json()["access_token"]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(
+            executor.map(
+                lambda index: _round_trip(session, base_url, token, index, lines, poll_interval, timeout),
+                range(documents),
+            )
+        )
+    elapsed = time.perf_counter() - started
+    completed = [outcome for outcome in outcomes if "round_trip" in outcome]
+    return {
+        "mode": "http",
+        "documents": documents,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput": len(completed) / elapsed if elapsed else 0.0,
+        "statuses": dict(Counter(str(outcome["status"]) for outcome in outcomes)),
+        "states": dict(Counter(str(outcome["state"]) for outcome in outcomes)),
+        "upload_latency": percentiles([outcome["upload"] for outcome in outcomes]),
+        "round_trip_latency": percentiles([outcome["round_trip"] for outcome in completed]),
+        "polls_per_document": sum(outcome.get("polls", 0) for outcome in outcomes) / max(documents, 1),
+    }
+
+
+def run_pipeline(
+    env,
+    documents=1000,
+    batch_size=500,
+    send_workers=16,
+    poll_workers=16,
+    poll_interval=0.5,
+    timeout=600.0,
+    base_url=None,
+    simulator_config=None,
+    output=None,
+):
+    """Send ``documents`` through the module's bulk send and status poll against the simulator.
+
+    Unless ``base_url`` is given, a simulator is started in this process.
+    Everything is created in a savepoint that is rolled back at the end; the
+    payload files written meanwhile are removed as well.
+    """
+    from .xml_benchmark import _create_catalog, _create_company, _create_move
+
+    server = None
+    created_payloads = []
+    if not base_url:
+        server = start_simulator(simulator_config or SimulatorConfig())
+        base_url = server.base_url
+    cr = env.cr
+    env.flush_all()
+    cr.execute("SAVEPOINT hacienda_load_driver")
+    try:
+        bench_env, company = _create_company(env)
+        company.write(
+            {"hacienda_api_base_url": base_url, "hacienda_username": "simulador", "hacienda_password": "simulador"}
+        )
+        taxes, products, partner = _create_catalog(bench_env, company)
+        journal = bench_env["account.journal"].search(
+            [("type", "=", "sale"), ("company_id", "=", company.id)], limit=1
+        )
+        shape = {"name": "load", "lines": 1, "mixed_taxes": False, "currency": "CRC"}
+        move = _create_move(bench_env, shape, journal, taxes, products, partner)
+        template, _filename = move._generate_hacienda_xml()
+        template_clave = re.search(rb"<Clave>([^<]*)</Clave>", template).group(1)
+        contents = [template.replace(template_clave, make_clave(index).encode(), 1) for index in range(documents)]
+        payloads = bench_env["hacienda.xml.payload"]._store_payloads(contents)
+        Document = bench_env["hacienda.electronic.document"]
+        records = Document.create(
+            [
+                {
+                    "name": f"LOAD-{index:06d}",
+                    "clave": make_clave(index),
+                    "move_id": move.id,
+                    "xml_filename": f"LOAD-{index:06d}.xml",
+                    "xml_payload_id": payload.id,
+                    "state": "queued",
+                }
+                for index, payload in enumerate(payloads)
+            ]
+        )
+
+        sent_at = {}
+        verdict_at = {}
+        send_reports = []
+        started = time.perf_counter()
+        for offset in range(0, len(records), batch_size):
+            batch = records[offset:offset + batch_size]
+            batch_started = time.perf_counter()
+            send_reports.append(batch._send_to_hacienda_bulk(max_workers=send_workers))
+            sent_at.update(dict.fromkeys(batch.ids, batch_started))
+        while time.perf_counter() - started < timeout:
+            pending = records.filtered(lambda document: document.state == "sent")
+            if not pending:
+                break
+            time.sleep(poll_interval)
+            pending._poll_hacienda_status(max_workers=poll_workers)
+            now = time.perf_counter()
+            for document in pending:
+                if document.state != "sent":
+                    verdict_at[document.id] = now
+        elapsed = time.perf_counter() - started
+        round_trips = [verdict_at[document_id] - sent_at[document_id] for document_id in verdict_at]
+        attempts = bench_env["hacienda.electronic.document.attempt"].search_read(
+            [("document_id", "in", records.ids), ("kind", "=", "send")], ["request_latency"]
+        )
+        report = {
+            "mode": "pipeline",
+            "documents": documents,
+            "batch_size": batch_size,
+            "send_workers": send_workers,
+            "poll_workers": poll_workers,
+            "seconds": elapsed,
+            "throughput": len(verdict_at) / elapsed if elapsed else 0.0,
+            "send_seconds": sum(send_report["seconds"] for send_report in send_reports),
+            "states": dict(Counter(records.mapped("state"))),
+            "upload_latency": percentiles([attempt["request_latency"] for attempt in attempts]),
+            "round_trip_latency": percentiles(round_trips),
+            "simulator": server.state.stats()["counters"] if server else None,
+        }
+        # Payload rows inserted by this transaction: their files go with the rollback.
+        env.flush_all()
+        cr.execute(
+            """
+            SELECT checksum, codec
+              FROM hacienda_xml_payload
+             WHERE xmin = (txid_current() % 4294967296)::text::xid
+            """
+        )
+        created_payloads = cr.fetchall()
+    finally:
+        env.invalidate_all(flush=False)
+        cr.execute("ROLLBACK TO SAVEPOINT hacienda_load_driver")
+        env.registry.clear_cache()
+        store = env["hacienda.xml.payload"]._get_payload_store()
+        for checksum, codec in created_payloads:
+            store.delete(checksum, codec)
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    return report
+
+
+def main(argv=None):
+    import requests
+
+    parser = argparse.ArgumentParser(description="Drive synthetic invoices through a Hacienda API simulator.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8765/")
+    parser.add_argument("--simulate", action="store_true", help="Start an in-process simulator.")
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--lines", type=int, default=10)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output")
+    add_config_arguments(parser)
+    arguments = parser.parse_args(argv)
+
+    server = start_simulator(config_from_arguments(arguments)) if arguments.simulate else None
+    try:
+        report = _run_http_load(
+            requests,
+            server.base_url if server else arguments.base_url,
+            arguments.documents,
+            arguments.concurrency,
+            arguments.lines,
+            arguments.poll_interval,
+            arguments.timeout,
+        )
+        if server:
+            report["simulator"] = server.state.stats()["counters"]
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+    text = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as handle:
+            handle.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
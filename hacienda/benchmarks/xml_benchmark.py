@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the invoice XML pipeline: build, sign and serialize.
+
+Synthetic data (a company with the generic chart of accounts, a customer,
+products, taxes and one invoice per shape) is created inside a savepoint that
+is rolled back at the end, together with a throwaway self-signed certificate,
+so the benchmark can run on any database with the module installed::
+
+    odoo-bin shell -d <database> --no-http <<'EOF'
+    from odoo.addons.hacienda.benchmarks.xml_benchmark import run
+    run(env, output="/tmp/hacienda_xml_benchmark.json")
+    EOF
+
+Each shape is measured ``repeat`` times after a warm-up run. Timings of
+:meth:`_build_hacienda_xml_tree`, :meth:`_sign_hacienda_xml_tree` and
+``etree.tostring`` are reported separately (min, median, mean and max in
+seconds), with the SQL queries issued by the build and the peak of memory
+allocated by one full run. Results are returned and optionally written as
+JSON so runs of different versions can be compared.
+"""
+import base64
+import datetime
+import importlib.metadata
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+from lxml import etree
+
+from odoo import Command, fields, release
+
+from ..tools.signing import invalidate_signing_material
+
+DEFAULT_LINE_COUNTS = (1, 50, 500, 5000)
+DEFAULT_REPEAT = 5
+CERTIFICATE_PIN = "1234"
+# (cr_tax_type, cr_tax_rate, amount) of the taxes used by the synthetic lines.
+BENCHMARK_TAXES = (
+    ("01", "08", 13.0),
+    ("01", "04", 4.0),
+    ("01", "03", 2.0),
+    ("01", "02", 1.0),
+)
+MAX_PRODUCTS = 200
+
+
+def iter_shapes(line_counts=DEFAULT_LINE_COUNTS):
+    """Invoice shapes: single and mixed tax rates in colones, mixed rates in dollars."""
+    for lines in line_counts:
+        yield {"name": f"{lines}-single-CRC", "lines": lines, "mixed_taxes": False, "currency": "CRC"}
+        yield {"name": f"{lines}-mixed-CRC", "lines": lines, "mixed_taxes": True, "currency": "CRC"}
+        yield {"name": f"{lines}-mixed-USD", "lines": lines, "mixed_taxes": True, "currency": "USD"}
+
+
+def make_test_certificate(pin=CERTIFICATE_PIN):
+    """Return a PKCS#12 container holding a fresh self-signed RSA key and certificate."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, pkcs12
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Hacienda benchmark")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return pkcs12.serialize_key_and_certificates(
+        b"hacienda-benchmark", key, certificate, None, BestAvailableEncryption(pin.encode())
+    )
+
+
+def _summary(samples):
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+        "samples": len(samples),
+    }
+
+
+def _create_company(env):
+    costa_rica = env.ref("base.cr")
+    colon = env.ref("base.CRC")
+    dollar = env.ref("base.USD")
+    (colon | dollar).write({"active": True})
+    company = env["res.company"].create(
+        {
+            "name": "Hacienda Benchmark",
+            "country_id": costa_rica.id,
+            "currency_id": colon.id,
+            "hacienda_cert_key": base64.b64encode(make_test_certificate()),
+            "hacienda_certificate_pin": CERTIFICATE_PIN,
+            "hacienda_system_provider_code": "3101000000",
+            "hacienda_activity_code": "620100",
+        }
+    )
+    company.partner_id.write(
+        {
+            "email": "benchmark@example.com",
+            "phone": "+506 2222 2222",
+            "street": "Avenida Central",
+            "hacienda_identification_type": "02",
+            "hacienda_identification": "3101000000",
+        }
+    )
+    env.user.company_ids |= company
+    env = env(context=dict(env.context, allowed_company_ids=[company.id]))
+    env["account.chart.template"].try_loading("generic_coa", company=company, install_demo=False)
+    env["res.currency.rate"].create(
+        {"currency_id": dollar.id, "company_id": company.id, "name": fields.Date.today(), "rate": 1 / 510.0}
+    )
+    return env, company
+
+
+def _create_catalog(env, company):
+    taxes = env["account.tax"].create(
+        [
+            {
+                "name": f"IVA {amount:g}% (benchmark)",
+                "amount": amount,
+                "amount_type": "percent",
+                "type_tax_use": "sale",
+                "company_id": company.id,
+                "cr_tax_type": tax_type,
+                "cr_tax_rate": tax_rate,
+            }
+            for tax_type, tax_rate, amount in BENCHMARK_TAXES
+        ]
+    )
+    unit = env["hacienda.measurement.unit"].search([("code", "=", "Unid")], limit=1) or env[
+        "hacienda.measurement.unit"
+    ].create({"code": "Unid", "name": "Unidad"})
+    cabys = env["hacienda.cabys"].create(
+        [{"code": f"99{index:011d}", "name": f"Producto de prueba {index}"} for index in range(MAX_PRODUCTS)]
+    )
+    products = env["product.product"].create(
+        [
+            {
+                "name": f"Producto de prueba {index}",
+                "default_code": f"BENCH-{index:04d}",
+                "list_price": 1000.0 + index,
+                "cabys_code_id": cabys[index].id,
+                "hacienda_measurement_unit_id": unit.id,
+            }
+            for index in range(MAX_PRODUCTS)
+        ]
+    )
+    partner = env["res.partner"].create(
+        {
+            "name": "Cliente de prueba",
+            "email": "cliente@example.com",
+            "phone": "+506 8888 8888",
+            "country_id": env.ref("base.cr").id,
+            "street": "Calle 1",
+            "hacienda_identification_type": "01",
+            "hacienda_identification": "101110111",
+        }
+    )
+    return taxes, products, partner
+
+
+def _create_move(env, shape, journal, taxes, products, partner):
+    currency = env.ref(f"base.{shape['currency']}")
+    return env["account.move"].create(
+        {
+            "move_type": "out_invoice",
+            "ref": f"BENCH-{shape['name']}",
+            "partner_id": partner.id,
+            "journal_id": journal.id,
+            "currency_id": currency.id,
+            "invoice_date": fields.Date.today(),
+            "cr_sale_condition": "01",
+            "invoice_line_ids": [
+                Command.create(
+                    {
+                        "product_id": products[index % len(products)].id,
+                        "quantity": 1 + index % 7,
+                        "price_unit": 1000.0 + index,
+                        "discount": 5.0 if index % 10 == 0 else 0.0,
+                        "tax_ids": [Command.set(taxes[index % len(taxes) if shape["mixed_taxes"] else 0].ids)],
+                    }
+                )
+                for index in range(shape["lines"])
+            ],
+        }
+    )
+
+
+def _measure_shape(move, repeat):
+    """Time the three stages of ``move`` ``repeat`` times and trace one full run."""
+    env = move.env
+    emission_date = move._get_hacienda_emission_date()
+    build, sign, serialize, queries = [], [], [], []
+    size = 0
+    for iteration in range(repeat + 1):
+        env.invalidate_all()
+        queries_before = env.cr.sql_log_count
+        started = time.perf_counter()
+        unsigned = move._build_hacienda_xml_tree(emission_date)
+        built = time.perf_counter()
+        build_queries = env.cr.sql_log_count - queries_before
+        signed = move._sign_hacienda_xml_tree(unsigned)
+        signed_at = time.perf_counter()
+        xml_bytes = etree.tostring(signed, encoding="utf-8", xml_declaration=True)
+        serialized = time.perf_counter()
+        if not iteration:
+            # Warm-up: loads the signing material and fills the ORM caches.
+            continue
+        build.append(built - started)
+        sign.append(signed_at - built)
+        serialize.append(serialized - signed_at)
+        queries.append(build_queries)
+        size = len(xml_bytes)
+
+    env.invalidate_all()
+    tracemalloc.start()
+    try:
+        unsigned = move._build_hacienda_xml_tree(emission_date)
+        etree.tostring(move._sign_hacienda_xml_tree(unsigned), encoding="utf-8", xml_declaration=True)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "build": _summary(build),
+        "sign": _summary(sign),
+        "serialize": _summary(serialize),
+        "build_queries": max(queries),
+        "peak_memory_bytes": peak,
+        "xml_bytes": size,
+    }
+
+
+def run(env, line_counts=DEFAULT_LINE_COUNTS, repeat=DEFAULT_REPEAT, output=None):
+    """Run the benchmark and return its results; write them as JSON to ``output`` when given."""
+    cr = env.cr
+    results = []
+    company = None
+    env.flush_all()
+    cr.execute("SAVEPOINT hacienda_xml_benchmark")
+    try:
+        bench_env, company = _create_company(env)
+        taxes, products, partner = _create_catalog(bench_env, company)
+        journal = bench_env["account.journal"].search(
+            [("type", "=", "sale"), ("company_id", "=", company.id)], limit=1
+        )
+        for shape in iter_shapes(line_counts):
+            created = time.perf_counter()
+            move = _create_move(bench_env, shape, journal, taxes, products, partner)
+            bench_env.flush_all()
+            result = {**shape, "setup_seconds": time.perf_counter() - created}
+            result.update(_measure_shape(move, repeat))
+            results.append(result)
+    finally:
+        env.invalidate_all(flush=False)
+        cr.execute("ROLLBACK TO SAVEPOINT hacienda_xml_benchmark")
+        env.registry.clear_cache()
+        if company:
+            invalidate_signing_material(cr.dbname, [company.id])
+
+    report = {
+        "benchmark": "hacienda.xml",
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "odoo": release.version,
+        "module": env["ir.module.module"].search([("name", "=", "hacienda")]).latest_version,
+        "python": platform.python_version(),
+        "lxml": ".".join(map(str, etree.LXML_VERSION)),
+        "signxml": importlib.metadata.version("signxml"),
+        "repeat": repeat,
+        "results": results,
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    return report
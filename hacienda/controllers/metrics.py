@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import hmac
+
+from werkzeug.exceptions import Forbidden, NotFound
+
+from odoo import http
+from odoo.http import request
+
+
+class HaciendaMetricsController(http.Controller):
+    @http.route("/hacienda/metrics", type="http", auth="none", methods=["GET"], csrf=False, save_session=False)
+    def hacienda_metrics(self, token=None, **kwargs):
+        """Prometheus scrape endpoint, enabled by setting the ``hacienda.metrics_token`` parameter.
+
+        The token is accepted as a bearer ``Authorization`` header or as the
+        ``token`` query parameter.
+        """
+        if not request.db:
+            raise NotFound()
+        expected = request.env["ir.config_parameter"].sudo().get_param("hacienda.metrics_token")
+        if not expected:
+            raise NotFound()
+        authorization = request.httprequest.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            token = authorization[7:].strip()
+        if not token or not hmac.compare_digest(token.encode(), expected.encode()):
+            raise Forbidden()
+        body = request.env["hacienda.metrics"].sudo()._render_prometheus()
+        return request.make_response(body, headers=[("Content-Type", "text/plain; version=0.0.4; charset=utf-8")])
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Backfill the now stored ``account.move.hacienda_document_state``.
+
+Creating and filling the column before the registry loads keeps Odoo from
+recomputing the field move by move through the ORM on large databases.
+"""
+from odoo.tools.sql import column_exists, create_column
+
+
+def migrate(cr, version):
+    if not version or column_exists(cr, "account_move", "hacienda_document_state"):
+        return
+    create_column(cr, "account_move", "hacienda_document_state", "varchar")
+    cr.execute(
+        """
+        UPDATE account_move m
+           SET hacienda_document_state = d.state
+          FROM (
+                SELECT DISTINCT ON (move_id) move_id, state
+                  FROM hacienda_electronic_document
+                 WHERE move_id IS NOT NULL
+              ORDER BY move_id, COALESCE(response_date, create_date) DESC, id DESC
+               ) d
+         WHERE m.id = d.move_id
+        """
+    )
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Move the XML of the electronic documents from attachments to the payload store.
+
+The former ``xml_file`` and ``xml_response`` binaries were one attachment per
+document and field. Their bytes are stored as deduplicated payloads, batch by
+batch, before the attachments are removed.
+"""
+import logging
+
+from psycopg2.extras import execute_values
+
+from odoo import SUPERUSER_ID, api
+
+_logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+PAYLOAD_COLUMNS = {"xml_file": "xml_payload_id", "xml_response": "response_payload_id"}
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Attachment = env["ir.attachment"]
+    Payload = env["hacienda.xml.payload"]
+    domain = [("res_model", "=", "hacienda.electronic.document"), ("res_field", "in", list(PAYLOAD_COLUMNS))]
+    moved = 0
+    while True:
+        attachments = Attachment.search(domain, limit=BATCH_SIZE, order="id")
+        if not attachments:
+            break
+        contents = [(attachment, attachment.raw) for attachment in attachments if attachment.res_id]
+        contents = [(attachment, raw) for attachment, raw in contents if raw]
+        payloads = Payload._store_payloads([raw for _attachment, raw in contents])
+        for field_name, column in PAYLOAD_COLUMNS.items():
+            rows = [
+                (attachment.res_id, payload.id)
+                for (attachment, _raw), payload in zip(contents, payloads)
+                if attachment.res_field == field_name
+            ]
+            if rows:
+                execute_values(
+                    cr,
+                    f"UPDATE hacienda_electronic_document d SET {column} = v.payload_id "
+                    "FROM (VALUES %s) AS v(id, payload_id) WHERE d.id = v.id",
+                    rows,
+                )
+        moved += len(contents)
+        attachments.unlink()
+        env.invalidate_all()
+    _logger.info("Moved %s Hacienda XML attachments to the payload store", moved)
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""Drop the identification answers cached before they were keyed by endpoint.
+
+Their lookup endpoint is unknown, so they cannot be kept under the new
+``(endpoint, identification)`` key; they are fetched again on demand.
+"""
+from odoo.tools.sql import column_exists, table_exists
+
+
+def migrate(cr, version):
+    if not version or not table_exists(cr, "hacienda_identification_cache"):
+        return
+    if not column_exists(cr, "hacienda_identification_cache", "endpoint"):
+        cr.execute("DELETE FROM hacienda_identification_cache")
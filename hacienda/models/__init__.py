@@ -3,7 +3,17 @@ from . import account_move
 from . import account_tax
 from . import product_template
 from . import res_partner
+from . import hacienda_geo_index
+from . import res_country_state
 from . import hacienda_config
+from . import hacienda_metrics
+from . import hacienda_payload
 from . import hacienda_document
+from . import hacienda_archive
+from . import hacienda_token
+from . import hacienda_identification_cache
 from . import hacienda_catalog
+from . import hacienda_cabys_import
+from . import hacienda_cabys_suggestion
+from . import hacienda_geo_import
 from . import uom_uom
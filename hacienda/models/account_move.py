@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 import base64
 import logging
+import os
 from collections import defaultdict
 from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
 
 try:  # pragma: no cover - optional dependency provided at runtime
     from lxml import etree
@@ -12,21 +12,77 @@ except ImportError:  # pragma: no cover - we will raise a user error when needed
 
 from odoo import api, fields, models
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import str2bool
+
+from ..tools import payload_store, xml_builder, xsd_validation
+from ..tools.http_client import get_session
+from ..tools.line_aggregation import TaxInfo
+from ..tools.signing import get_signing_material
 
 _logger = logging.getLogger(__name__)
 
+# Lines rendered as LineaDetalle. Since Odoo 16 invoice product lines carry the
+# "product" display type instead of an empty one.
+HACIENDA_DETAIL_LINE_DOMAIN = [("display_type", "in", ("product", False))]
+
+HACIENDA_MOVE_FIELDS = [
+    "name",
+    "ref",
+    "company_id",
+    "partner_id",
+    "currency_id",
+    "journal_id",
+    "invoice_date",
+    "move_type",
+    "cr_sale_condition",
+    "cr_credit_term",
+    "narration",
+    "amount_untaxed",
+    "amount_tax",
+    "amount_total",
+    "invoice_line_ids",
+]
+HACIENDA_JOURNAL_FIELDS = ["cr_use_xml_44", "cr_branch_number", "cr_terminal_number", "cr_electronic_document_type"]
+HACIENDA_COMPANY_FIELDS = ["name", "partner_id", "hacienda_system_provider_code", "hacienda_activity_code"]
+HACIENDA_LINE_FIELDS = [
+    "move_id",
+    "product_id",
+    "name",
+    "quantity",
+    "product_uom_id",
+    "price_unit",
+    "discount",
+    "price_subtotal",
+    "price_total",
+    "tax_ids",
+]
+HACIENDA_PRODUCT_FIELDS = ["default_code", "display_name", "cabys_code_id", "hacienda_measurement_unit_id"]
+HACIENDA_PARTNER_FIELDS = [
+    "name",
+    "email",
+    "phone",
+    "mobile",
+    "country_id",
+    "street",
+    "street2",
+    "state_id",
+    "hacienda_canton_id",
+    "hacienda_district_id",
+    "hacienda_neighborhood_id",
+    "hacienda_identification",
+    "hacienda_identification_type",
+    "hacienda_activity_code",
+]
+
 
 class AccountMove(models.Model):
     _inherit = "account.move"
 
-    HACIENDA_XMLNS = "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica"
-    HACIENDA_SCHEMA_LOCATION = (
-        "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica "
-        "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica.xsd"
-    )
-    DS_NS = "http://www.w3.org/2000/09/xmldsig#"
-    XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
-    XADES_NS = "http://uri.etsi.org/01903/v1.3.2#"
+    HACIENDA_XMLNS = xml_builder.HACIENDA_XMLNS
+    HACIENDA_SCHEMA_LOCATION = xml_builder.HACIENDA_SCHEMA_LOCATION
+    DS_NS = xml_builder.DS_NS
+    XSI_NS = xml_builder.XSI_NS
+    XADES_NS = xml_builder.XADES_NS
     HACIENDA_DOCUMENT_TYPE_MAP = {
         "FE": "01",
         "ND": "02",
@@ -64,15 +120,22 @@ class AccountMove(models.Model):
         string="Documentos electrónicos Hacienda",
         readonly=True,
     )
+    hacienda_archive_entry_ids = fields.One2many(
+        comodel_name="hacienda.archive.entry",
+        inverse_name="move_id",
+        string="Comprobantes archivados",
+        readonly=True,
+    )
     hacienda_document_state = fields.Selection(
         selection=lambda self: self._selection_hacienda_document_state(),
         string="Estado Hacienda",
         compute="_compute_hacienda_document_state",
-        store=False,
+        store=True,
+        index=True,
     )
 
     def action_post(self):
-        """Extend post to generate and send the electronic invoice to Hacienda."""
+        """Extend post to generate the electronic invoice and queue it for Hacienda."""
         res = super().action_post()
         try:
             self._process_hacienda_electronic_document()
@@ -83,53 +146,151 @@ class AccountMove(models.Model):
             _logger.exception("Error procesando la factura electrónica para Hacienda")
         return res
 
-    def _process_hacienda_electronic_document(self):
-        """Create an electronic document, store the XML and trigger the send to Hacienda."""
+    def _process_hacienda_electronic_document(self, raise_on_error=True):
+        """Create the electronic documents, store their XML and queue them for the dispatcher.
+
+        The XML of every invoice is produced by one batch: a read phase, the
+        building and signing spread over worker processes and one write phase.
+        Returns a dict mapping the ids of the moves that failed to their error.
+
+        With ``raise_on_error`` any failure raises a ``UserError``, except
+        schema failures: the XML is not signed and its document is kept in
+        ``error`` state with the issues line by line in ``validation_errors``.
+        """
         invoices = self.filtered(lambda m: m.is_invoice(include_receipts=True))
         if not invoices:
-            return
+            return {}
+
+        results = invoices._generate_hacienda_xml_batch()
+        errors = {
+            move_id: "\n".join(filter(None, (result[2], result[3])))
+            for move_id, result in results.items()
+            if result[2]
+        }
+        # Schema issues are stored on the document below; rolling them back would lose them.
+        blocking = [error for move_id, error in errors.items() if not results[move_id][3]]
+        if blocking and raise_on_error:
+            for result in results.values():
+                if isinstance(result[0], payload_store.SpooledPayload):
+                    os.unlink(result[0].path)
+            raise UserError("\n".join(blocking))
 
         Document = self.env["hacienda.electronic.document"]
+        documents_by_move = {}
+        for document in Document.search([("move_id", "in", invoices.ids)], order="create_date desc, id desc"):
+            documents_by_move.setdefault(document.move_id.id, document)
+
+        # All the signed XML go to the payload store in one batch.
+        stored = [move_id for move_id, result in results.items() if result[0] and not result[2]]
+        payloads = self.env["hacienda.xml.payload"]._store_payloads([results[move_id][0] for move_id in stored])
+        payload_ids = dict(zip(stored, payloads.ids))
+
+        queued = failed = Document
+        to_create = []
+        to_create_failed = []
         for move in invoices:
-            xml_content, xml_filename = move._generate_hacienda_xml()
+            xml_content, xml_filename, error, validation_errors, validated = results.get(
+                move.id, (None, None, None, None, False)
+            )
+            document = documents_by_move.get(move.id)
+            if error:
+                if document:
+                    document.write({"state": "error", "message": error, "validation_errors": validation_errors})
+                    failed |= document
+                elif validation_errors:
+                    # Schema errors are kept on a document so they can be reviewed line by line.
+                    to_create_failed.append(
+                        {
+                            "name": move.name or move.ref or move._get_default_hacienda_document_name(),
+                            "clave": move._compute_hacienda_key(),
+                            "move_id": move.id,
+                            "state": "error",
+                            "message": error,
+                            "validation_errors": validation_errors,
+                        }
+                    )
+                continue
             if not xml_content:
                 continue
 
-            document = Document.search([("move_id", "=", move.id)], limit=1)
             document_values = {
                 "name": move.name or move.ref or move._get_default_hacienda_document_name(),
+                "clave": move._compute_hacienda_key(),
                 "xml_filename": xml_filename,
-                "xml_file": base64.b64encode(xml_content),
-                "state": "draft",
+                "xml_payload_id": payload_ids[move.id],
+                "state": "queued",
                 "send_date": False,
                 "message": False,
                 "response_date": False,
-                "xml_response": False,
+                "next_poll_date": False,
+                "poll_count": 0,
+                "response_payload_id": False,
                 "xml_response_filename": False,
+                "validation_errors": False,
+                "xsd_validation_skipped": not validated,
             }
             if document:
                 document.write(document_values)
+                queued |= document
             else:
                 document_values["move_id"] = move.id
-                document = Document.create(document_values)
-            document.action_send_to_hacienda()
+                to_create.append(document_values)
+        if to_create:
+            queued |= Document.create(to_create)
+        if to_create_failed:
+            failed |= Document.create(to_create_failed)
+        (failed | queued)._log_hacienda_attempt("generate")
+        self.env["hacienda.metrics"]._flush_metrics()
+        if queued:
+            Document._trigger_hacienda_dispatcher()
+        return errors
+
+    def action_regenerate_hacienda_xml(self):
+        """Rebuild, sign and queue again the XML of posted invoices, e.g. after a certificate rotation."""
+        moves = self.filtered(lambda m: m.state == "posted")
+        errors = moves._process_hacienda_electronic_document(raise_on_error=False)
+        message = f"{len(moves) - len(errors)} comprobantes regenerados y puestos en cola."
+        if errors:
+            message += f" {len(errors)} con errores."
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": "Hacienda",
+                "message": message,
+                "type": "warning" if errors else "success",
+                "sticky": bool(errors),
+            },
+        }
 
     @api.model
     def _selection_hacienda_document_state(self):
         return self.env["hacienda.electronic.document"]._fields["state"].selection
 
+    @api.depends("hacienda_document_ids.state", "hacienda_document_ids.response_date", "hacienda_archive_entry_ids")
     def _compute_hacienda_document_state(self):
-        if not self:
-            return
-        documents = self.env["hacienda.electronic.document"].search(
-            [("move_id", "in", self.ids)], order="create_date desc"
-        )
-        documents_by_move = {}
-        for document in documents:
-            documents_by_move.setdefault(document.move_id.id, document)
+        """State of the latest electronic document of the move.
+
+        Stored and indexed so invoice lists can filter and group on it in SQL;
+        existing databases are backfilled by the 19.0.1.0.2 migration.
+        Archived documents left the hot table but keep their verdict, so the
+        latest one is taken across documents and archive entries, on the date
+        of the answer of Hacienda or, without one, of the document.
+        """
         for move in self:
-            document = documents_by_move.get(move.id)
-            move.hacienda_document_state = document.state if document else False
+            candidates = [
+                ((document.response_date or document.create_date or datetime.min), 1, document.id, document.state)
+                for document in move.hacienda_document_ids
+            ] + [
+                (
+                    (entry.response_date or entry.send_date or entry.create_date or datetime.min),
+                    0,
+                    entry.id,
+                    entry.state,
+                )
+                for entry in move.hacienda_archive_entry_ids
+            ]
+            move.hacienda_document_state = max(candidates)[3] if candidates else False
 
     def _get_default_hacienda_document_name(self):
         prefix = getattr(self, "sequence_prefix", False) or "Factura-"
@@ -142,26 +303,131 @@ class AccountMove(models.Model):
     def _generate_hacienda_xml(self):
         """Build, sign and return the Hacienda XML for this invoice."""
         self.ensure_one()
+        self._check_hacienda_xml_prerequisites()
 
-        if not self.name and not self.ref:
-            raise UserError("La factura debe tener un número antes de generar el XML para Hacienda.")
+        emission_date = self._get_hacienda_emission_date()
+        unsigned_tree = self._build_hacienda_xml_tree(emission_date)
+        self._validate_hacienda_xml_tree(unsigned_tree)
+        signed_tree = self._sign_hacienda_xml_tree(unsigned_tree)
 
-        invoice_date = fields.Date.to_date(self.invoice_date or fields.Date.context_today(self))
-        emission_datetime = datetime.combine(invoice_date, datetime.min.time())
-        emission_date = fields.Datetime.context_timestamp(self, emission_datetime)
+        xml_bytes = etree.tostring(signed_tree, encoding="utf-8", xml_declaration=True)
+        return xml_bytes, self._get_hacienda_xml_filename()
+
+    def _generate_hacienda_xml_batch(self):
+        """Build and sign the XML of every move in ``self``.
+
+        Only the snapshot extraction uses the ORM; building, signing and
+        serializing run in this process unless ``hacienda.xml_workers`` opts
+        into a pool of that many forked processes (capped, see
+        :func:`..tools.xml_builder.generate_signed_xml_batch`), used once the
+        batch reaches ``hacienda.xml_parallel_threshold`` moves. Trees are
+        validated against the XSD before signing. Invoices with at least
+        ``hacienda.xml_streaming_threshold`` lines (0 disables it) are written
+        piece by piece to the spool of the payload store and their XML comes
+        as a :class:`~..tools.payload_store.SpooledPayload`.
+        Returns ``{move_id: (xml_bytes, filename, error, validation_errors,
+        validated)}``, ``validated`` telling whether a schema checked the XML.
+        """
+        results = {}
+        jobs = []
+        signing_by_company = {}
+        xsd_directory = self._get_hacienda_xsd_directory()
+        params = self.env["ir.config_parameter"].sudo()
+        streaming_threshold = int(params.get_param("hacienda.xml_streaming_threshold", 2000) or 0)
+        spool_directory = self.env["hacienda.xml.payload"]._get_payload_store().spool_directory
+        metrics = self.env["hacienda.metrics"]._get_metrics_registry()
+        with metrics.span("prefetch", self.company_id.id if len(self.company_id) == 1 else None, moves=len(self)):
+            prefetch = self._prefetch_hacienda_xml_values()
+        for move in self:
+            try:
+                move._check_hacienda_xml_prerequisites()
+                company = move.company_id
+                if company.id not in signing_by_company:
+                    signing_by_company[company.id] = move._get_hacienda_signing_arguments()
+                data = move._prepare_hacienda_xml_data(move._get_hacienda_emission_date(), prefetch)
+            except UserError as exc:
+                results[move.id] = (None, None, str(exc), None, False)
+                continue
+            streamed = streaming_threshold and len(data["lines"]) >= streaming_threshold
+            jobs.append((data, signing_by_company[company.id], xsd_directory, streamed and spool_directory))
+
+        # Forking an Odoo worker per core on every posting is opt-in.
+        workers = int(params.get_param("hacienda.xml_workers", 1) or 1)
+        threshold = int(params.get_param("hacienda.xml_parallel_threshold", 50) or 0)
+        if len(jobs) < threshold:
+            workers = 1
+
+        filenames = {move.id: move._get_hacienda_xml_filename() for move in self if move.id not in results}
+        companies = {move.id: move.company_id.id for move in self}
+        batch = xml_builder.generate_signed_xml_batch(jobs, workers)
+        for move_id, xml_bytes, error, timings, validation_errors in batch:
+            results[move_id] = (
+                xml_bytes,
+                filenames[move_id] if xml_bytes else None,
+                error,
+                validation_errors,
+                "validate" in timings,
+            )
+            last_stage = list(timings)[-1] if timings else None
+            for stage, seconds in timings.items():
+                outcome = "error" if error and stage == last_stage else "ok"
+                metrics.observe(stage, seconds, companies[move_id], outcome, move_id=move_id)
+        return results
+
+    @api.model
+    def _get_hacienda_xsd_directory(self):
+        """Directory of the XSD files used before signing, or False when ``hacienda.xsd_validation`` is off."""
+        params = self.env["ir.config_parameter"].sudo()
+        if not str2bool(params.get_param("hacienda.xsd_validation", "True"), True):
+            return False
+        return params.get_param("hacienda.xsd_directory") or self._get_default_hacienda_xsd_directory()
 
+    @api.model
+    def _get_default_hacienda_xsd_directory(self):
+        """Filestore copy of the schemas, kept up to date by :meth:`_cron_sync_hacienda_xsd`."""
+        return os.path.join(self.env["ir.attachment"]._filestore(), "hacienda_xsd", "v4.4")
+
+    @api.model
+    def _cron_sync_hacienda_xsd(self):
+        """Download the Hacienda schemas missing from the validation directory.
+
+        Runs daily, so a failed download (no network, CDN down) is retried,
+        but not on install, which an offline server would slow down. Does
+        nothing once every schema is there.
+        """
+        directory = self._get_hacienda_xsd_directory()
+        if directory is False:
+            return
+        added = xsd_validation.download_schemas(directory, get_session(self.env))
+        if added:
+            _logger.info("Esquemas XSD de Hacienda agregados en %s: %s", directory, ", ".join(added))
+
+    def _validate_hacienda_xml_tree(self, root):
+        xsd_directory = self._get_hacienda_xsd_directory()
+        if xsd_directory is False:
+            return
+        issues = xsd_validation.validate_tree(root, xsd_directory)
+        if issues:
+            raise UserError(
+                "El XML no cumple el esquema XSD de Hacienda.\n" + xsd_validation.format_issues(issues)
+            )
+
+    def _check_hacienda_xml_prerequisites(self):
+        if not self.name and not self.ref:
+            raise UserError("La factura debe tener un número antes de generar el XML para Hacienda.")
         if etree is None:
             raise UserError(
                 "No se pudo generar el XML para Hacienda porque falta la librería 'lxml'. "
                 "Instálela en el entorno de Odoo."
             )
 
-        unsigned_tree = self._build_hacienda_xml_tree(emission_date)
-        signed_tree = self._sign_hacienda_xml_tree(unsigned_tree)
+    def _get_hacienda_emission_date(self):
+        invoice_date = fields.Date.to_date(self.invoice_date or fields.Date.context_today(self))
+        emission_datetime = datetime.combine(invoice_date, datetime.min.time())
+        return fields.Datetime.context_timestamp(self, emission_datetime)
 
-        xml_bytes = etree.tostring(signed_tree, encoding="utf-8", xml_declaration=True)
-        filename = f"{(self.name or self.ref).replace('/', '-')}.xml"
-        return xml_bytes, filename
+    def _get_hacienda_xml_filename(self):
+        return f"{(self.name or self.ref).replace('/', '-')}.xml"
 
     def _compute_hacienda_key(self):
         return (self.name or self.ref or "00000000000000000000").replace("/", "")[:50]
@@ -219,255 +485,243 @@ class AccountMove(models.Model):
         return doc_code
 
     def _build_hacienda_xml_tree(self, emission_date):
-        nsmap = {
-            None: self.HACIENDA_XMLNS,
-            "ds": self.DS_NS,
-            "xsi": self.XSI_NS,
-            "xades": self.XADES_NS,
+        return xml_builder.build_invoice_tree(self._prepare_hacienda_xml_data(emission_date))
+
+    def _prefetch_hacienda_xml_values(self):
+        """Load everything the XML snapshots of ``self`` need in a fixed number of queries.
+
+        Returns ``{model_name: {record_id: values}}`` as produced by
+        ``read(load=None)``, plus a ``tax_table`` mapping tax ids to their
+        :class:`TaxInfo` and the cached ``geo`` index of locations; the number
+        of queries does not depend on how many moves, lines or partners are
+        involved.
+        """
+
+        def read(model, ids, fnames):
+            records = self.env[model].browse(sorted({record_id for record_id in ids if record_id}))
+            if not records:
+                return {}
+            fnames = [fname for fname in fnames if fname in records._fields]
+            return {values["id"]: values for values in records.read(fnames, load=None)}
+
+        move_fields = [fname for fname in HACIENDA_MOVE_FIELDS + ["currency_rate"] if fname in self._fields]
+        moves = {values["id"]: values for values in self.read(move_fields, load=None)}
+        companies = read("res.company", [m["company_id"] for m in moves.values()], HACIENDA_COMPANY_FIELDS)
+        lines = self.env["account.move.line"].search_read(
+            [("move_id", "in", self.ids)] + HACIENDA_DETAIL_LINE_DOMAIN, HACIENDA_LINE_FIELDS, load=None
+        )
+        lines = {values["id"]: values for values in lines}
+        products = read("product.product", [l["product_id"] for l in lines.values()], HACIENDA_PRODUCT_FIELDS)
+        partners = read(
+            "res.partner",
+            [m["partner_id"] for m in moves.values()] + [c["partner_id"] for c in companies.values()],
+            HACIENDA_PARTNER_FIELDS,
+        )
+        payments = self.env["hacienda.move.payment.method"].search_read(
+            [("move_id", "in", self.ids)], ["move_id", "code", "amount", "description"], load=None
+        )
+        geo = self.env["hacienda.geo.index"]._get_geo_index()
+        tax_fields = ["cr_tax_type", "cr_tax_rate", "amount", "amount_type", "children_tax_ids"]
+        taxes = read("account.tax", [tax_id for line in lines.values() for tax_id in line["tax_ids"]], tax_fields)
+        # Groups are computed as their children, which are the taxes reported to Hacienda.
+        children = [
+            child_id for tax in taxes.values() if tax["amount_type"] == "group" for child_id in tax["children_tax_ids"]
+        ]
+        if children:
+            taxes.update(read("account.tax", children, tax_fields))
+        return {
+            "account.move": moves,
+            # Read for the consecutive number helpers, which use the journal records.
+            "account.journal": read(
+                "account.journal", [m["journal_id"] for m in moves.values()], HACIENDA_JOURNAL_FIELDS
+            ),
+            "account.move.line": lines,
+            "res.company": companies,
+            "res.partner": partners,
+            "product.product": products,
+            "hacienda.move.payment.method": payments,
+            "res.currency": read(
+                "res.currency", [m["currency_id"] for m in moves.values()], ["name", "decimal_places", "rate"]
+            ),
+            "hacienda.cabys": read("hacienda.cabys", [p["cabys_code_id"] for p in products.values()], ["code"]),
+            "hacienda.measurement.unit": read(
+                "hacienda.measurement.unit", [p["hacienda_measurement_unit_id"] for p in products.values()], ["code"]
+            ),
+            "uom.uom": read("uom.uom", [l["product_uom_id"] for l in lines.values()], ["name"]),
+            "account.tax": taxes,
+            "tax_table": {
+                tax_id: TaxInfo(tax["cr_tax_type"] or "", tax["cr_tax_rate"] or "", tax["amount"] or 0.0)
+                for tax_id, tax in taxes.items()
+            },
+            "line_tax_amounts": self._get_hacienda_line_tax_amounts(moves, lines, taxes),
+            "res.country": read("res.country", [p["country_id"] for p in partners.values()], ["phone_code"]),
+            "geo": geo,
+            # Only states outside the Costa Rican index (foreign customers) are read.
+            "res.country.state": read(
+                "res.country.state",
+                [p["state_id"] for p in partners.values() if geo.code("province", p["state_id"]) is None],
+                ["code", "name"],
+            ),
         }
-        root = etree.Element("FacturaElectronica", nsmap=nsmap)
-        root.set(etree.QName(self.XSI_NS, "schemaLocation"), self.HACIENDA_SCHEMA_LOCATION)
-
-        self._append_header(root, emission_date)
-        self._append_emitter(root)
-        self._append_receiver(root)
-        self._append_sale_condition(root)
-        self._append_invoice_lines(root)
-        self._append_summary(root)
-        self._append_other_information(root)
-        return root
-
-    def _append_header(self, root, emission_date):
-        etree.SubElement(root, "Clave").text = self._compute_hacienda_key()
-        company = self.company_id
-        if company.hacienda_system_provider_code:
-            etree.SubElement(root, "ProveedorSistemas").text = company.hacienda_system_provider_code
-        if company.hacienda_activity_code:
-            etree.SubElement(root, "CodigoActividadEmisor").text = company.hacienda_activity_code
-        partner_activity = self.partner_id.hacienda_activity_code
-        if partner_activity:
-            etree.SubElement(root, "CodigoActividadReceptor").text = partner_activity
-        etree.SubElement(root, "NumeroConsecutivo").text = self._compute_hacienda_sequence()
-        etree.SubElement(root, "FechaEmision").text = self._format_datetime_with_timezone(emission_date)
-
-    def _append_emitter(self, root):
-        company = self.company_id
-        partner = company.partner_id
-        emisor = etree.SubElement(root, "Emisor")
-        etree.SubElement(emisor, "Nombre").text = partner.name or company.name or ""
-        self._append_identification(emisor, partner)
-        if company.name and company.name != partner.name:
-            etree.SubElement(emisor, "NombreComercial").text = company.name
-        self._append_location(emisor, partner)
-        self._append_phone(emisor, partner)
-        if partner.email:
-            etree.SubElement(emisor, "CorreoElectronico").text = partner.email
-
-    def _append_receiver(self, root):
-        partner = self.partner_id
-        receptor = etree.SubElement(root, "Receptor")
-        etree.SubElement(receptor, "Nombre").text = partner.name or ""
-        self._append_identification(receptor, partner)
-        self._append_location(receptor, partner)
-        self._append_phone(receptor, partner)
-        if partner.email:
-            etree.SubElement(receptor, "CorreoElectronico").text = partner.email
-
-    def _append_identification(self, node, partner):
-        if not partner.hacienda_identification:
-            return
-        identificacion = etree.SubElement(node, "Identificacion")
-        etree.SubElement(identificacion, "Tipo").text = partner.hacienda_identification_type or ""
-        etree.SubElement(identificacion, "Numero").text = partner.hacienda_identification
 
-    def _append_location(self, node, partner):
+    def _get_hacienda_line_tax_amounts(self, moves, lines, taxes):
+        """Amount of each tax of the lines whose tax total cannot be split by rate.
+
+        Several taxes on a line may be fixed amounts, included in the price or
+        part of the base of the next ones, and a group stands for its
+        children. The amounts of those lines come from ``compute_all``, with
+        one recordset per distinct set of taxes of the batch. Lines with a
+        single plain tax are left to the split of
+        :func:`..tools.line_aggregation.split_tax_amount`.
+        Returns ``{line_id: [(tax_id, amount), ...]}``.
+        """
+        by_tax_set = defaultdict(list)
+        for line in lines.values():
+            tax_ids = tuple(line["tax_ids"])
+            if len(tax_ids) > 1 or any(taxes[tax_id]["amount_type"] == "group" for tax_id in tax_ids):
+                by_tax_set[tax_ids].append(line)
+        if not by_tax_set:
+            return {}
+        # Browsed together, the taxes of every set share one prefetch.
+        all_taxes = self.env["account.tax"].browse({tax_id for tax_ids in by_tax_set for tax_id in tax_ids})
+        amounts = {}
+        for tax_ids, tax_lines in by_tax_set.items():
+            tax_set = all_taxes.browse(tax_ids)
+            for line in tax_lines:
+                move = moves[line["move_id"]]
+                result = tax_set.compute_all(
+                    (line["price_unit"] or 0.0) * (1 - (line["discount"] or 0.0) / 100.0),
+                    currency=self.env["res.currency"].browse(move["currency_id"]),
+                    quantity=line["quantity"] or 0.0,
+                    product=self.env["product.product"].browse(line["product_id"]),
+                    partner=self.env["res.partner"].browse(move["partner_id"]),
+                    is_refund=move["move_type"] in ("out_refund", "in_refund"),
+                )
+                amounts[line["id"]] = [(tax["id"], tax["amount"]) for tax in result["taxes"]]
+        return amounts
+
+    def _prepare_hacienda_xml_data(self, emission_date, prefetch=None):
+        """Extract the plain data snapshot consumed by :mod:`..tools.xml_builder`.
+
+        ``prefetch`` is the result of :meth:`_prefetch_hacienda_xml_values` for a
+        recordset containing ``self``; batches compute it once for all moves.
+        """
+        self.ensure_one()
+        if prefetch is None:
+            prefetch = self._prefetch_hacienda_xml_values()
+        move = prefetch["account.move"][self.id]
+        company = prefetch["res.company"][move["company_id"]]
+        company_partner = prefetch["res.partner"].get(company["partner_id"]) or {}
+        partner = prefetch["res.partner"].get(move["partner_id"]) or {}
+        currency = prefetch["res.currency"].get(move["currency_id"])
+        lines = prefetch["account.move.line"]
+        return {
+            "move_id": self.id,
+            "key": self._compute_hacienda_key(),
+            "provider_code": company["hacienda_system_provider_code"] or False,
+            "activity_code": company["hacienda_activity_code"] or False,
+            "receiver_activity_code": partner.get("hacienda_activity_code") or False,
+            "sequence": self._compute_hacienda_sequence(),
+            "emission_date": self._format_datetime_with_timezone(emission_date),
+            "emitter": self._prepare_hacienda_party_data(
+                prefetch,
+                company_partner,
+                company_partner.get("name") or company["name"] or "",
+                company["name"] if company["name"] and company["name"] != company_partner.get("name") else False,
+            ),
+            "receiver": self._prepare_hacienda_party_data(prefetch, partner, partner.get("name") or ""),
+            "sale_condition": move["cr_sale_condition"] or "01",
+            "credit_term": move["cr_credit_term"],
+            "currency": {
+                "name": currency["name"],
+                "decimal_places": currency["decimal_places"],
+                "rate": move.get("currency_rate") or currency["rate"],
+            }
+            if currency
+            else False,
+            "lines": [
+                self._prepare_hacienda_line_data(prefetch, lines[line_id])
+                for line_id in move["invoice_line_ids"]
+                if line_id in lines
+            ],
+            "amount_untaxed": move["amount_untaxed"],
+            "amount_tax": move["amount_tax"],
+            "amount_total": move["amount_total"],
+            "payments": [
+                {"code": payment["code"], "amount": payment["amount"], "description": payment["description"]}
+                for payment in prefetch["hacienda.move.payment.method"]
+                if payment["move_id"] == self.id
+            ],
+            "narration": move["narration"] or False,
+            "taxes": prefetch["tax_table"],
+        }
+
+    def _prepare_hacienda_party_data(self, prefetch, partner, name, commercial_name=False):
+        country = prefetch["res.country"].get(partner.get("country_id")) or {}
+        phone_code, phone_number = self._get_partner_phone_components(
+            partner.get("phone") or partner.get("mobile") or "", country.get("phone_code")
+        )
+        identification = False
+        if partner.get("hacienda_identification"):
+            identification = {
+                "type": partner["hacienda_identification_type"] or "",
+                "number": partner["hacienda_identification"],
+            }
+        return {
+            "name": name,
+            "commercial_name": commercial_name,
+            "identification": identification,
+            "location": self._prepare_hacienda_location_data(prefetch, partner),
+            "phone": (phone_code, phone_number) if phone_number else False,
+            "email": partner.get("email") or False,
+        }
+
+    def _prepare_hacienda_location_data(self, prefetch, partner):
         if not (
-            partner.state_id
-            or partner.hacienda_canton_id
-            or partner.hacienda_district_id
-            or partner.hacienda_neighborhood_id
-            or partner.street
-            or partner.street2
+            partner.get("state_id")
+            or partner.get("hacienda_canton_id")
+            or partner.get("hacienda_district_id")
+            or partner.get("hacienda_neighborhood_id")
+            or partner.get("street")
+            or partner.get("street2")
         ):
-            return
-        ubicacion = etree.SubElement(node, "Ubicacion")
-        if partner.state_id:
-            etree.SubElement(ubicacion, "Provincia").text = self._clean_numeric_code(
-                partner.state_id.code or partner.state_id.name
-            )
-        if partner.hacienda_canton_id:
-            etree.SubElement(ubicacion, "Canton").text = self._clean_numeric_code(partner.hacienda_canton_id.code)
-        if partner.hacienda_district_id:
-            etree.SubElement(ubicacion, "Distrito").text = self._clean_numeric_code(partner.hacienda_district_id.code)
-        if partner.hacienda_neighborhood_id:
-            etree.SubElement(ubicacion, "Barrio").text = self._clean_numeric_code(partner.hacienda_neighborhood_id.code)
-        other_address = ", ".join(filter(None, [partner.street, partner.street2]))
-        if other_address:
-            etree.SubElement(ubicacion, "OtrasSenas").text = other_address
-
-    def _append_phone(self, node, partner):
-        phone_code, phone_number = self._get_partner_phone_components(partner)
-        if not phone_number:
-            return
-        telefono = etree.SubElement(node, "Telefono")
-        etree.SubElement(telefono, "CodigoPais").text = phone_code
-        etree.SubElement(telefono, "NumTelefono").text = phone_number
-
-    def _append_sale_condition(self, root):
-        condition = self.cr_sale_condition or "01"
-        etree.SubElement(root, "CondicionVenta").text = condition
-        if condition in {"02", "10"} and self.cr_credit_term:
-            etree.SubElement(root, "PlazoCredito").text = str(int(self.cr_credit_term))
-
-    def _append_invoice_lines(self, root):
-        detalle = etree.SubElement(root, "DetalleServicio")
-        currency = self.currency_id
-        lines = self.invoice_line_ids.filtered(lambda l: not l.display_type)
-        for index, line in enumerate(lines, start=1):
-            linea = etree.SubElement(detalle, "LineaDetalle")
-            etree.SubElement(linea, "NumeroLinea").text = str(index)
-            product = line.product_id
-            if product and product.cabys_code_id:
-                etree.SubElement(linea, "CodigoCABYS").text = product.cabys_code_id.code
-            if product and product.default_code:
-                codigo_comercial = etree.SubElement(linea, "CodigoComercial")
-                etree.SubElement(codigo_comercial, "Tipo").text = "01"
-                etree.SubElement(codigo_comercial, "Codigo").text = product.default_code
-            etree.SubElement(linea, "Cantidad").text = self._format_decimal(line.quantity, digits=5)
-            unidad = (
-                product.hacienda_measurement_unit_id.code
-                if product and product.hacienda_measurement_unit_id
-                else (line.product_uom_id and line.product_uom_id.name) or "Unid"
-            )
-            etree.SubElement(linea, "UnidadMedida").text = unidad
-            description = line.name or (product.display_name if product else "")
-            etree.SubElement(linea, "Detalle").text = description
-            etree.SubElement(linea, "PrecioUnitario").text = self._format_decimal(line.price_unit, currency)
-            line_total = (line.quantity or 0.0) * (line.price_unit or 0.0)
-            etree.SubElement(linea, "MontoTotal").text = self._format_decimal(line_total, currency)
-            discount_rate = (line.discount or 0.0) / 100.0
-            discount_amount = line_total * discount_rate
-            etree.SubElement(linea, "MontoDescuento").text = self._format_decimal(discount_amount, currency)
-            etree.SubElement(linea, "SubTotal").text = self._format_decimal(line.price_subtotal, currency)
-            etree.SubElement(linea, "BaseImponible").text = self._format_decimal(line.price_subtotal, currency)
-            tax_amount = line.price_total - line.price_subtotal
-            if tax_amount or line.tax_ids:
-                impuestos = etree.SubElement(linea, "Impuesto")
-                tax = line.tax_ids[:1]
-                etree.SubElement(impuestos, "Codigo").text = (tax.cr_tax_type if tax else "00") or "00"
-                if tax and tax.cr_tax_rate:
-                    etree.SubElement(impuestos, "CodigoTarifaIVA").text = tax.cr_tax_rate
-                if tax:
-                    etree.SubElement(impuestos, "Tarifa").text = self._format_decimal(tax.amount, digits=2)
-                etree.SubElement(impuestos, "Monto").text = self._format_decimal(tax_amount, currency)
-            etree.SubElement(linea, "ImpuestoAsumidoEmisorFabrica").text = "0"
-            etree.SubElement(linea, "ImpuestoNeto").text = self._format_decimal(tax_amount, currency)
-            etree.SubElement(linea, "MontoTotalLinea").text = self._format_decimal(line.price_total, currency)
-
-    def _append_summary(self, root):
-        resumen = etree.SubElement(root, "ResumenFactura")
-        currency = self.currency_id
-        if currency:
-            codigo_tipo_moneda = etree.SubElement(resumen, "CodigoTipoMoneda")
-            etree.SubElement(codigo_tipo_moneda, "CodigoMoneda").text = currency.name or "CRC"
-            currency_rate = getattr(self, "currency_rate", False) or (currency.rate if currency else 1.0)
-            etree.SubElement(codigo_tipo_moneda, "TipoCambio").text = self._format_decimal(currency_rate or 1.0)
-        taxable, exempt = self._compute_taxable_and_exempt_amounts()
-        etree.SubElement(resumen, "TotalServGravados").text = self._format_decimal(taxable, currency)
-        etree.SubElement(resumen, "TotalServExentos").text = self._format_decimal(exempt, currency)
-        etree.SubElement(resumen, "TotalServExonerado").text = self._format_decimal(0.0, currency)
-        etree.SubElement(resumen, "TotalServNoSujeto").text = self._format_decimal(0.0, currency)
-        etree.SubElement(resumen, "TotalMercanciasGravadas").text = self._format_decimal(0.0, currency)
-        etree.SubElement(resumen, "TotalMercanciasExentas").text = self._format_decimal(0.0, currency)
-        etree.SubElement(resumen, "TotalMercExonerada").text = self._format_decimal(0.0, currency)
-        etree.SubElement(resumen, "TotalMercNoSujeta").text = self._format_decimal(0.0, currency)
-        etree.SubElement(resumen, "TotalGravado").text = self._format_decimal(taxable, currency)
-        etree.SubElement(resumen, "TotalExento").text = self._format_decimal(exempt, currency)
-        etree.SubElement(resumen, "TotalExonerado").text = self._format_decimal(0.0, currency)
-        total_discounts = self._compute_total_discounts()
-        etree.SubElement(resumen, "TotalVenta").text = self._format_decimal(
-            self.amount_untaxed + total_discounts, currency
-        )
-        etree.SubElement(resumen, "TotalDescuentos").text = self._format_decimal(total_discounts, currency)
-        etree.SubElement(resumen, "TotalVentaNeta").text = self._format_decimal(self.amount_untaxed, currency)
-        etree.SubElement(resumen, "TotalImpuesto").text = self._format_decimal(self.amount_tax, currency)
-        etree.SubElement(resumen, "TotalImpAsumEmisorFabrica").text = self._format_decimal(0.0, currency)
-        etree.SubElement(resumen, "TotalIVADevuelto").text = self._format_decimal(0.0, currency)
-        self._append_tax_breakdown(resumen, currency)
-        self._append_payment_methods(resumen, currency)
-        etree.SubElement(resumen, "TotalComprobante").text = self._format_decimal(self.amount_total, currency)
-
-    def _append_tax_breakdown(self, resumen, currency):
-        breakdown = defaultdict(lambda: Decimal("0.0"))
-        for line in self.invoice_line_ids.filtered(lambda l: not l.display_type):
-            if not line.tax_ids:
-                continue
-            price_unit = (line.price_unit or 0.0) * (1 - (line.discount or 0.0) / 100.0)
-            tax_data = line.tax_ids.compute_all(
-                price_unit,
-                currency=self.currency_id,
-                quantity=line.quantity,
-                product=line.product_id,
-                partner=self.partner_id,
-                is_refund=self.move_type in {"out_refund", "in_refund"},
-            )
-            for tax_result in tax_data.get("taxes", []):
-                tax = self.env["account.tax"].browse(tax_result.get("id"))
-                key = (tax.cr_tax_type or "", tax.cr_tax_rate or "")
-                breakdown[key] += Decimal(str(tax_result.get("amount", 0.0)))
-
-        for (tax_code, rate_code), amount in breakdown.items():
-            desglose = etree.SubElement(resumen, "TotalDesgloseImpuesto")
-            if tax_code:
-                etree.SubElement(desglose, "Codigo").text = tax_code
-            if rate_code:
-                etree.SubElement(desglose, "CodigoTarifaIVA").text = rate_code
-            etree.SubElement(desglose, "TotalMontoImpuesto").text = self._format_decimal(amount, currency)
-
-    def _append_payment_methods(self, resumen, currency):
-        for payment in self.cr_payment_method_line_ids:
-            medio = etree.SubElement(resumen, "MedioPago")
-            etree.SubElement(medio, "TipoMedioPago").text = payment.code
-            if payment.amount:
-                etree.SubElement(medio, "MontoPago").text = self._format_decimal(payment.amount, currency)
-            if payment.description:
-                etree.SubElement(medio, "DetallePago").text = payment.description
-
-    def _append_other_information(self, root):
-        if not self.narration:
-            return
-        otros = etree.SubElement(root, "Otros")
-        etree.SubElement(otros, "OtroTexto").text = self.narration
+            return False
+        geo = prefetch["geo"]
+
+        def location_code(level, record_id):
+            # Local codes ("03") when the hierarchy is known, else the stored code.
+            return geo.local_code(level, record_id) or self._clean_numeric_code(geo.code(level, record_id))
+
+        province = location_code("province", partner["state_id"])
+        if not province:
+            state = prefetch["res.country.state"].get(partner["state_id"])
+            province = self._clean_numeric_code(state["code"] or state["name"]) if state else ""
+        return {
+            "province": province,
+            "canton": location_code("canton", partner["hacienda_canton_id"]),
+            "district": location_code("district", partner["hacienda_district_id"]),
+            "neighborhood": location_code("neighborhood", partner["hacienda_neighborhood_id"]),
+            "other": ", ".join(filter(None, [partner["street"], partner["street2"]])),
+        }
 
-    def _compute_total_discounts(self):
-        total = sum(
-            line.price_unit * line.quantity * (line.discount or 0.0) / 100.0
-            for line in self.invoice_line_ids.filtered(lambda l: not l.display_type)
-        )
-        return total
-
-    def _compute_taxable_and_exempt_amounts(self):
-        taxable = 0.0
-        exempt = 0.0
-        for line in self.invoice_line_ids.filtered(lambda l: not l.display_type):
-            if line.tax_ids:
-                taxable += line.price_subtotal
-            else:
-                exempt += line.price_subtotal
-        return taxable, exempt
-
-    def _format_decimal(self, value, currency=None, digits=None):
-        if value is None:
-            value = 0.0
-        if isinstance(value, Decimal):
-            decimal_value = value
-        else:
-            decimal_value = Decimal(str(value))
-        if digits is None:
-            digits = currency.decimal_places if currency and currency.decimal_places is not None else 5
-        quantize_pattern = Decimal("1") if digits == 0 else Decimal("1." + "0" * digits)
-        quantized = decimal_value.quantize(quantize_pattern, rounding=ROUND_HALF_UP)
-        return f"{quantized:.{digits}f}"
+    def _prepare_hacienda_line_data(self, prefetch, line):
+        product = prefetch["product.product"].get(line["product_id"])
+        cabys = product and prefetch["hacienda.cabys"].get(product["cabys_code_id"])
+        unit = product and prefetch["hacienda.measurement.unit"].get(product["hacienda_measurement_unit_id"])
+        uom = prefetch["uom.uom"].get(line["product_uom_id"])
+        return {
+            "cabys_code": cabys["code"] if cabys else False,
+            "default_code": product["default_code"] if product else False,
+            "quantity": line["quantity"],
+            "unit": unit["code"] if unit else (uom and uom["name"]) or "Unid",
+            "description": line["name"] or (product["display_name"] if product else ""),
+            "price_unit": line["price_unit"],
+            "discount": line["discount"],
+            "price_subtotal": line["price_subtotal"],
+            "price_total": line["price_total"],
+            "tax_ids": line["tax_ids"],
+            "tax_amounts": prefetch["line_tax_amounts"].get(line["id"]),
+        }
 
     def _format_datetime_with_timezone(self, dt):
         if not dt:
@@ -484,10 +738,9 @@ class AccountMove(models.Model):
         digits = "".join(ch for ch in str(value) if ch.isdigit())
         return digits or str(value)
 
-    def _get_partner_phone_components(self, partner):
-        phone = partner.phone or partner.mobile or ""
-        digits = "".join(ch for ch in phone if ch.isdigit())
-        country_code = partner.country_id and partner.country_id.phone_code or "506"
+    def _get_partner_phone_components(self, phone, country_code):
+        digits = "".join(ch for ch in (phone or "") if ch.isdigit())
+        country_code = country_code or "506"
         if digits.startswith("00"):
             digits = digits.lstrip("0")
         if country_code and digits.startswith(str(country_code)):
@@ -500,66 +753,54 @@ class AccountMove(models.Model):
         return str(country_code or "506"), local_number
 
     def _sign_hacienda_xml_tree(self, root):
-        company = self.company_id
-        if not company.hacienda_cert_key or not company.hacienda_certificate_pin:
-            raise UserError(
-                "Debe cargar la llave criptográfica y el PIN del certificado en Ajustes > Hacienda para firmar el XML."
-            )
-
         try:  # pragma: no cover - heavy dependency handled at runtime
-            from signxml import DigestAlgorithm, methods, xades
+            import signxml  # noqa: F401
         except ImportError as exc:  # pragma: no cover
             raise UserError(
                 "No se pudo firmar el XML. Instale la librería de Python 'signxml' en el entorno de Odoo."
             ) from exc
 
         try:  # pragma: no cover - handled at runtime
-            from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, pkcs12
+            from cryptography.hazmat.primitives.serialization import pkcs12  # noqa: F401
         except ImportError as exc:
             raise UserError(
                 "No se pudo firmar el XML. Instale la librería de Python 'cryptography' en el entorno de Odoo."
             ) from exc
 
         try:
-            p12_bytes = base64.b64decode(company.hacienda_cert_key)
-            private_key, cert, additional = pkcs12.load_key_and_certificates(
-                p12_bytes, (company.hacienda_certificate_pin or "").encode()
-            )
+            material = get_signing_material(*self._get_hacienda_signing_arguments())
+        except UserError:
+            raise
         except Exception as exc:  # pragma: no cover - depends on runtime certificates
             raise UserError(
                 "No se pudo leer el certificado criptográfico. Verifique que el archivo sea válido y el PIN sea correcto."
             ) from exc
 
-        if not private_key or not cert:
+        if material is None:
             raise UserError("El certificado proporcionado no contiene una llave privada válida.")
 
-        key_pem = private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
-        cert_chain = [cert.public_bytes(Encoding.PEM)]
-        if additional:
-            cert_chain.extend(c.public_bytes(Encoding.PEM) for c in additional if c)
-
-        signer = xades.XAdESSigner(
-            method=methods.enveloped,
-            signature_algorithm="rsa-sha256",
-            digest_algorithm="sha256",
-            c14n_algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315",
-            signature_policy=xades.XAdESSignaturePolicy(
-                Identifier=self.HACIENDA_XMLNS,
-                Description="",
-                DigestMethod=DigestAlgorithm.SHA1,
-                DigestValue="Ohixl6upD6av8N7pEvDABhEL6hM=",
-            ),
-            claimed_roles=["ObligadoTributario"],
-            data_object_format=xades.XAdESDataObjectFormat(Description="", MimeType="text/xml"),
-        )
-
         try:
-            signed_root = signer.sign(root, key=key_pem, cert=cert_chain, reference_uri="")
+            signed_root = material.sign(root)
         except Exception as exc:  # pragma: no cover - signing failures depend on runtime data
             raise UserError("Ocurrió un error firmando el XML con el certificado indicado.") from exc
 
         return signed_root
 
+    def _get_hacienda_signing_arguments(self):
+        """Arguments of :func:`..tools.signing.get_signing_material` for the move's company."""
+        company = self.company_id
+        if not company.hacienda_cert_key or not company.hacienda_certificate_pin:
+            raise UserError(
+                "Debe cargar la llave criptográfica y el PIN del certificado en Ajustes > Hacienda para firmar el XML."
+            )
+        return (
+            self.env.cr.dbname,
+            company.id,
+            base64.b64decode(company.hacienda_cert_key),
+            company.hacienda_certificate_pin,
+            self.HACIENDA_XMLNS,
+        )
+
     @staticmethod
     def _selection_cr_sale_condition():
         return [
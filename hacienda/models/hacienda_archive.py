@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import base64
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from psycopg2.extras import execute_values
+
+from odoo import api, fields, models
+from odoo.tools import human_size
+
+from ..tools.archive_segment import MAX_SEGMENT_SIZE, SegmentReader, append_records, pack_record, segment_size
+
+_logger = logging.getLogger(__name__)
+
+# Namespace of the advisory locks that keep a single writer per company segment.
+HACIENDA_ARCHIVE_LOCK_NAMESPACE = 0x48415243  # "HARC"
+_SEGMENT_READER = SegmentReader()
+
+
+class HaciendaArchiveEntry(models.Model):
+    _name = "hacienda.archive.entry"
+    _description = "Comprobante electrónico archivado"
+    _order = "response_date desc, id desc"
+
+    name = fields.Char(string="Número documento", required=True, index=True, readonly=True)
+    clave = fields.Char(string="Clave", index=True, readonly=True)
+    move_id = fields.Many2one(
+        comodel_name="account.move",
+        string="Factura relacionada",
+        ondelete="set null",
+        index="btree_not_null",
+        readonly=True,
+    )
+    company_id = fields.Many2one(comodel_name="res.company", string="Compañía", index=True, readonly=True)
+    state = fields.Selection(
+        selection=lambda self: self.env["hacienda.electronic.document"]._fields["state"].selection,
+        string="Estado",
+        readonly=True,
+    )
+    send_date = fields.Datetime(string="Fecha envío", readonly=True)
+    response_date = fields.Datetime(string="Fecha respuesta", readonly=True)
+    message = fields.Text(string="Mensaje Hacienda", readonly=True)
+    xml_filename = fields.Char(string="Nombre XML", readonly=True)
+    xml_response_filename = fields.Char(string="Nombre respuesta", readonly=True)
+    xml_size = fields.Integer(string="Tamaño XML", readonly=True)
+    response_size = fields.Integer(string="Tamaño respuesta", readonly=True)
+    segment = fields.Char(string="Segmento", required=True, readonly=True)
+    offset = fields.Integer(string="Posición", readonly=True)
+    length = fields.Integer(string="Longitud", readonly=True)
+    xml_file = fields.Binary(string="Archivo XML", compute="_compute_archived_files", attachment=False)
+    xml_response = fields.Binary(string="Respuesta Hacienda", compute="_compute_archived_files", attachment=False)
+    attempt_ids = fields.One2many(
+        comodel_name="hacienda.electronic.document.attempt",
+        inverse_name="archive_entry_id",
+        string="Intentos",
+        readonly=True,
+    )
+
+    @api.depends("segment", "offset", "length")
+    @api.depends_context("bin_size")
+    def _compute_archived_files(self):
+        if self.env.context.get("bin_size"):
+            for entry in self:
+                entry.xml_file = human_size(entry.xml_size) if entry.xml_size else False
+                entry.xml_response = human_size(entry.response_size) if entry.response_size else False
+            return
+        for entry in self:
+            xml, response = entry._read_archived_payloads()
+            entry.xml_file = base64.b64encode(xml) if xml else False
+            entry.xml_response = base64.b64encode(response) if response else False
+
+    @api.model
+    def _get_archive_root(self):
+        return os.path.join(self.env["ir.attachment"]._filestore(), "hacienda_archive")
+
+    def _read_archived_payloads(self):
+        """Return the ``(xml, response)`` bytes of the entry from its memory mapped segment."""
+        self.ensure_one()
+        return _SEGMENT_READER.read(os.path.join(self._get_archive_root(), self.segment), self.offset, self.length)
+
+    @api.model
+    def _get_segment(self, company, month, incoming):
+        """Relative path of the segment of ``company`` and ``month`` that can take ``incoming`` more bytes."""
+        root = self._get_archive_root()
+        directory = os.path.join(root, str(company.id))
+        prefix = f"{month}-"
+        existing = sorted(
+            name for name in (os.listdir(directory) if os.path.isdir(directory) else [])
+            if name.startswith(prefix) and name.endswith(".seg")
+        )
+        sequence = int(existing[-1][len(prefix):-4]) if existing else 0
+        segment = f"{company.id}/{month}-{sequence:03d}.seg"
+        if existing and segment_size(os.path.join(root, segment)) + incoming > MAX_SEGMENT_SIZE:
+            segment = f"{company.id}/{month}-{sequence + 1:03d}.seg"
+        return segment
+
+    @api.model
+    def _cron_archive_hacienda_documents(self, max_batches=None):
+        """Move accepted documents older than ``hacienda.archive_after_days`` to the archive segments."""
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        params = self.env["ir.config_parameter"].sudo()
+        days = int(params.get_param("hacienda.archive_after_days", 180) or 0)
+        if days <= 0:
+            return
+        batch_size = max(int(params.get_param("hacienda.archive_batch_size", 1000) or 0), 1)
+        cutoff = fields.Datetime.now() - timedelta(days=days)
+        batches = 0
+        # Companies whose segments another transaction is writing; left for the next run.
+        busy_company_ids = set()
+        while max_batches is None or batches < max_batches:
+            documents = self._claim_hacienda_documents_to_archive(cutoff, batch_size, busy_company_ids)
+            if not documents:
+                return
+            entries = self._archive_hacienda_documents(documents)
+            busy_company_ids |= set(documents.company_id.ids) - set(entries.company_id.ids)
+            batches += 1
+            if auto_commit:
+                self.env.cr.commit()
+            if len(documents) < batch_size:
+                return
+        cron = self.env.ref("hacienda.ir_cron_hacienda_archive_documents", raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _claim_hacienda_documents_to_archive(self, cutoff, limit, exclude_company_ids=()):
+        self.env.cr.execute(
+            """
+            SELECT id
+              FROM hacienda_electronic_document
+             WHERE state = 'accepted'
+               AND company_id IS NOT NULL
+               AND company_id != ALL(%s)
+               AND COALESCE(response_date, create_date) < %s
+          ORDER BY company_id, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+            """,
+            (list(exclude_company_ids), cutoff, limit),
+        )
+        return self.env["hacienda.electronic.document"].browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _keep_hacienda_attempts(self, documents, entries):
+        """Move the attempts of ``documents`` to their archive ``entries`` instead of deleting them.
+
+        The attempts hold the timing history reported by day and company. Their
+        payloads are released: the archive segment holds the last XML and response.
+        """
+        if not entries:
+            return
+        execute_values(
+            self.env.cr,
+            """
+            UPDATE hacienda_electronic_document_attempt a
+               SET document_id = NULL, archive_entry_id = v.entry_id,
+                   xml_payload_id = NULL, response_payload_id = NULL
+              FROM (VALUES %s) AS v(document_id, entry_id)
+             WHERE a.document_id = v.document_id
+            """,
+            [(document.id, entry.id) for document, entry in zip(documents, entries)],
+        )
+        self.env["hacienda.electronic.document.attempt"].invalidate_model(
+            ["document_id", "archive_entry_id", "xml_payload_id", "response_payload_id"]
+        )
+
+    def _archive_hacienda_documents(self, documents):
+        """Append the payloads of ``documents`` to their segments, index them and delete the documents.
+
+        Segments are grouped by company and month of the answer of Hacienda.
+        Each group is written with one append and one ``fsync`` before the
+        index rows are created, under an advisory lock so a single transaction
+        writes to the segments of a company at a time; the documents of a
+        company whose lock is held are left as they are. The attempts of the
+        documents move to their entries, and the payloads of the deleted
+        documents are released to the payload garbage collector.
+        Returns the archive entries created.
+        """
+        preferred = self.env["ir.config_parameter"].sudo().get_param("hacienda.payload_compression", "zstd")
+        root = self._get_archive_root()
+        values = []
+        # Archived documents in the order of ``values``.
+        archived_documents = []
+        archived = documents.browse()
+        for company, company_documents in documents.grouped("company_id").items():
+            self.env.cr.execute(
+                "SELECT pg_try_advisory_xact_lock(%s, %s)", (HACIENDA_ARCHIVE_LOCK_NAMESPACE, company.id)
+            )
+            if not self.env.cr.fetchone()[0]:
+                continue
+            by_month = defaultdict(documents.browse)
+            for document in company_documents:
+                by_month[(document.response_date or document.create_date).strftime("%Y-%m")] |= document
+            for month, month_documents in sorted(by_month.items()):
+                payloads = [
+                    (
+                        document.xml_payload_id._read_payload() if document.xml_payload_id else b"",
+                        document.response_payload_id._read_payload() if document.response_payload_id else b"",
+                    )
+                    for document in month_documents
+                ]
+                records = [pack_record(xml, response, preferred) for xml, response in payloads]
+                segment = self._get_segment(company, month, sum(len(record) for record in records))
+                positions = append_records(os.path.join(root, segment), records)
+                for document, (xml, response), (offset, length) in zip(month_documents, payloads, positions):
+                    values.append(
+                        {
+                            "name": document.name,
+                            "clave": document.clave,
+                            "move_id": document.move_id.id,
+                            "company_id": company.id,
+                            "state": document.state,
+                            "send_date": document.send_date,
+                            "response_date": document.response_date,
+                            "message": document.message,
+                            "xml_filename": document.xml_filename,
+                            "xml_response_filename": document.xml_response_filename,
+                            "xml_size": len(xml),
+                            "response_size": len(response),
+                            "segment": segment,
+                            "offset": offset,
+                            "length": length,
+                        }
+                    )
+                    archived_documents.append(document)
+                archived |= month_documents
+        entries = self.create(values)
+        self._keep_hacienda_attempts(archived_documents, entries)
+        archived.unlink()
+        if entries:
+            _logger.info("Archived %s Hacienda documents", len(entries))
+        return entries
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import base64
+import logging
+import time
+
+from psycopg2.extras import execute_values
+
+from odoo import fields, models
+from odoo.exceptions import UserError
+
+from ..tools.cabys_import import iter_chunks, iter_csv_rows, iter_xlsx_rows
+from ..tools.tabular import is_xlsx
+from ..tools.text import normalize_search_text
+
+_logger = logging.getLogger(__name__)
+
+CABYS_IMPORT_CHUNK_SIZE = 5000
+
+
+class HaciendaCabysImport(models.TransientModel):
+    _name = "hacienda.cabys.import"
+    _description = "Importar catálogo CABYS"
+
+    file = fields.Binary(string="Archivo", required=True)
+    filename = fields.Char(string="Nombre del archivo")
+    retire_missing = fields.Boolean(
+        string="Desactivar códigos ausentes",
+        default=True,
+        help="Desactiva los códigos CABYS existentes que no aparecen en el archivo importado. "
+        "Desmarque esta opción si el archivo contiene solo una parte del catálogo.",
+    )
+    state = fields.Selection([("draft", "Borrador"), ("done", "Importado")], default="draft")
+    inserted_count = fields.Integer(string="Nuevos", readonly=True)
+    updated_count = fields.Integer(string="Actualizados", readonly=True)
+    unchanged_count = fields.Integer(string="Sin cambios", readonly=True)
+    retired_count = fields.Integer(string="Desactivados", readonly=True)
+    duration = fields.Float(string="Duración (s)", readonly=True, digits=(16, 2))
+
+    def action_import(self):
+        self.ensure_one()
+        started = time.monotonic()
+        counts = self._import_cabys_rows(self._iter_cabys_file_rows(), retire_missing=self.retire_missing)
+        self.write(dict(counts, state="done", duration=time.monotonic() - started))
+        _logger.info(
+            "CABYS import %s: %s inserted, %s updated, %s unchanged, %s retired in %.2fs",
+            self.filename or "",
+            self.inserted_count,
+            self.updated_count,
+            self.unchanged_count,
+            self.retired_count,
+            self.duration,
+        )
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def _iter_cabys_file_rows(self):
+        data = base64.b64decode(self.file or b"")
+        if not data:
+            raise UserError("Seleccione el archivo del catálogo CABYS a importar.")
+        if is_xlsx(data, self.filename):
+            try:  # pragma: no cover - optional dependency handled at runtime
+                import openpyxl  # noqa: F401
+            except ImportError as exc:
+                raise UserError(
+                    "Para importar archivos XLSX instale la librería de Python 'openpyxl' "
+                    "o exporte el catálogo a CSV."
+                ) from exc
+            rows = iter_xlsx_rows(data)
+        else:
+            rows = iter_csv_rows(data)
+        try:
+            yield from rows
+        except ValueError as exc:
+            raise UserError(str(exc)) from exc
+
+    def _import_cabys_rows(self, rows, retire_missing=True):
+        """Upsert ``(code, name, tax_rate)`` rows into ``hacienda_cabys`` with set-based SQL.
+
+        Rows are written ``CABYS_IMPORT_CHUNK_SIZE`` at a time with ``INSERT ...
+        ON CONFLICT (code) DO UPDATE``; rows whose values did not change are left
+        untouched. The imported codes are collected in a temporary table so the
+        codes missing from the release can be archived in a single statement.
+        """
+        cabys = self.env["hacienda.cabys"]
+        cabys.flush_model()
+        cr = self.env.cr
+        uid = self.env.uid
+        valid_rates = {code for code, _label in self.env["account.tax"]._selection_cr_tax_rate()}
+        cr.execute("CREATE TEMPORARY TABLE IF NOT EXISTS hacienda_cabys_import_code (code varchar PRIMARY KEY)")
+        cr.execute("TRUNCATE hacienda_cabys_import_code")
+        counts = {"inserted_count": 0, "updated_count": 0, "unchanged_count": 0, "retired_count": 0}
+        for chunk in iter_chunks(rows, CABYS_IMPORT_CHUNK_SIZE):
+            values = [(code, name, tax_rate if tax_rate in valid_rates else None) for code, name, tax_rate in chunk]
+            execute_values(
+                cr,
+                "INSERT INTO hacienda_cabys_import_code (code) VALUES %s ON CONFLICT DO NOTHING",
+                [(code,) for code, _name, _tax_rate in values],
+                page_size=len(values),
+            )
+            results = execute_values(
+                cr,
+                """
+                INSERT INTO hacienda_cabys AS c (
+                    code, name, search_name, tax_rate, active, create_uid, write_uid, create_date, write_date
+                )
+                VALUES %s
+                ON CONFLICT (code) DO UPDATE
+                   SET name = EXCLUDED.name,
+                       search_name = EXCLUDED.search_name,
+                       tax_rate = EXCLUDED.tax_rate,
+                       active = TRUE,
+                       write_uid = EXCLUDED.write_uid,
+                       write_date = EXCLUDED.write_date
+                 WHERE (c.name, c.tax_rate, c.active) IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.tax_rate, TRUE)
+                RETURNING (xmax = 0)
+                """,
+                [(code, name, normalize_search_text(name), tax_rate, uid, uid) for code, name, tax_rate in values],
+                template="(%s, %s, %s, %s, TRUE, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')",
+                page_size=len(values),
+                fetch=True,
+            )
+            inserted = sum(1 for (is_insert,) in results if is_insert)
+            counts["inserted_count"] += inserted
+            counts["updated_count"] += len(results) - inserted
+            counts["unchanged_count"] += len(values) - len(results)
+        if not counts["inserted_count"] + counts["updated_count"] + counts["unchanged_count"]:
+            raise UserError("El archivo no contiene códigos CABYS válidos.")
+        if retire_missing:
+            cr.execute(
+                """
+                UPDATE hacienda_cabys c
+                   SET active = FALSE,
+                       write_uid = %s,
+                       write_date = now() at time zone 'UTC'
+                 WHERE c.active
+                   AND NOT EXISTS (SELECT 1 FROM hacienda_cabys_import_code i WHERE i.code = c.code)
+                """,
+                (uid,),
+            )
+            counts["retired_count"] = cr.rowcount
+        cr.execute("DROP TABLE hacienda_cabys_import_code")
+        cabys.invalidate_model()
+        return counts
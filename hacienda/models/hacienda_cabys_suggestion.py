@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from collections import defaultdict
+
+from psycopg2.extras import execute_values
+
+from odoo import api, fields, models
+from odoo.exceptions import UserError
+
+from ..tools.cabys_classifier import Bm25Index, build_query
+
+_logger = logging.getLogger(__name__)
+
+CABYS_CLASSIFIER_CHUNK_SIZE = 5000
+
+
+class HaciendaCabysSuggestion(models.Model):
+    _name = "hacienda.cabys.suggestion"
+    _description = "Sugerencia de código CABYS"
+    _order = "product_tmpl_id, rank"
+
+    product_tmpl_id = fields.Many2one(
+        comodel_name="product.template",
+        string="Producto",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    cabys_id = fields.Many2one(
+        comodel_name="hacienda.cabys",
+        string="Código CABYS",
+        required=True,
+        ondelete="cascade",
+    )
+    rank = fields.Integer(string="Posición", required=True, default=1)
+    score = fields.Float(string="Puntaje", digits=(16, 4))
+    confidence = fields.Float(string="Confianza", digits=(16, 4), index=True)
+    current_cabys_id = fields.Many2one(related="product_tmpl_id.cabys_code_id", string="Código actual")
+
+    def action_apply(self):
+        """Assign the suggested code to each product, best ranked suggestion first."""
+        best = {}
+        for suggestion in self.sorted(lambda s: (s.rank, -s.confidence)):
+            best.setdefault(suggestion.product_tmpl_id.id, suggestion.cabys_id.id)
+        return self._apply_cabys_codes(best)
+
+    @api.model
+    def _apply_cabys_codes(self, cabys_by_product):
+        """Write ``{product_tmpl_id: cabys_id}`` with one ``write`` per distinct code."""
+        products_by_cabys = defaultdict(list)
+        for product_id, cabys_id in cabys_by_product.items():
+            products_by_cabys[cabys_id].append(product_id)
+        templates = self.env["product.template"]
+        for cabys_id, product_ids in products_by_cabys.items():
+            templates.browse(product_ids).write({"cabys_code_id": cabys_id})
+        return len(cabys_by_product)
+
+
+class HaciendaCabysClassifier(models.TransientModel):
+    _name = "hacienda.cabys.classifier"
+    _description = "Clasificar productos por CABYS"
+
+    only_missing = fields.Boolean(string="Solo productos sin código", default=True)
+    top_k = fields.Integer(string="Sugerencias por producto", default=3)
+    auto_apply = fields.Boolean(
+        string="Aplicar sugerencias confiables",
+        help="Asigna directamente la mejor sugerencia cuando su confianza alcanza el mínimo indicado.",
+    )
+    min_confidence = fields.Float(string="Confianza mínima", default=0.75)
+    state = fields.Selection([("draft", "Borrador"), ("done", "Clasificado")], default="draft")
+    product_count = fields.Integer(string="Productos analizados", readonly=True)
+    suggestion_count = fields.Integer(string="Sugerencias generadas", readonly=True)
+    applied_count = fields.Integer(string="Códigos asignados", readonly=True)
+    duration = fields.Float(string="Duración (s)", readonly=True, digits=(16, 2))
+
+    def action_classify(self):
+        self.ensure_one()
+        if self.top_k < 1:
+            raise UserError("Indique al menos una sugerencia por producto.")
+        started = time.monotonic()
+        counts = self._classify_products()
+        self.write(dict(counts, state="done", duration=time.monotonic() - started))
+        _logger.info(
+            "CABYS classification: %s products, %s suggestions, %s codes applied in %.2fs",
+            self.product_count,
+            self.suggestion_count,
+            self.applied_count,
+            self.duration,
+        )
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def action_view_suggestions(self):
+        action = self.env["ir.actions.act_window"]._for_xml_id("hacienda.action_hacienda_cabys_suggestions")
+        action["context"] = {"search_default_best": 1}
+        return action
+
+    def _classify_products(self):
+        """Score every selected product against a BM25 index of the active CABYS codes.
+
+        The index is built once from the catalogue; products are read and their
+        suggestions inserted ``CABYS_CLASSIFIER_CHUNK_SIZE`` at a time, replacing
+        the previous suggestions of the same products.
+        """
+        catalogue = self.env["hacienda.cabys"].search_read([("active", "=", True)], ["name"])
+        if not catalogue:
+            raise UserError("Importe el catálogo CABYS antes de clasificar productos.")
+        index = Bm25Index((row["id"], row["name"]) for row in catalogue)
+        categories = {
+            row["id"]: row["complete_name"]
+            for row in self.env["product.category"].search_read([], ["complete_name"])
+        }
+        domain = [("cabys_code_id", "=", False)] if self.only_missing else []
+        templates = self.env["product.template"]
+        product_ids = templates.search(domain, order="id").ids
+
+        suggestion_model = self.env["hacienda.cabys.suggestion"]
+        suggestion_model.flush_model()
+        cr = self.env.cr
+        uid = self.env.uid
+        counts = {"product_count": len(product_ids), "suggestion_count": 0, "applied_count": 0}
+        to_apply = {}
+        for start in range(0, len(product_ids), CABYS_CLASSIFIER_CHUNK_SIZE):
+            chunk = product_ids[start:start + CABYS_CLASSIFIER_CHUNK_SIZE]
+            rows = []
+            for product in templates.browse(chunk).read(["name", "categ_id"], load=None):
+                suggestions = index.search(
+                    build_query(product["name"], categories.get(product["categ_id"])), limit=self.top_k
+                )
+                rows.extend(
+                    (product["id"], suggestion.doc_id, rank, suggestion.score, suggestion.confidence, uid, uid)
+                    for rank, suggestion in enumerate(suggestions, start=1)
+                )
+                if suggestions and self.auto_apply and suggestions[0].confidence >= self.min_confidence:
+                    to_apply[product["id"]] = suggestions[0].doc_id
+            cr.execute("DELETE FROM hacienda_cabys_suggestion WHERE product_tmpl_id = ANY(%s)", (chunk,))
+            if rows:
+                execute_values(
+                    cr,
+                    """
+                    INSERT INTO hacienda_cabys_suggestion (
+                        product_tmpl_id, cabys_id, rank, score, confidence,
+                        create_uid, write_uid, create_date, write_date
+                    )
+                    VALUES %s
+                    """,
+                    rows,
+                    template="(%s, %s, %s, %s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')",
+                    page_size=1000,
+                )
+            counts["suggestion_count"] += len(rows)
+        suggestion_model.invalidate_model()
+        if to_apply:
+            counts["applied_count"] = suggestion_model._apply_cabys_codes(to_apply)
+        return counts
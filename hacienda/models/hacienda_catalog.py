@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
-from odoo import fields, models
+from odoo import api, fields, models
+from odoo.fields import Domain
+from odoo.tools import SQL, escape_psql
+from odoo.tools.sql import create_index, index_exists
+
+from ..tools.text import normalize_search_text
 
 
 class HaciendaCabys(models.Model):
@@ -9,6 +14,12 @@ class HaciendaCabys(models.Model):
 
     code = fields.Char(string="Código", required=True, index=True)
     name = fields.Char(string="Descripción", required=True)
+    search_name = fields.Char(
+        compute="_compute_search_name",
+        store=True,
+        index="trigram",
+        help="Descripción en minúsculas y sin tildes, usada por la búsqueda indexada.",
+    )
     tax_rate = fields.Selection(
         selection=lambda self: self.env["account.tax"]._selection_cr_tax_rate(),
         string="Tarifa por defecto",
@@ -19,6 +30,44 @@ class HaciendaCabys(models.Model):
         ("hacienda_cabys_code_unique", "unique(code)", "El código CABYS debe ser único."),
     ]
 
+    def init(self):
+        # ``code`` already has a btree index, but prefix searches (``LIKE '0111%'``)
+        # can only use it under the C collation; text_pattern_ops works everywhere.
+        if not index_exists(self.env.cr, "hacienda_cabys_code_pattern_index"):
+            create_index(
+                self.env.cr, "hacienda_cabys_code_pattern_index", self._table, ["code text_pattern_ops"]
+            )
+
+    @api.depends("name")
+    def _compute_search_name(self):
+        for cabys in self:
+            cabys.search_name = normalize_search_text(cabys.name)
+
+    @api.model
+    def name_search(self, name="", domain=None, operator="ilike", limit=100):
+        """Search codes by prefix and descriptions word by word, best matches first.
+
+        Every word must appear in the accent free ``search_name`` (trigram index);
+        a query made of digits also matches codes by prefix. Results are ranked by
+        exact code, code prefix, then trigram similarity to the whole query.
+        """
+        words = normalize_search_text(name).split()
+        if operator != "ilike" or not words:
+            return super().name_search(name, domain, operator, limit)
+        text_domain = Domain.AND(Domain("search_name", "ilike", word) for word in words)
+        term = name.strip()
+        if term.isdigit():
+            text_domain = Domain("code", "=like", escape_psql(term) + "%") | text_domain
+        query = self._search(Domain(domain or []) & text_domain, limit=limit)
+        code = SQL.identifier(query.table, "code")
+        search_name = SQL.identifier(query.table, "search_name")
+        ranking = [SQL("%s = %s DESC", code, term), SQL("%s LIKE %s DESC", code, escape_psql(term) + "%")]
+        if self.env.registry.has_trigram:
+            ranking.append(SQL("similarity(%s, %s) DESC", search_name, " ".join(words)))
+        ranking.append(SQL("length(%s), %s", search_name, code))
+        query.order = SQL(", ").join(ranking)
+        return [(record.id, record.display_name) for record in self.browse(query).sudo()]
+
 
 class HaciendaMeasurementUnit(models.Model):
     _name = "hacienda.measurement.unit"
@@ -40,6 +89,7 @@ class HaciendaMeasurementUnit(models.Model):
 
 class HaciendaCanton(models.Model):
     _name = "hacienda.canton"
+    _inherit = ["hacienda.geo.cache.mixin"]
     _description = "Cantones Hacienda"
     _order = "code"
 
@@ -58,6 +108,7 @@ class HaciendaCanton(models.Model):
 
 class HaciendaDistrict(models.Model):
     _name = "hacienda.district"
+    _inherit = ["hacienda.geo.cache.mixin"]
     _description = "Distritos Hacienda"
     _order = "code"
 
@@ -77,6 +128,7 @@ class HaciendaDistrict(models.Model):
 
 class HaciendaNeighborhood(models.Model):
     _name = "hacienda.neighborhood"
+    _inherit = ["hacienda.geo.cache.mixin"]
     _description = "Barrios Hacienda"
     _order = "code"
 
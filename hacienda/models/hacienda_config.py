@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from odoo import fields, models
 
+from ..tools import xsd_validation
+from ..tools.signing import invalidate_signing_material
+
+HACIENDA_CREDENTIAL_FIELDS = {"hacienda_api_base_url", "hacienda_username", "hacienda_password"}
+HACIENDA_CERTIFICATE_FIELDS = {"hacienda_cert_key", "hacienda_certificate_pin"}
+
 
 class ResCompany(models.Model):
     _inherit = "res.company"
@@ -19,6 +25,24 @@ class ResCompany(models.Model):
         string="Código actividad económica",
         help="Código de actividad económica registrado ante Hacienda.",
     )
+    hacienda_send_batch_size = fields.Integer(
+        string="Tamaño de lote de envío",
+        default=50,
+        help="Cantidad de comprobantes en cola que el despachador envía por lote.",
+    )
+    hacienda_send_concurrency = fields.Integer(
+        string="Envíos concurrentes",
+        default=2,
+        help="Cantidad máxima de comprobantes de la compañía que se envían a Hacienda al mismo tiempo.",
+    )
+
+    def write(self, vals):
+        res = super().write(vals)
+        if HACIENDA_CREDENTIAL_FIELDS.intersection(vals):
+            self.env["hacienda.auth.token"]._clear_company_tokens(self)
+        if HACIENDA_CERTIFICATE_FIELDS.intersection(vals):
+            invalidate_signing_material(self.env.cr.dbname, set(self.ids))
+        return res
 
 
 class HaciendaResConfigSettings(models.TransientModel):
@@ -34,3 +58,34 @@ class HaciendaResConfigSettings(models.TransientModel):
         related="company_id.hacienda_system_provider_code", readonly=False
     )
     hacienda_activity_code = fields.Char(related="company_id.hacienda_activity_code", readonly=False)
+    hacienda_send_batch_size = fields.Integer(related="company_id.hacienda_send_batch_size", readonly=False)
+    hacienda_send_concurrency = fields.Integer(related="company_id.hacienda_send_concurrency", readonly=False)
+    hacienda_xsd_status = fields.Char(
+        string="Estado de la validación XSD", compute="_compute_hacienda_xsd_status"
+    )
+
+    def _compute_hacienda_xsd_status(self):
+        """Warning shown while the XML is signed without schema validation, False otherwise."""
+        directory = self.env["account.move"]._get_hacienda_xsd_directory()
+        if directory is False:
+            status = "La validación XSD está desactivada (parámetro hacienda.xsd_validation)."
+        else:
+            missing = xsd_validation.missing_schemas(directory)
+            status = (
+                f"Faltan esquemas en {directory}: {', '.join(missing)}. "
+                "Los comprobantes de esos tipos se firman sin validar."
+                if missing
+                else False
+            )
+        for settings in self:
+            settings.hacienda_xsd_status = status
+
+    def action_hacienda_sync_xsd(self):
+        self.env["account.move"]._cron_sync_hacienda_xsd()
+        return {"type": "ir.actions.client", "tag": "reload"}
+
+    def set_values(self):
+        super().set_values()
+        # The related fields already write through res.company, which drops the
+        # cached certificate; this also covers settings saved without changes.
+        invalidate_signing_material(self.env.cr.dbname, {self.company_id.id})
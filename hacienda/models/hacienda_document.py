@@ -1,23 +1,98 @@
 # -*- coding: utf-8 -*-
 import base64
 import logging
-from datetime import datetime
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from urllib.parse import urljoin
 
 import requests
 
-from odoo import fields, models
+from odoo import api, fields, models
 from odoo.exceptions import UserError
 
+from ..tools.http_client import get_session
+
+try:  # pragma: no cover - optional dependency provided at runtime
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    etree = None
+
 _logger = logging.getLogger(__name__)
 
+# Namespace of the PostgreSQL advisory locks that keep a single dispatcher
+# working on the queue of a company at the same time.
+HACIENDA_DISPATCH_LOCK_NAMESPACE = 0x48414349  # "HACI"
+
+# Delay in seconds before each status query of a document in "sent": quick at
+# first because most answers arrive within a minute, then slowing down to the
+# last value, which is reused for every following query.
+HACIENDA_POLL_INTERVALS = (30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 6 * 3600)
+HACIENDA_TERMINAL_STATES = {"accepted", "rejected", "error"}
+# Documents in other states were already received (or are being sent) by Hacienda.
+HACIENDA_SENDABLE_STATES = {"draft", "queued", "error"}
+
+
+class HaciendaTokenError(requests.RequestException):
+    """No token could be obtained for the company of an upload."""
+
+
+def _post_hacienda_document(session, url, xml_content, token):
+    """POST a signed XML to ``recepcion``. Runs in worker threads: no ORM access."""
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/xml",
+        "Accept": "application/json, application/xml",
+    }
+    started = time.perf_counter()
+    try:
+        response = session.post(url, data=xml_content, headers=headers, timeout=60)
+    except requests.RequestException as exc:
+        return None, exc, time.perf_counter() - started
+    return response, None, time.perf_counter() - started
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(percent / 100.0 * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def _fetch_hacienda_status(session, url, token):
+    """Query ``recepcion/{clave}``. Runs in worker threads: it must not use the ORM."""
+    headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+    started = time.perf_counter()
+    try:
+        response = session.get(url, headers=headers, timeout=30)
+    except requests.RequestException as exc:
+        return None, None, exc, time.perf_counter() - started, 0
+    elapsed = time.perf_counter() - started
+    data = None
+    if "json" in response.headers.get("Content-Type", ""):
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+    return response.status_code, data, None, elapsed, len(response.content or b"")
+
+
+def _error_class(error):
+    return type(error).__name__ if error is not None else False
+
 
 class HaciendaElectronicDocument(models.Model):
     _name = "hacienda.electronic.document"
+    _inherit = ["hacienda.xml.payload.mixin"]
     _description = "Documento electrónico Hacienda"
     _order = "create_date desc"
 
     name = fields.Char(string="Número documento", required=True)
+    clave = fields.Char(string="Clave", index=True, copy=False)
     move_id = fields.Many2one(
         comodel_name="account.move",
         string="Factura relacionada",
@@ -32,6 +107,7 @@ class HaciendaElectronicDocument(models.Model):
     state = fields.Selection(
         [
             ("draft", "Borrador"),
+            ("queued", "En cola"),
             ("sent", "Enviado"),
             ("accepted", "Aceptado"),
             ("rejected", "Rechazado"),
@@ -39,32 +115,487 @@ class HaciendaElectronicDocument(models.Model):
         ],
         string="Estado",
         default="draft",
+        index=True,
     )
-    xml_filename = fields.Char(string="Nombre XML")
-    xml_file = fields.Binary(string="Archivo XML")
-    xml_response_filename = fields.Char(string="Nombre respuesta")
-    xml_response = fields.Binary(string="Respuesta Hacienda")
     send_date = fields.Datetime(string="Fecha envío")
     response_date = fields.Datetime(string="Fecha respuesta")
     message = fields.Text(string="Mensaje Hacienda")
+    validation_errors = fields.Text(
+        string="Errores de esquema",
+        readonly=True,
+        copy=False,
+        help="Errores de la validación contra el XSD de Hacienda, con la línea y la ruta de cada elemento.",
+    )
+    xsd_validation_skipped = fields.Boolean(
+        string="Sin validación XSD",
+        readonly=True,
+        copy=False,
+        help="El XML se firmó sin validarlo contra el XSD de Hacienda: el esquema no estaba disponible "
+        "o la validación está desactivada.",
+    )
+    next_poll_date = fields.Datetime(string="Próxima consulta de estado", index="btree_not_null", copy=False)
+    poll_count = fields.Integer(string="Consultas de estado", copy=False)
     company_id = fields.Many2one(
         related="move_id.company_id",
         string="Compañía",
         store=True,
         readonly=True,
     )
+    attempt_ids = fields.One2many(
+        comodel_name="hacienda.electronic.document.attempt",
+        inverse_name="document_id",
+        string="Intentos",
+        readonly=True,
+    )
 
     # ------------------------------------------------------------------
     # Actions
     # ------------------------------------------------------------------
 
     def action_send_to_hacienda(self):
-        for document in self:
-            document._action_send_to_hacienda()
+        if len(self) == 1:
+            self._action_send_to_hacienda()
+            return
+        report = self._send_to_hacienda_bulk()
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": "Envío a Hacienda",
+                "message": self._format_bulk_send_report(report),
+                "type": "warning" if report["failed"] else "success",
+                "sticky": bool(report["failed"]),
+            },
+        }
+
+    def action_enqueue_to_hacienda(self):
+        """Put the documents in the outbound queue processed by the dispatcher cron."""
+        documents = self.filtered(lambda d: d.state in {"draft", "error"})
+        if not documents:
+            return
+        documents.write({"state": "queued", "message": False})
+        self._trigger_hacienda_dispatcher()
+
+    def action_poll_hacienda_status(self):
+        documents = self.filtered(lambda d: d.state == "sent")
+        if documents:
+            documents._poll_hacienda_status()
+
+    @api.model
+    def _trigger_hacienda_dispatcher(self):
+        cron = self.env.ref("hacienda.ir_cron_hacienda_dispatch_queue", raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _cron_dispatch_hacienda_queue(self, max_batches=None):
+        """Drain the outbound queue company by company in batches.
+
+        A session level advisory lock keeps one dispatcher per company, which
+        then sends up to ``hacienda_send_concurrency`` documents at once; unlike
+        a transaction level one, it outlives the commits made while a batch is
+        being uploaded. Rows are claimed with ``SKIP LOCKED`` and each batch is
+        committed on its own.
+        """
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        groups = self._read_group([("state", "=", "queued")], ["company_id"], ["__count"])
+        remaining = False
+        for company, _count in groups:
+            if not company:
+                continue
+            batch_size = max(company.hacienda_send_batch_size or 0, 1)
+            batches = 0
+            if not self._acquire_hacienda_dispatch_lock(company):
+                continue
+            try:
+                while max_batches is None or batches < max_batches:
+                    documents = self._claim_hacienda_queued_documents(company, batch_size)
+                    if not documents:
+                        break
+                    documents._send_to_hacienda_bulk(max_workers=company.hacienda_send_concurrency)
+                    batches += 1
+                    if auto_commit:
+                        self.env.cr.commit()
+                    if len(documents) < batch_size:
+                        break
+                else:
+                    remaining = True
+            except Exception:
+                # The lock can only be released, and must be before the connection goes back to the pool,
+                # once the failed transaction is rolled back.
+                self.env.cr.rollback()
+                raise
+            finally:
+                self._release_hacienda_dispatch_lock(company)
+        if remaining:
+            self._trigger_hacienda_dispatcher()
+
+    @api.model
+    def _acquire_hacienda_dispatch_lock(self, company):
+        self.env.cr.execute(
+            "SELECT pg_try_advisory_lock(%s, %s)",
+            (HACIENDA_DISPATCH_LOCK_NAMESPACE, company.id),
+        )
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _release_hacienda_dispatch_lock(self, company):
+        self.env.cr.execute(
+            "SELECT pg_advisory_unlock(%s, %s)",
+            (HACIENDA_DISPATCH_LOCK_NAMESPACE, company.id),
+        )
+
+    @api.model
+    def _claim_hacienda_queued_documents(self, company, limit):
+        self.env.cr.execute(
+            """
+            SELECT id
+              FROM hacienda_electronic_document
+             WHERE state = 'queued'
+               AND company_id = %s
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+            """,
+            (company.id, limit),
+        )
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _cron_poll_hacienda_status(self, max_batches=None):
+        """Ask Hacienda for the verdict of every document in "sent" that is due."""
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        params = self.env["ir.config_parameter"].sudo()
+        batch_size = max(int(params.get_param("hacienda.poll_batch_size", 500) or 0), 1)
+        max_workers = max(int(params.get_param("hacienda.poll_workers", 16) or 0), 1)
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            documents = self._claim_hacienda_documents_to_poll(batch_size)
+            if not documents:
+                return
+            documents._poll_hacienda_status(max_workers=max_workers)
+            batches += 1
+            if auto_commit:
+                self.env.cr.commit()
+            if len(documents) < batch_size:
+                return
+        cron = self.env.ref("hacienda.ir_cron_hacienda_poll_status", raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _claim_hacienda_documents_to_poll(self, limit):
+        self.env.cr.execute(
+            """
+            SELECT id
+              FROM hacienda_electronic_document
+             WHERE state = 'sent'
+               AND (next_poll_date IS NULL OR next_poll_date <= (now() at time zone 'UTC'))
+          ORDER BY next_poll_date NULLS FIRST, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+            """,
+            (limit,),
+        )
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _poll_hacienda_status(self, max_workers=16):
+        """Query the status of the documents concurrently and store the verdicts.
+
+        The HTTP calls run in a thread pool over plain data only; every ORM read
+        happens before and every write after, grouped where values are shared.
+        """
+        jobs = []
+        unreachable = self.browse()
+        token_latencies = {}
+        for company, documents in self.grouped("company_id").items():
+            base_url = (company.hacienda_api_base_url or "").strip()
+            token = None
+            if base_url:
+                token, token_latencies[company] = self._timed_authenticate_with_hacienda(company)
+            if not token:
+                unreachable |= documents
+                continue
+            for document in documents:
+                url = urljoin(base_url.rstrip("/") + "/", f"recepcion/{document.clave or document.name}")
+                jobs.append((document, company, url, token))
+
+        results = []
+        if jobs:
+            session = get_session(self.env)
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+                results = list(executor.map(lambda job: _fetch_hacienda_status(session, job[2], job[3]), jobs))
+
+        now = fields.Datetime.now()
+        pending = defaultdict(self.browse)
+        for document in unreachable:
+            pending[document.poll_count + 1] |= document
+        unauthorized = set()
+        verdicts = []
+        timings = {}
+        for (document, company, _url, _token), (status_code, data, error, elapsed, size) in zip(jobs, results):
+            timings[document.id] = {
+                "token_latency": token_latencies.get(company, 0.0),
+                "request_latency": elapsed,
+                "http_status": status_code or False,
+                "response_size": size,
+                "error_class": _error_class(error),
+            }
+            if error:
+                _logger.warning("Error consultando el estado de %s en Hacienda: %s", document.name, error)
+            elif status_code == 401:
+                unauthorized.add(company)
+            state = None
+            if data:
+                message, state = self._parse_hacienda_status(data, document.message)
+            if state not in HACIENDA_TERMINAL_STATES:
+                pending[document.poll_count + 1] |= document
+                continue
+            values = {
+                "state": state,
+                "message": message,
+                "response_date": now,
+                "next_poll_date": False,
+            }
+            response_xml = data.get("respuesta-xml")
+            content = None
+            if response_xml:
+                try:
+                    content = base64.b64decode(response_xml)
+                except ValueError:
+                    _logger.warning("Respuesta XML inválida de Hacienda para %s", document.name)
+            if content:
+                values.update(
+                    {
+                        "xml_response_filename": document._build_response_filename(),
+                        "message": self._extract_hacienda_response_detail(content) or message,
+                    }
+                )
+            verdicts.append((document, values, content))
+
+        payloads = self.env["hacienda.xml.payload"]._store_payloads(
+            [content for _document, _values, content in verdicts if content]
+        )
+        payloads = iter(payloads)
+        answered = self.browse()
+        for document, values, content in verdicts:
+            if content:
+                values["response_payload_id"] = next(payloads).id
+            document.write(values)
+            answered |= document
+        answered._log_hacienda_attempt("poll", timings)
+
+        metrics = self.env["hacienda.metrics"]._get_metrics_registry()
+        for (document, company, _url, _token), (status_code, _data, error, elapsed, _size) in zip(jobs, results):
+            if document in answered:
+                outcome = document.state
+            elif error or (status_code or 0) >= 400:
+                outcome = "error"
+            else:
+                outcome = "pending"
+            metrics.observe("poll", elapsed, company.id, outcome, document=document.name)
+        for company, documents in unreachable.grouped("company_id").items():
+            metrics.count("poll", "unreachable", company.id, amount=len(documents))
+
+        for poll_count, documents in pending.items():
+            documents.write({"poll_count": poll_count, "next_poll_date": self._next_hacienda_poll_date(poll_count)})
+        for company in unauthorized:
+            self.env["hacienda.auth.token"]._invalidate_access_token(company)
+        metrics.flush()
+
+    def _send_to_hacienda_bulk(self, max_workers=None):
+        """Send many documents concurrently and return a throughput report.
+
+        Only documents in draft, queued or error state are sent; the others
+        are left untouched and out of the report. Reads and validation happen
+        first, then the documents to upload are marked as sent and committed,
+        which releases the rows claimed by the dispatcher. The authentication
+        and the uploads run outside of any transaction holding those rows, in
+        a bounded thread pool that only sees plain data, and the outcomes are
+        written back in a new transaction with one ``write`` per distinct set
+        of values instead of two per document.
+        """
+        started = time.perf_counter()
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        documents_to_send = self.filtered(lambda d: d.state in HACIENDA_SENDABLE_STATES)
+        if not max_workers:
+            params = self.env["ir.config_parameter"].sudo()
+            max_workers = int(params.get_param("hacienda.send_workers", 8) or 0)
+        max_workers = max(max_workers, 1)
+
+        failures = {}
+        jobs = []
+        token_latencies = defaultdict(float)
+        for company, documents in documents_to_send.grouped("company_id").items():
+            base_url = (company.hacienda_api_base_url or "").strip() if company else ""
+            message = None
+            if not company:
+                message = "El documento electrónico debe estar vinculado a una compañía."
+            elif not (base_url and company.hacienda_username and company.hacienda_password):
+                message = "Debe configurar la URL del API, usuario y contraseña de Hacienda en Ajustes > Hacienda."
+            if message:
+                failures.update(dict.fromkeys(documents, message))
+                continue
+            recepcion_url = urljoin(base_url.rstrip("/") + "/", "recepcion")
+            for document in documents:
+                if not document.xml_payload_id:
+                    failures[document] = "No hay archivo XML para enviar a Hacienda."
+                    continue
+                jobs.append((document, company, recepcion_url, document.xml_payload_id._read_payload()))
+
+        send_date = fields.Datetime.now()
+        # As in _send_to_recepcion; once committed, a concurrent send finds them sent and skips them.
+        self.browse([job[0].id for job in jobs]).write({"state": "sent", "send_date": send_date})
+        if auto_commit:
+            self.env.cr.commit()
+        outcomes = self._run_bulk_uploads(jobs, max_workers, token_latencies=token_latencies)
+        upload_latencies = [elapsed for _response, _error, elapsed in outcomes]
+        retry_indexes = [
+            index
+            for index, (response, _error, _elapsed) in enumerate(outcomes)
+            if response is not None and response.status_code == 401
+        ]
+        if retry_indexes:
+            # Renew each rejected token once and retry only the affected uploads.
+            retry = [jobs[index] for index in retry_indexes]
+            for company in {job[1] for job in retry}:
+                self.env["hacienda.auth.token"]._invalidate_access_token(company)
+            retried = self._run_bulk_uploads(retry, max_workers, force_refresh=True, token_latencies=token_latencies)
+            for index, outcome in zip(retry_indexes, retried):
+                outcomes[index] = outcome
+                upload_latencies[index] += outcome[2]
+
+        response_date = fields.Datetime.now()
+        groups = defaultdict(self.browse)
+        payloads = []
+        latencies = []
+        timings = {
+            document.id: {"token_latency": token_latencies.get(document.company_id, 0.0)} for document in failures
+        }
+        for document, message in failures.items():
+            groups[(("state", "error"), ("message", message))] |= document
+        for (document, company, _url, _xml), (response, error, elapsed), upload_latency in zip(
+            jobs, outcomes, upload_latencies
+        ):
+            latencies.append(elapsed)
+            if response is not None and error is None:
+                try:
+                    response.raise_for_status()
+                except requests.RequestException as exc:
+                    error = exc
+            timings[document.id] = {
+                "token_latency": token_latencies[company],
+                "request_latency": upload_latency,
+                "http_status": response.status_code if response is not None else False,
+                "response_size": len(response.content or b"") if response is not None else 0,
+                "error_class": _error_class(error),
+            }
+            if isinstance(error, HaciendaTokenError):
+                failures[document] = str(error)
+                groups[(("state", "error"), ("message", failures[document]), ("send_date", False))] |= document
+                continue
+            if error is not None:
+                _logger.warning("Error enviando documento %s a Hacienda: %s", document.name, error)
+                failures[document] = "Error de comunicación con Hacienda. Consulte los registros del sistema."
+                groups[(("state", "error"), ("message", failures[document]), ("send_date", send_date))] |= document
+                continue
+            message, state = self._process_hacienda_response(response)
+            values = {
+                "message": message,
+                "state": state,
+                "send_date": send_date,
+                "response_date": response_date,
+                "poll_count": 0,
+                "next_poll_date": self._next_hacienda_poll_date(0) if state == "sent" else False,
+            }
+            groups[tuple(sorted(values.items()))] |= document
+            if response.content:
+                payloads.append((document, response.content))
+
+        for values, documents in groups.items():
+            documents.write(dict(values))
+        stored = self.env["hacienda.xml.payload"]._store_payloads([content for _document, content in payloads])
+        for (document, _content), payload in zip(payloads, stored):
+            document.write(
+                {
+                    "response_payload_id": payload.id,
+                    "xml_response_filename": document._build_response_filename(),
+                }
+            )
+        documents_to_send._log_hacienda_attempt("send", timings)
+
+        metrics = self.env["hacienda.metrics"]._get_metrics_registry()
+        for document, company, _url, _xml in jobs:
+            timing = timings[document.id]
+            outcome = "error" if timing["error_class"] else document.state
+            metrics.observe("upload", timing["request_latency"], company.id, outcome, document=document.name)
+        uploaded = {job[0] for job in jobs}
+        for document in documents_to_send:
+            if document not in uploaded:
+                metrics.count("upload", "refused", document.company_id.id, document=document.name)
+        metrics.flush()
+
+        elapsed = time.perf_counter() - started
+        states = defaultdict(int)
+        for document in documents_to_send:
+            states[document.state] += 1
+        report = {
+            "documents": len(documents_to_send),
+            "uploaded": len(jobs),
+            "failed": len(failures),
+            "states": dict(states),
+            "seconds": elapsed,
+            "documents_per_second": len(documents_to_send) / elapsed if elapsed else 0.0,
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+        }
+        _logger.info(
+            "Envío masivo a Hacienda: %(documents)s documentos en %(seconds).2fs "
+            "(%(documents_per_second).1f doc/s, p50 %(latency_p50).3fs, p95 %(latency_p95).3fs, "
+            "%(failed)s fallidos)",
+            report,
+        )
+        return report
+
+    def _run_bulk_uploads(self, jobs, max_workers, force_refresh=False, token_latencies=None):
+        if not jobs:
+            return []
+        tokens = {}
+        for company in {job[1] for job in jobs}:
+            tokens[company], seconds = self._timed_authenticate_with_hacienda(company, force_refresh=force_refresh)
+            if token_latencies is not None:
+                token_latencies[company] += seconds
+        session = get_session(self.env)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+            futures = [
+                executor.submit(_post_hacienda_document, session, url, xml_content, tokens[company])
+                if tokens[company]
+                else None
+                for _document, company, url, xml_content in jobs
+            ]
+            return [
+                future.result()
+                if future
+                else (None, HaciendaTokenError("No se pudo obtener un token de Hacienda."), 0.0)
+                for future in futures
+            ]
+
+    @api.model
+    def _format_bulk_send_report(self, report):
+        states = dict(self._fields["state"].selection)
+        summary = ", ".join(f"{states.get(state, state)}: {count}" for state, count in sorted(report["states"].items()))
+        return (
+            f"{report['documents']} documentos en {report['seconds']:.1f} s "
+            f"({report['documents_per_second']:.1f} doc/s). "
+            f"Latencia p50 {report['latency_p50']:.2f} s, p95 {report['latency_p95']:.2f} s. "
+            f"Fallidos: {report['failed']}. {summary}"
+        )
 
     def _action_send_to_hacienda(self):
         self.ensure_one()
-        if not self.xml_file:
+        if self.state not in HACIENDA_SENDABLE_STATES:
+            raise UserError("Solo se pueden enviar a Hacienda documentos en borrador, en cola o con error.")
+        if not self.xml_payload_id:
             raise UserError("No hay archivo XML para enviar a Hacienda.")
 
         company = self.company_id
@@ -79,26 +610,47 @@ class HaciendaElectronicDocument(models.Model):
                 "Debe configurar la URL del API, usuario y contraseña de Hacienda en Ajustes > Hacienda."
             )
 
-        token = self._authenticate_with_hacienda(base_url, username, password)
+        timing = {"token_latency": 0.0, "request_latency": 0.0}
+        self._send_to_recepcion(company, base_url, timing)
+        self._log_hacienda_attempt("send", {self.id: timing})
+        metrics = self.env["hacienda.metrics"]._get_metrics_registry()
+        if "http_status" in timing or timing.get("error_class"):
+            outcome = "error" if timing.get("error_class") else self.state
+            metrics.observe("upload", timing["request_latency"], company.id, outcome, document=self.name)
+        else:
+            metrics.count("upload", "refused", company.id, document=self.name)
+        metrics.flush()
+
+    def _send_to_recepcion(self, company, base_url, timing):
+        """Upload the XML and store the outcome; ``timing`` receives the attempt measurements."""
+        token, timing["token_latency"] = self._timed_authenticate_with_hacienda(company)
         if not token:
             self.write({"state": "error", "message": "No se pudo obtener un token de Hacienda."})
             return
 
-        xml_content = base64.b64decode(self.xml_file)
+        xml_content = self.xml_payload_id._read_payload()
         recepcion_url = urljoin(base_url.rstrip("/") + "/", "recepcion")
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/xml",
-            "Accept": "application/json, application/xml",
-        }
 
         self.write({"send_date": fields.Datetime.now(), "state": "sent"})
 
+        response = None
+        refresh_latency = 0.0
+        started = time.perf_counter()
         try:
-            response = requests.post(recepcion_url, data=xml_content, headers=headers, timeout=60)
+            response = self._post_to_recepcion(recepcion_url, xml_content, token)
+            if response.status_code == 401:
+                # The cached token was revoked or expired early: renew it once.
+                self.env["hacienda.auth.token"]._invalidate_access_token(company)
+                token, refresh_latency = self._timed_authenticate_with_hacienda(company, force_refresh=True)
+                timing["token_latency"] += refresh_latency
+                if not token:
+                    self.write({"state": "error", "message": "No se pudo obtener un token de Hacienda."})
+                    return
+                response = self._post_to_recepcion(recepcion_url, xml_content, token)
             response.raise_for_status()
         except requests.RequestException as exc:
             _logger.exception("Error enviando documento a Hacienda: %s", exc)
+            timing["error_class"] = _error_class(exc)
             self.write(
                 {
                     "state": "error",
@@ -106,17 +658,24 @@ class HaciendaElectronicDocument(models.Model):
                 }
             )
             return
+        finally:
+            timing["request_latency"] = time.perf_counter() - started - refresh_latency
+            if response is not None:
+                timing["http_status"] = response.status_code
+                timing["response_size"] = len(response.content or b"")
 
         message, state = self._process_hacienda_response(response)
         values = {
             "message": message,
             "state": state,
             "response_date": fields.Datetime.now(),
+            "poll_count": 0,
+            "next_poll_date": self._next_hacienda_poll_date(0) if state == "sent" else False,
         }
         if response.content:
             values.update(
                 {
-                    "xml_response": base64.b64encode(response.content),
+                    "response_payload_id": self.env["hacienda.xml.payload"]._store_payload(response.content).id,
                     "xml_response_filename": self._build_response_filename(),
                 }
             )
@@ -126,46 +685,146 @@ class HaciendaElectronicDocument(models.Model):
     # Helpers
     # ------------------------------------------------------------------
 
-    def _authenticate_with_hacienda(self, base_url, username, password):
-        token_url = urljoin(base_url.rstrip("/") + "/", "token")
-        payload = {"username": username, "password": password}
-        headers = {"Content-Type": "application/json"}
-        try:
-            response = requests.post(token_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-        except requests.RequestException as exc:
-            _logger.exception("Error autenticando contra Hacienda: %s", exc)
-            return None
+    def _log_hacienda_attempt(self, kind, timings=None):
+        """Record the current state and payloads of the documents as an attempt of ``kind``.
 
-        try:
-            data = response.json()
-        except ValueError:
-            data = {}
-        token = data.get("access_token") or data.get("token") or data.get("id_token")
-        return token
+        ``timings`` maps document ids to the measurements of their attempt
+        (latencies, HTTP status, response size and error class).
+        """
+        if not self:
+            return
+        timings = timings or {}
+        self.env["hacienda.electronic.document.attempt"].create(
+            [
+                {
+                    **timings.get(document.id, {}),
+                    "document_id": document.id,
+                    "company_id": document.company_id.id,
+                    "kind": kind,
+                    "state": document.state,
+                    "message": document.message,
+                    "xml_filename": document.xml_filename,
+                    "xml_payload_id": document.xml_payload_id.id,
+                    "xml_response_filename": document.xml_response_filename,
+                    "response_payload_id": document.response_payload_id.id,
+                }
+                for document in self
+            ]
+        )
+
+    def _authenticate_with_hacienda(self, company, force_refresh=False):
+        return self.env["hacienda.auth.token"]._get_access_token(company, force_refresh=force_refresh)
+
+    def _timed_authenticate_with_hacienda(self, company, force_refresh=False):
+        """Return the access token of ``company`` and the seconds it took to get it."""
+        started = time.perf_counter()
+        token = self._authenticate_with_hacienda(company, force_refresh=force_refresh)
+        elapsed = time.perf_counter() - started
+        self.env["hacienda.metrics"]._get_metrics_registry().observe(
+            "authenticate", elapsed, company.id, "ok" if token else "error", force_refresh=force_refresh
+        )
+        return token, elapsed
+
+    def _post_to_recepcion(self, recepcion_url, xml_content, token):
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/xml",
+            "Accept": "application/json, application/xml",
+        }
+        return get_session(self.env).post(recepcion_url, data=xml_content, headers=headers, timeout=60)
 
     def _process_hacienda_response(self, response):
         message = "Documento enviado a Hacienda correctamente."
         state = "sent"
+        if response.status_code == 202:
+            message = "Documento recibido por Hacienda, pendiente de validación."
         content_type = response.headers.get("Content-Type", "")
         if "json" in content_type:
             try:
                 data = response.json()
             except ValueError:
                 data = {}
-            message = data.get("message") or data.get("detalle") or message
-            status = (data.get("status") or data.get("estado") or "").lower()
-            if status in {"aceptado", "accepted"}:
-                state = "accepted"
-            elif status in {"rechazado", "rejected"}:
-                state = "rejected"
-            elif status in {"error", "errores"}:
-                state = "error"
+            message, state = self._parse_hacienda_status(data, message)
         return message, state
 
+    @api.model
+    def _parse_hacienda_status(self, data, default_message=False):
+        message = data.get("message") or data.get("detalle") or default_message
+        status = (data.get("ind-estado") or data.get("status") or data.get("estado") or "").lower()
+        state = "sent"
+        if status in {"aceptado", "accepted"}:
+            state = "accepted"
+        elif status in {"rechazado", "rejected"}:
+            state = "rejected"
+        elif status in {"error", "errores"}:
+            state = "error"
+        return message, state
+
+    @api.model
+    def _extract_hacienda_response_detail(self, response_xml):
+        """Return the ``DetalleMensaje`` of a ``MensajeHacienda`` given as bytes."""
+        if etree is None:
+            return False
+        try:
+            root = etree.fromstring(response_xml)
+        except (ValueError, etree.XMLSyntaxError):
+            return False
+        detail = root.find("{*}DetalleMensaje")
+        return detail.text.strip() if detail is not None and detail.text else False
+
+    @api.model
+    def _next_hacienda_poll_date(self, poll_count):
+        delay = HACIENDA_POLL_INTERVALS[min(poll_count, len(HACIENDA_POLL_INTERVALS) - 1)]
+        return fields.Datetime.now() + timedelta(seconds=delay)
+
     def _build_response_filename(self):
         timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
         base_name = self.xml_filename or (self.name + ".xml")
         if base_name.endswith(".xml"):
             base_name = base_name[:-4]
         return f"{base_name}_respuesta_{timestamp}.xml"
+
+
+class HaciendaElectronicDocumentAttempt(models.Model):
+    _name = "hacienda.electronic.document.attempt"
+    _inherit = ["hacienda.xml.payload.mixin"]
+    _description = "Intento de documento electrónico Hacienda"
+    _order = "date desc, id desc"
+
+    # Emptied when the document is archived; the attempt then points to its archive entry.
+    document_id = fields.Many2one(
+        comodel_name="hacienda.electronic.document",
+        string="Documento",
+        ondelete="set null",
+        index=True,
+    )
+    archive_entry_id = fields.Many2one(
+        comodel_name="hacienda.archive.entry",
+        string="Comprobante archivado",
+        ondelete="set null",
+        index="btree_not_null",
+        readonly=True,
+    )
+    kind = fields.Selection(
+        [("generate", "Generación"), ("send", "Envío"), ("poll", "Consulta de estado")],
+        string="Tipo",
+        required=True,
+    )
+    date = fields.Datetime(string="Fecha", required=True, default=fields.Datetime.now)
+    # Stored on the attempt, so that the reports by company outlive the archived documents.
+    company_id = fields.Many2one(comodel_name="res.company", string="Compañía", index=True, readonly=True)
+    state = fields.Selection(
+        selection=lambda self: self.env["hacienda.electronic.document"]._fields["state"].selection,
+        string="Estado",
+    )
+    message = fields.Text(string="Mensaje Hacienda")
+    token_latency = fields.Float(string="Latencia token (s)", digits=(16, 3), aggregator="avg")
+    request_latency = fields.Float(
+        string="Latencia solicitud (s)",
+        digits=(16, 3),
+        aggregator="avg",
+        help="Duración de la carga del XML (envíos, reintentos incluidos) o de la consulta de estado.",
+    )
+    http_status = fields.Integer(string="Estado HTTP")
+    response_size = fields.Integer(string="Tamaño respuesta (bytes)", aggregator="avg")
+    error_class = fields.Char(string="Tipo de error")
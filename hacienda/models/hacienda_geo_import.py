@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import base64
+import logging
+import time
+
+from psycopg2.extras import execute_values
+
+from odoo import fields, models
+from odoo.exceptions import UserError
+
+from ..tools.geo_import import collect_division
+from ..tools.geo_index import local_number
+from ..tools.tabular import is_xlsx, iter_csv, iter_xlsx
+from ..tools.text import normalize_search_text
+
+_logger = logging.getLogger(__name__)
+
+# (level, table, parent column, label) in insertion order, parents first.
+HACIENDA_GEO_IMPORT_LEVELS = (
+    ("canton", "hacienda_canton", "province_id", "Cantones"),
+    ("district", "hacienda_district", "canton_id", "Distritos"),
+    ("neighborhood", "hacienda_neighborhood", "district_id", "Barrios"),
+)
+HACIENDA_GEO_MODELS = ("res.country.state", "hacienda.canton", "hacienda.district", "hacienda.neighborhood")
+
+
+class HaciendaGeoImport(models.TransientModel):
+    _name = "hacienda.geo.import"
+    _description = "Importar división territorial"
+
+    file = fields.Binary(string="Archivo", required=True)
+    filename = fields.Char(string="Nombre del archivo")
+    state = fields.Selection([("draft", "Borrador"), ("done", "Importado")], default="draft")
+    summary = fields.Text(string="Resumen", readonly=True)
+    duration = fields.Float(string="Duración (s)", readonly=True, digits=(16, 2))
+
+    def action_import(self):
+        self.ensure_one()
+        started = time.monotonic()
+        counts = self._import_division(self._read_division_file())
+        summary = "\n".join(
+            f"{label}: {inserted} nuevos, {updated} actualizados, {unchanged} sin cambios"
+            for label, (inserted, updated, unchanged) in counts.items()
+        )
+        self.write({"state": "done", "summary": summary, "duration": time.monotonic() - started})
+        _logger.info("Territorial division import %s in %.2fs:\n%s", self.filename or "", self.duration, summary)
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def _read_division_file(self):
+        data = base64.b64decode(self.file or b"")
+        if not data:
+            raise UserError("Seleccione el archivo de la división territorial a importar.")
+        if is_xlsx(data, self.filename):
+            try:  # pragma: no cover - optional dependency handled at runtime
+                import openpyxl  # noqa: F401
+            except ImportError as exc:
+                raise UserError(
+                    "Para importar archivos XLSX instale la librería de Python 'openpyxl' "
+                    "o exporte la división territorial a CSV."
+                ) from exc
+            rows = iter_xlsx(data)
+        else:
+            rows = iter_csv(data)
+        try:
+            division = collect_division(rows)
+        except ValueError as exc:
+            raise UserError(str(exc)) from exc
+        if not division["province"]:
+            raise UserError("El archivo no contiene provincias, cantones ni distritos.")
+        return division
+
+    def _import_division(self, division):
+        """Load ``{level: {full_code: (name, parent_code)}}`` level by level, parents first.
+
+        Provinces are matched with the existing Costa Rican states. Each lower
+        level is written with a single ``INSERT ... ON CONFLICT (code)`` that
+        skips unchanged rows, after mapping parent codes to ids in memory, so a
+        re-run only touches what changed. Rows created earlier with local codes
+        ("01") are renamed to their full path code first instead of duplicated.
+        """
+        counts = {}
+        ids_by_code, counts["Provincias"] = self._import_provinces(division["province"])
+        for model in HACIENDA_GEO_MODELS:
+            self.env[model].flush_model()
+        for level, table, parent_column, label in HACIENDA_GEO_IMPORT_LEVELS:
+            rows = [
+                (code, name, ids_by_code[parent])
+                for code, (name, parent) in division[level].items()
+                if parent in ids_by_code
+            ]
+            if not rows:
+                continue
+            self._rename_local_geo_codes(table, parent_column, rows, {v: k for k, v in ids_by_code.items()})
+            counts[label], level_ids = self._upsert_geo_level(table, parent_column, rows)
+            ids_by_code = level_ids
+        for model in HACIENDA_GEO_MODELS:
+            self.env[model].invalidate_model()
+        self.env["hacienda.geo.index"]._invalidate_geo_index()
+        return counts
+
+    def _import_provinces(self, provinces):
+        country = self.env.ref("base.cr")
+        states = self.env["res.country.state"].search([("country_id", "=", country.id)])
+        by_key = {}
+        for state in states:
+            for key in (state.hacienda_code, state.code, normalize_search_text(state.name)):
+                if key:
+                    by_key.setdefault(key, state)
+        ids_by_code = {}
+        inserted = updated = unchanged = 0
+        for code, (name, _parent) in provinces.items():
+            state = by_key.get(code) or by_key.get(normalize_search_text(name))
+            if not state:
+                state = self.env["res.country.state"].create(
+                    {"name": name, "code": code, "hacienda_code": code, "country_id": country.id}
+                )
+                inserted += 1
+            elif state.hacienda_code != code:
+                state.hacienda_code = code
+                updated += 1
+            else:
+                unchanged += 1
+            ids_by_code[code] = state.id
+        return ids_by_code, (inserted, updated, unchanged)
+
+    def _rename_local_geo_codes(self, table, parent_column, rows, parent_codes):
+        """Give rows stored with a local code the full path code the file uses for them."""
+        wanted = {(parent_id, local_number(code, parent_codes[parent_id])): code for code, _name, parent_id in rows}
+        self.env.cr.execute(
+            f"SELECT id, code, {parent_column} FROM {table} WHERE {parent_column} = ANY(%s)",
+            (list(parent_codes),),
+        )
+        renames = {}
+        for record_id, code, parent_id in self.env.cr.fetchall():
+            target = wanted.get((parent_id, local_number(code, parent_codes[parent_id])))
+            if target and target != code:
+                renames[target] = record_id
+        if renames:
+            # Never steal a code another row already has; the upsert updates that row instead.
+            self.env.cr.execute(f"SELECT code FROM {table} WHERE code = ANY(%s)", (list(renames),))
+            for (code,) in self.env.cr.fetchall():
+                del renames[code]
+        if renames:
+            execute_values(
+                self.env.cr,
+                f"UPDATE {table} t SET code = v.code FROM (VALUES %s) AS v(id, code) WHERE t.id = v.id",
+                [(record_id, code) for code, record_id in renames.items()],
+            )
+
+    def _upsert_geo_level(self, table, parent_column, rows):
+        """Upsert ``(code, name, parent_id)`` rows; return the counts and ``{code: id}`` of the level."""
+        cr = self.env.cr
+        uid = self.env.uid
+        results = execute_values(
+            cr,
+            f"""
+            INSERT INTO {table} AS t (code, name, {parent_column}, create_uid, write_uid, create_date, write_date)
+            VALUES %s
+            ON CONFLICT (code) DO UPDATE
+               SET name = EXCLUDED.name,
+                   {parent_column} = EXCLUDED.{parent_column},
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+             WHERE (t.name, t.{parent_column}) IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.{parent_column})
+            RETURNING (xmax = 0)
+            """,
+            [(code, name, parent_id, uid, uid) for code, name, parent_id in rows],
+            template="(%s, %s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')",
+            page_size=1000,
+            fetch=True,
+        )
+        inserted = sum(1 for (is_insert,) in results if is_insert)
+        cr.execute(f"SELECT code, id FROM {table} WHERE code = ANY(%s)", ([code for code, _name, _parent in rows],))
+        return (inserted, len(results) - inserted, len(rows) - len(results)), dict(cr.fetchall())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models, tools
+
+from ..tools.geo_index import GeoIndex
+
+# System parameter holding the version of the cached geographic index.
+HACIENDA_GEO_INDEX_VERSION_KEY = "hacienda.geo_index_version"
+# Fields whose changes alter the geographic index.
+HACIENDA_GEO_INDEX_FIELDS = {
+    "code",
+    "hacienda_code",
+    "name",
+    "country_id",
+    "province_id",
+    "canton_id",
+    "district_id",
+}
+
+
+class HaciendaGeoIndex(models.AbstractModel):
+    _name = "hacienda.geo.index"
+    _description = "Índice de ubicaciones Hacienda"
+
+    @api.model
+    def _get_geo_index(self):
+        """Return the :class:`GeoIndex` of the Costa Rican territorial division.
+
+        Cached in the registry per version of the division, which models mixing
+        in ``hacienda.geo.cache.mixin`` change with :meth:`_invalidate_geo_index`.
+        The version is read with a plain query, so other workers rebuild the
+        index once the change is committed without any other cache being cleared.
+        """
+        self.env.cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s", (HACIENDA_GEO_INDEX_VERSION_KEY,))
+        row = self.env.cr.fetchone()
+        return self._build_geo_index(row[0] if row else "")
+
+    @api.model
+    @tools.ormcache("version")
+    def _build_geo_index(self, version):
+        env = self.env(su=True)
+        provinces = env["res.country.state"].search_read(
+            [("country_id.code", "=", "CR")], ["code", "hacienda_code", "name"]
+        )
+        cantons = env["hacienda.canton"].search_read([], ["code", "province_id"], load=None)
+        districts = env["hacienda.district"].search_read([], ["code", "canton_id"], load=None)
+        neighborhoods = env["hacienda.neighborhood"].search_read([], ["code", "district_id"], load=None)
+        return GeoIndex(
+            [(row["id"], row["hacienda_code"] or row["code"], None) for row in provinces],
+            [(row["id"], row["code"], row["province_id"]) for row in cantons],
+            [(row["id"], row["code"], row["canton_id"]) for row in districts],
+            [(row["id"], row["code"], row["district_id"]) for row in neighborhoods],
+            province_names={row["id"]: row["name"] for row in provinces},
+        )
+
+    @api.model
+    def _invalidate_geo_index(self):
+        """Give the division a new version, never reused even if the transaction rolls back."""
+        self.env.cr.execute(
+            """
+            INSERT INTO ir_config_parameter (key, value, create_uid, write_uid, create_date, write_date)
+            VALUES (%s, clock_timestamp()::text, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')
+            ON CONFLICT (key) DO UPDATE
+               SET value = EXCLUDED.value, write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+            """,
+            (HACIENDA_GEO_INDEX_VERSION_KEY, self.env.uid, self.env.uid),
+        )
+
+
+class HaciendaGeoCacheMixin(models.AbstractModel):
+    _name = "hacienda.geo.cache.mixin"
+    _description = "Invalidación del índice de ubicaciones Hacienda"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env["hacienda.geo.index"]._invalidate_geo_index()
+        return records
+
+    def write(self, vals):
+        result = super().write(vals)
+        if HACIENDA_GEO_INDEX_FIELDS.intersection(vals):
+            self.env["hacienda.geo.index"]._invalidate_geo_index()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env["hacienda.geo.index"]._invalidate_geo_index()
+        return result
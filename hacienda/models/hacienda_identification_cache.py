@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+
+class HaciendaIdentificationCache(models.Model):
+    _name = "hacienda.identification.cache"
+    _description = "Caché de consultas de identificación Hacienda"
+    _rec_name = "identification"
+
+    endpoint = fields.Char(string="Servicio", required=True, index=True)
+    identification = fields.Char(string="Identificación", required=True, index=True)
+    payload = fields.Json(string="Respuesta")
+    fetched_at = fields.Datetime(string="Consultado", required=True, index=True)
+
+    _sql_constraints = [
+        (
+            "hacienda_identification_cache_unique",
+            "unique(endpoint, identification)",
+            "Solo puede existir una respuesta en caché por servicio e identificación.",
+        ),
+    ]
+
+    @api.model
+    def _get_ttl(self):
+        hours = self.env["ir.config_parameter"].sudo().get_param("hacienda.identification_cache_ttl_hours", 168)
+        return timedelta(hours=float(hours or 0))
+
+    @api.model
+    def _get_fresh_payloads(self, keys):
+        """Return ``{(endpoint, identification): payload}`` for the cached answers younger than the TTL.
+
+        ``keys`` are ``(endpoint, identification)`` pairs, so answers of a former
+        lookup endpoint are never served for the current one.
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        entries = self.sudo().search_read(
+            [
+                ("endpoint", "in", list({endpoint for endpoint, _identification in keys})),
+                ("identification", "in", list({identification for _endpoint, identification in keys})),
+                ("fetched_at", ">=", fields.Datetime.now() - self._get_ttl()),
+            ],
+            ["endpoint", "identification", "payload"],
+        )
+        payloads = {(entry["endpoint"], entry["identification"]): entry["payload"] for entry in entries}
+        return {key: payload for key, payload in payloads.items() if key in keys}
+
+    @api.model
+    def _store_payloads(self, payloads):
+        """Cache ``{(endpoint, identification): payload}``, replacing older answers for the same keys."""
+        if not payloads:
+            return
+        cache = self.sudo()
+        now = fields.Datetime.now()
+        existing = cache.search(
+            [
+                ("endpoint", "in", list({endpoint for endpoint, _identification in payloads})),
+                ("identification", "in", list({identification for _endpoint, identification in payloads})),
+            ]
+        )
+        known = set()
+        for entry in existing:
+            key = (entry.endpoint, entry.identification)
+            if key in payloads:
+                entry.write({"payload": payloads[key], "fetched_at": now})
+                known.add(key)
+        cache.create(
+            [
+                {"endpoint": endpoint, "identification": identification, "payload": payload, "fetched_at": now}
+                for (endpoint, identification), payload in payloads.items()
+                if (endpoint, identification) not in known
+            ]
+        )
+
+    @api.autovacuum
+    def _gc_expired_entries(self):
+        self.sudo().search([("fetched_at", "<", fields.Datetime.now() - self._get_ttl())]).unlink()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import os
+
+from odoo import api, fields, models
+from odoo.tools import str2bool
+
+from ..tools.metrics import get_registry, render_prometheus
+
+# Snapshots of worker processes that stopped writing for this long are dropped.
+METRICS_SNAPSHOT_MAX_AGE = 24 * 3600
+
+
+class HaciendaMetrics(models.AbstractModel):
+    _name = "hacienda.metrics"
+    _description = "Métricas del flujo de facturación electrónica"
+
+    @api.model
+    def _get_metrics_registry(self):
+        """Metrics of the current database in this process; ``hacienda.metrics_log`` enables the span log."""
+        directory = os.path.join(self.env["ir.attachment"]._filestore(), "hacienda_metrics")
+        registry = get_registry(self.env.cr.dbname, directory)
+        registry.log_spans = str2bool(
+            self.env["ir.config_parameter"].sudo().get_param("hacienda.metrics_log", "False"), False
+        )
+        return registry
+
+    @api.model
+    def _flush_metrics(self):
+        self._get_metrics_registry().flush()
+
+    @api.model
+    def _get_queue_gauges(self):
+        """Documents per company and state, and the age of the oldest queued one."""
+        Document = self.env["hacienda.electronic.document"].sudo()
+        depth = [
+            ({"company": company.id, "state": state}, count)
+            for company, state, count in Document._read_group([], ["company_id", "state"], ["__count"])
+        ]
+        now = fields.Datetime.now()
+        oldest = [
+            ({"company": company.id}, max((now - created).total_seconds(), 0.0))
+            for company, created in Document._read_group(
+                [("state", "=", "queued")], ["company_id"], ["create_date:min"]
+            )
+            if created
+        ]
+        companies = self.env["res.company"].sudo().search([])
+        names = [({"company": company.id, "name": company.name}, 1) for company in companies]
+        return [
+            ("documents", "Electronic documents by company and state.", depth),
+            ("queue_oldest_seconds", "Age of the oldest queued document by company.", oldest),
+            ("company_info", "Names of the companies used as labels.", names),
+        ]
+
+    @api.model
+    def _render_prometheus(self):
+        histograms, counters = self._get_metrics_registry().collect()
+        return render_prometheus(histograms, counters, self._get_queue_gauges())
+
+    @api.autovacuum
+    def _gc_stale_metric_snapshots(self):
+        self._get_metrics_registry().prune(METRICS_SNAPSHOT_MAX_AGE)
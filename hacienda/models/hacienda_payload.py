@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import base64
+import logging
+import os
+from datetime import timedelta
+
+from psycopg2.extras import execute_values
+
+from odoo import api, fields, models
+from odoo.tools import human_size
+
+from ..tools import payload_store
+
+_logger = logging.getLogger(__name__)
+
+# Columns holding references to payloads; rows referenced nowhere are garbage collected.
+HACIENDA_PAYLOAD_REFERENCES = (
+    ("hacienda_electronic_document", "xml_payload_id"),
+    ("hacienda_electronic_document", "response_payload_id"),
+    ("hacienda_electronic_document_attempt", "xml_payload_id"),
+    ("hacienda_electronic_document_attempt", "response_payload_id"),
+)
+# Spooled files are stored right after their generation; older ones were left by a failed one.
+HACIENDA_SPOOL_MAX_AGE = 24 * 3600
+
+
+class HaciendaXmlPayload(models.Model):
+    _name = "hacienda.xml.payload"
+    _description = "Contenido XML Hacienda"
+    _rec_name = "checksum"
+
+    checksum = fields.Char(string="SHA-256", required=True, index=True, readonly=True)
+    size = fields.Integer(string="Tamaño", readonly=True)
+    stored_size = fields.Integer(string="Tamaño almacenado", readonly=True)
+    codec = fields.Selection(
+        [(payload_store.CODEC_IDENTITY, "Sin compresión"), (payload_store.CODEC_ZSTD, "Zstandard")],
+        string="Compresión",
+        required=True,
+        default=payload_store.CODEC_IDENTITY,
+        readonly=True,
+    )
+
+    _sql_constraints = [
+        ("hacienda_xml_payload_checksum_unique", "unique(checksum)", "El contenido ya está almacenado."),
+    ]
+
+    @api.model
+    def _get_payload_store(self):
+        return payload_store.PayloadStore(os.path.join(self.env["ir.attachment"]._filestore(), "hacienda_payloads"))
+
+    @api.model
+    def _store_payloads(self, contents):
+        """Store ``contents`` and return their payload records, in the same order.
+
+        Contents are bytes or :class:`~..tools.payload_store.SpooledPayload`
+        files, which are moved into the store and compressed as a stream.
+        Files are written before the rows and rows are upserted on their
+        checksum, so identical contents, within the batch or from concurrent
+        transactions, end up as a single file and a single row. Storing an
+        existing content touches the ``write_date`` of its row, which keeps it
+        from :meth:`_gc_unreferenced_payloads` while it gets referenced.
+        """
+        if not contents:
+            return self.browse()
+        with self.env["hacienda.metrics"]._get_metrics_registry().span("store", payloads=len(contents)):
+            preferred = self.env["ir.config_parameter"].sudo().get_param("hacienda.payload_compression", "zstd")
+            store = self._get_payload_store()
+            rows = {}
+            digests = []
+            for content in contents:
+                spooled = isinstance(content, payload_store.SpooledPayload)
+                digest = content.checksum if spooled else payload_store.checksum(content)
+                digests.append(digest)
+                if digest in rows:
+                    if spooled:
+                        os.unlink(content.path)
+                    continue
+                if spooled:
+                    size = content.size
+                    codec = payload_store.choose_codec_for_size(size, preferred)
+                    stored_size = store.write_file(digest, content.path, codec)
+                else:
+                    size = len(content)
+                    codec = payload_store.choose_codec(content, preferred)
+                    encoded = payload_store.encode(content, codec)
+                    store.write(digest, encoded, codec)
+                    stored_size = len(encoded)
+                rows[digest] = (digest, size, stored_size, codec, self.env.uid, self.env.uid)
+            execute_values(
+                self.env.cr,
+                """
+                INSERT INTO hacienda_xml_payload (
+                    checksum, size, stored_size, codec, create_uid, write_uid, create_date, write_date
+                )
+                VALUES %s
+                ON CONFLICT (checksum) DO UPDATE
+                   SET write_date = EXCLUDED.write_date, write_uid = EXCLUDED.write_uid
+                """,
+                # Sorted, concurrent upserts of the same contents lock the rows in the same order.
+                sorted(rows.values()),
+                template="(%s, %s, %s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')",
+            )
+            self.env.cr.execute("SELECT checksum, id FROM hacienda_xml_payload WHERE checksum = ANY(%s)", (list(rows),))
+            ids = dict(self.env.cr.fetchall())
+            return self.browse([ids[digest] for digest in digests])
+
+    @api.model
+    def _store_payload(self, content):
+        return self._store_payloads([content]) if content else self.browse()
+
+    def _read_payload(self):
+        self.ensure_one()
+        return self._get_payload_store().read(self.checksum, self.codec)
+
+    def _get_binary_value(self, bin_size=False):
+        """Value for a computed ``Binary`` field: base64 bytes, or the human size under ``bin_size``."""
+        if not self:
+            return False
+        if bin_size:
+            return human_size(self.size)
+        return base64.b64encode(self._read_payload())
+
+    @api.autovacuum
+    def _gc_unreferenced_payloads(self):
+        """Delete the payloads no document or attempt uses anymore, then their files.
+
+        Payloads stored during the last day are kept: a transaction may have
+        stored them without having committed the row that references them yet.
+        Rows locked by such a transaction, which is storing the same content
+        again, are skipped. Spooled files of that age were left behind by a
+        failed generation.
+        """
+        self._get_payload_store().prune_spool(HACIENDA_SPOOL_MAX_AGE)
+        references = " AND ".join(
+            f"NOT EXISTS (SELECT 1 FROM {table} r WHERE r.{column} = p.id)"
+            for table, column in HACIENDA_PAYLOAD_REFERENCES
+        )
+        self.env.cr.execute(
+            f"""
+            DELETE FROM hacienda_xml_payload
+             WHERE id IN (
+                    SELECT p.id
+                      FROM hacienda_xml_payload p
+                     WHERE p.write_date < %s
+                       AND {references}
+                       FOR UPDATE SKIP LOCKED
+                   )
+         RETURNING checksum, codec
+            """,
+            (fields.Datetime.now() - timedelta(days=1),),
+        )
+        removed = self.env.cr.fetchall()
+        if not removed:
+            return
+        store = self._get_payload_store()
+
+        @self.env.cr.postcommit.add
+        def _delete_files():
+            for digest, codec in removed:
+                store.delete(digest, codec)
+
+        _logger.info("Removed %s unreferenced Hacienda payloads", len(removed))
+
+
+class HaciendaXmlPayloadMixin(models.AbstractModel):
+    _name = "hacienda.xml.payload.mixin"
+    _description = "Contenidos XML Hacienda"
+
+    xml_filename = fields.Char(string="Nombre XML")
+    xml_payload_id = fields.Many2one(
+        comodel_name="hacienda.xml.payload",
+        string="Contenido XML",
+        ondelete="restrict",
+        index="btree_not_null",
+        copy=False,
+        readonly=True,
+    )
+    xml_file = fields.Binary(
+        string="Archivo XML",
+        compute="_compute_xml_file",
+        inverse="_inverse_xml_file",
+        attachment=False,
+    )
+    xml_response_filename = fields.Char(string="Nombre respuesta")
+    response_payload_id = fields.Many2one(
+        comodel_name="hacienda.xml.payload",
+        string="Contenido respuesta",
+        ondelete="restrict",
+        index="btree_not_null",
+        copy=False,
+        readonly=True,
+    )
+    xml_response = fields.Binary(
+        string="Respuesta Hacienda",
+        compute="_compute_xml_response",
+        inverse="_inverse_xml_response",
+        attachment=False,
+    )
+
+    # The bytes are only read when the binary itself is requested: lists never
+    # ask for it and forms read it with ``bin_size``, which only needs the row.
+    @api.depends("xml_payload_id")
+    @api.depends_context("bin_size")
+    def _compute_xml_file(self):
+        bin_size = self.env.context.get("bin_size")
+        for record in self:
+            record.xml_file = record.xml_payload_id._get_binary_value(bin_size)
+
+    @api.depends("response_payload_id")
+    @api.depends_context("bin_size")
+    def _compute_xml_response(self):
+        bin_size = self.env.context.get("bin_size")
+        for record in self:
+            record.xml_response = record.response_payload_id._get_binary_value(bin_size)
+
+    def _inverse_xml_file(self):
+        self._store_binary_payloads("xml_file", "xml_payload_id")
+
+    def _inverse_xml_response(self):
+        self._store_binary_payloads("xml_response", "response_payload_id")
+
+    def _store_binary_payloads(self, binary_field, payload_field):
+        records = self.filtered(binary_field)
+        payloads = self.env["hacienda.xml.payload"]._store_payloads(
+            [base64.b64decode(record[binary_field]) for record in records]
+        )
+        for record, payload in zip(records, payloads):
+            record[payload_field] = payload
+        (self - records)[payload_field] = False
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+from urllib.parse import urljoin
+
+import requests
+
+from odoo import api, fields, models
+
+from ..tools.http_client import get_session
+
+_logger = logging.getLogger(__name__)
+
+
+class HaciendaAuthToken(models.Model):
+    _name = "hacienda.auth.token"
+    _description = "Token de autenticación Hacienda"
+
+    # Tokens are renewed this many seconds before they actually expire so a
+    # request never leaves with a token that dies while it is in flight.
+    REFRESH_MARGIN = 60
+
+    company_id = fields.Many2one(
+        comodel_name="res.company",
+        string="Compañía",
+        required=True,
+        ondelete="cascade",
+        index=True,
+    )
+    access_token = fields.Char(string="Token de acceso")
+    expires_at = fields.Datetime(string="Expira")
+    refresh_token = fields.Char(string="Token de refresco")
+    refresh_expires_at = fields.Datetime(string="Refresco expira")
+
+    _sql_constraints = [
+        ("hacienda_auth_token_company_unique", "unique(company_id)", "Solo puede existir un token por compañía."),
+    ]
+
+    @api.model
+    def _get_access_token(self, company, force_refresh=False):
+        """Return a valid access token for ``company``, renewing it when needed.
+
+        Tokens live in the database so every worker shares them. Renewals run in
+        their own cursor and are committed right away; the row lock serializes
+        concurrent renewals so only one worker talks to the IdP at a time.
+        """
+        if not force_refresh:
+            token = self.sudo().search([("company_id", "=", company.id)], limit=1)
+            if token._is_access_token_valid():
+                return token.access_token
+
+        with self.env.registry.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, self.env.context)
+            Token = env[self._name].sudo()
+            cr.execute(
+                """
+                INSERT INTO hacienda_auth_token (company_id, create_uid, create_date, write_uid, write_date)
+                     VALUES (%s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+                ON CONFLICT (company_id) DO NOTHING
+                """,
+                (company.id, env.uid, env.uid),
+            )
+            cr.execute("SELECT id FROM hacienda_auth_token WHERE company_id = %s FOR UPDATE", (company.id,))
+            token = Token.browse(cr.fetchone()[0])
+            # Another worker may have renewed the token while we waited for the lock.
+            if not force_refresh and token._is_access_token_valid():
+                return token.access_token
+            return token._renew(env["res.company"].browse(company.id))
+
+    @api.model
+    def _invalidate_access_token(self, company):
+        """Forget the cached token, e.g. after Hacienda answered 401."""
+        with self.env.registry.cursor() as cr:
+            cr.execute(
+                """
+                UPDATE hacienda_auth_token
+                   SET access_token = NULL, expires_at = NULL
+                 WHERE company_id = %s
+                """,
+                (company.id,),
+            )
+        self.sudo().search([("company_id", "=", company.id)]).invalidate_recordset()
+
+    @api.model
+    def _clear_company_tokens(self, companies):
+        self.sudo().search([("company_id", "in", companies.ids)]).unlink()
+
+    def _is_access_token_valid(self):
+        if not self or not self.access_token or not self.expires_at:
+            return False
+        return self.expires_at > fields.Datetime.now() + timedelta(seconds=self.REFRESH_MARGIN)
+
+    def _is_refresh_token_valid(self):
+        if not self.refresh_token:
+            return False
+        if not self.refresh_expires_at:
+            return True
+        return self.refresh_expires_at > fields.Datetime.now() + timedelta(seconds=self.REFRESH_MARGIN)
+
+    def _renew(self, company):
+        self.ensure_one()
+        base_url = (company.hacienda_api_base_url or "").strip()
+        username = (company.hacienda_username or "").strip()
+        password = (company.hacienda_password or "").strip()
+        if not base_url or not username or not password:
+            return None
+
+        data = None
+        if self._is_refresh_token_valid():
+            data = self._request_token(
+                base_url, {"grant_type": "refresh_token", "refresh_token": self.refresh_token}
+            )
+        if not data:
+            data = self._request_token(base_url, {"username": username, "password": password})
+        if not data:
+            self.write(
+                {"access_token": False, "expires_at": False, "refresh_token": False, "refresh_expires_at": False}
+            )
+            return None
+
+        access_token = data.get("access_token") or data.get("token") or data.get("id_token")
+        now = fields.Datetime.now()
+        values = {
+            "access_token": access_token,
+            "expires_at": now + timedelta(seconds=self._coerce_seconds(data.get("expires_in"), 300)),
+            "refresh_token": data.get("refresh_token") or False,
+            "refresh_expires_at": False,
+        }
+        refresh_expires_in = self._coerce_seconds(data.get("refresh_expires_in"), 0)
+        if refresh_expires_in:
+            values["refresh_expires_at"] = now + timedelta(seconds=refresh_expires_in)
+        self.write(values)
+        return access_token
+
+    @api.model
+    def _request_token(self, base_url, payload):
+        token_url = urljoin(base_url.rstrip("/") + "/", "token")
+        headers = {"Content-Type": "application/json"}
+        try:
+            response = get_session(self.env).post(token_url, json=payload, headers=headers, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as exc:
+            _logger.exception("Error autenticando contra Hacienda: %s", exc)
+            return None
+
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _coerce_seconds(value, default):
+        try:
+            return max(int(value), 0)
+        except (TypeError, ValueError):
+            return default
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models
+
+
+class ResCountryState(models.Model):
+    _name = "res.country.state"
+    _inherit = ["res.country.state", "hacienda.geo.cache.mixin"]
+
+    hacienda_code = fields.Char(
+        string="Código Hacienda",
+        help="Código numérico de la provincia en la división territorial oficial (1 = San José).",
+    )
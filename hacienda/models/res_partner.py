@@ -1,14 +1,33 @@
 # -*- coding: utf-8 -*-
 import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
 from odoo import api, fields, models
 from odoo.exceptions import UserError
 
+from ..tools.http_client import get_session
+from ..tools.rate_limit import RateLimiter
+
 _logger = logging.getLogger(__name__)
 
 
+def _fetch_identification(session, url, limiter=None):
+    """GET an ``identificacion`` endpoint. Runs in worker threads: no ORM access."""
+    if limiter:
+        limiter.acquire()
+    try:
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        return response.status_code, (response.json() if response.content else {}), None
+    except (requests.RequestException, ValueError) as exc:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+        return status, None, exc
+
+
 class ResPartner(models.Model):
     _inherit = "res.partner"
 
@@ -57,78 +76,165 @@ class ResPartner(models.Model):
         ]
 
     def action_fetch_hacienda_identification(self):
+        if len(self) > 1:
+            report = self._fetch_hacienda_identification_batch()
+            return {
+                "type": "ir.actions.client",
+                "tag": "display_notification",
+                "params": {
+                    "title": "Consulta de identificaciones",
+                    "message": self._format_identification_report(report),
+                    "type": "warning" if report["errors"] else "success",
+                    "sticky": bool(report["errors"]),
+                },
+            }
         for partner in self:
             if not partner.hacienda_identification:
                 raise UserError("Debe indicar el número de identificación antes de consultar a Hacienda.")
 
-            company = partner.company_id or self.env.company
-            base_url = company.hacienda_api_base_url
+            base_url = partner._get_hacienda_identification_base_url()
             if not base_url:
                 raise UserError("Configure la URL del API de Hacienda en Ajustes > Hacienda.")
 
-            endpoint = f"{base_url.rstrip('/')}/identificacion/{partner.hacienda_identification}"
-            try:
-                response = requests.get(endpoint, timeout=30)
-                response.raise_for_status()
-            except requests.RequestException as exc:
-                _logger.exception("Error consultando Hacienda: %s", exc)
-                raise UserError("No fue posible obtener la información desde Hacienda.")
-
-            data = response.json() if response.content else {}
+            key = (base_url.rstrip("/"), partner.hacienda_identification.strip())
+            cache = self.env["hacienda.identification.cache"]
+            data = cache._get_fresh_payloads([key]).get(key)
+            if data is None:
+                status, data, error = _fetch_identification(get_session(self.env), f"{key[0]}/identificacion/{key[1]}")
+                if error:
+                    _logger.error("Error consultando Hacienda: %s", error)
+                    raise UserError("No fue posible obtener la información desde Hacienda.")
+                if data:
+                    cache._store_payloads({key: data})
             if not data:
                 raise UserError("Hacienda no retornó información para la identificación indicada.")
 
-            partner_values = {}
-            name = data.get("nombre") or data.get("name")
-            if name:
-                partner_values["name"] = name
-
-            email = data.get("email")
-            if email:
-                partner_values["email"] = email
-
-            phone = data.get("telefono") or data.get("phone")
-            if phone:
-                partner_values["phone"] = phone
-
-            address = data.get("direccion") or {}
-            if address:
-                partner_values.update(
-                    {
-                        "street": address.get("linea1") or address.get("street"),
-                        "zip": address.get("codigo_postal") or address.get("zip"),
-                    }
-                )
-                province_code = address.get("provincia") or address.get("province")
-                canton_code = address.get("canton")
-                district_code = address.get("distrito")
-                neighborhood_code = address.get("barrio")
-
-                if province_code:
-                    province = self.env["res.country.state"].search([("code", "=", province_code)], limit=1)
-                    if not province:
-                        province = self.env["res.country.state"].search([("name", "ilike", province_code)], limit=1)
-                    if province:
-                        partner_values["hacienda_province_id"] = province.id
-
-                if canton_code:
-                    canton = self.env["hacienda.canton"].search([("code", "=", canton_code)], limit=1)
-                    if canton:
-                        partner_values["hacienda_canton_id"] = canton.id
-
-                if district_code:
-                    district = self.env["hacienda.district"].search([("code", "=", district_code)], limit=1)
-                    if district:
-                        partner_values["hacienda_district_id"] = district.id
-
-                if neighborhood_code:
-                    neighborhood = self.env["hacienda.neighborhood"].search([("code", "=", neighborhood_code)], limit=1)
-                    if neighborhood:
-                        partner_values["hacienda_neighborhood_id"] = neighborhood.id
-
+            partner_values = partner._prepare_hacienda_identification_values(data)
             if partner_values:
                 partner.write(partner_values)
 
+    def _get_hacienda_identification_base_url(self):
+        company = self.company_id or self.env.company
+        return (company.hacienda_api_base_url or "").strip()
+
+    def _prepare_hacienda_identification_values(self, data):
+        """Partner values from an ``identificacion`` answer of Hacienda."""
+        partner_values = {}
+        name = data.get("nombre") or data.get("name")
+        if name:
+            partner_values["name"] = name
+
+        email = data.get("email")
+        if email:
+            partner_values["email"] = email
+
+        phone = data.get("telefono") or data.get("phone")
+        if phone:
+            partner_values["phone"] = phone
+
+        address = data.get("direccion") or {}
+        if address:
+            partner_values.update(
+                {
+                    "street": address.get("linea1") or address.get("street"),
+                    "zip": address.get("codigo_postal") or address.get("zip"),
+                }
+            )
+            resolved = self.env["hacienda.geo.index"]._get_geo_index().resolve(
+                province=address.get("provincia") or address.get("province"),
+                canton=address.get("canton"),
+                district=address.get("distrito"),
+                neighborhood=address.get("barrio"),
+            )
+            for level, record_id in resolved.items():
+                partner_values[f"hacienda_{level}_id"] = record_id
+        return partner_values
+
+    def _fetch_hacienda_identification_batch(self, max_workers=None):
+        """Look up the identification of every partner concurrently and update them in bulk.
+
+        Answers are served from ``hacienda.identification.cache`` when fresh, so
+        each number is fetched at most once per TTL and lookup endpoint whatever
+        the number of partners (or companies) sharing it. Fetches run in a thread pool over
+        plain data, spaced by ``hacienda.identification_rate_limit`` requests per
+        second. Failures are collected per partner instead of aborting the run.
+        """
+        started = time.perf_counter()
+        params = self.env["ir.config_parameter"].sudo()
+        if max_workers is None:
+            max_workers = int(params.get_param("hacienda.identification_workers", 8) or 1)
+        rate = float(params.get_param("hacienda.identification_rate_limit", 10) or 0)
+
+        errors = {}
+        partners_by_key = defaultdict(lambda: self.browse())
+        for partner in self:
+            identification = (partner.hacienda_identification or "").strip()
+            base_url = partner._get_hacienda_identification_base_url()
+            if not identification:
+                errors[partner.id] = "Sin número de identificación."
+            elif not base_url:
+                errors[partner.id] = "Falta la URL del API de Hacienda."
+            else:
+                partners_by_key[(base_url.rstrip("/"), identification)] |= partner
+
+        cache = self.env["hacienda.identification.cache"]
+        payloads = cache._get_fresh_payloads(partners_by_key)
+        cached = len(payloads)
+        missing = [key for key in partners_by_key if key not in payloads]
+        if missing:
+            session = get_session(self.env)
+            limiter = RateLimiter(rate)
+            with ThreadPoolExecutor(max_workers=max(min(max_workers, len(missing)), 1)) as executor:
+                results = executor.map(
+                    lambda key: _fetch_identification(session, f"{key[0]}/identificacion/{key[1]}", limiter), missing
+                )
+                fetched = {}
+                for key, (status, data, error) in zip(missing, results):
+                    if error or not data:
+                        message = str(error) if error else f"Hacienda no retornó información (HTTP {status})."
+                        for partner in partners_by_key[key]:
+                            errors[partner.id] = message
+                    else:
+                        fetched[key] = data
+            cache._store_payloads(fetched)
+            payloads.update(fetched)
+
+        updated = 0
+        for key, partners in partners_by_key.items():
+            data = payloads.get(key)
+            if not data:
+                continue
+            values = partners[:1]._prepare_hacienda_identification_values(data)
+            if values:
+                partners.write(values)
+                updated += len(partners)
+
+        report = {
+            "partners": len(self),
+            "updated": updated,
+            "cached": cached,
+            "fetched": len(missing),
+            "errors": {self.browse(partner_id).display_name: message for partner_id, message in errors.items()},
+            "seconds": time.perf_counter() - started,
+        }
+        _logger.info(
+            "Hacienda identification batch: %(partners)s partners, %(updated)s updated, "
+            "%(cached)s cached, %(fetched)s fetched in %(seconds).2fs",
+            report,
+        )
+        return report
+
+    @api.model
+    def _format_identification_report(self, report):
+        message = (
+            f"{report['updated']} de {report['partners']} contactos actualizados en {report['seconds']:.1f} s "
+            f"({report['cached']} desde caché, {report['fetched']} consultas)."
+        )
+        if report["errors"]:
+            details = "; ".join(f"{name}: {error}" for name, error in list(report["errors"].items())[:20])
+            message += f" Errores ({len(report['errors'])}): {details}"
+        return message
+
     @api.onchange("hacienda_province_id")
     def _onchange_hacienda_province_id(self):
         self.hacienda_canton_id = False
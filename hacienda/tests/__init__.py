@@ -0,0 +1,4 @@
+from . import test_cabys_classifier
+from . import test_geo_index
+from . import test_signing
+from . import test_xml_queries
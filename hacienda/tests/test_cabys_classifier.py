@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+from ..tools.cabys_classifier import Bm25Index, build_query
+
+CABYS_DESCRIPTIONS = [
+    (1, "Tornillos de acero"),
+    (2, "Clavos de acero"),
+    (3, "Pan de trigo"),
+    (4, "Leche entera"),
+    (5, "Arandelas y tuercas de metal"),
+    (6, "Tubos de plástico"),
+]
+
+
+@tagged("post_install", "-at_install")
+class TestCabysClassifier(TransactionCase):
+    """Confidence of the BM25 suggestions against the auto-apply threshold."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.index = Bm25Index(CABYS_DESCRIPTIONS)
+        cls.min_confidence = cls.env["hacienda.cabys.classifier"].default_get(["min_confidence"])["min_confidence"]
+
+    def test_matched_query_reaches_threshold(self):
+        best = self.index.search(build_query("Tornillos", "Acero"))[0]
+        self.assertEqual(best.doc_id, 1)
+        self.assertGreaterEqual(best.confidence, self.min_confidence)
+
+    def test_unmatched_category_lowers_confidence(self):
+        alone = self.index.search(build_query("Tornillo"))[0]
+        with_category = self.index.search(build_query("Tornillo", "Ferreteria"))[0]
+        self.assertEqual(with_category.doc_id, 1)
+        self.assertLess(with_category.confidence, alone.confidence)
+        self.assertLess(with_category.confidence, self.min_confidence)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+from ..tools.geo_index import GeoIndex
+
+
+@tagged("post_install", "-at_install")
+class TestHaciendaGeoIndex(TransactionCase):
+    """Addresses resolve through code paths, or stored codes when the province has none."""
+
+    def _index(self, province_code):
+        return GeoIndex(
+            [(1, province_code, None), (2, "A" if province_code == "SJ" else "2", None)],
+            [(10, "101", 1), (11, "201", 2)],
+            [(20, "10101", 10)],
+            [(30, "1010101", 20)],
+            province_names={1: "San José", 2: "Alajuela"},
+        )
+
+    def test_resolve_by_path(self):
+        index = self._index("1")
+        self.assertEqual(
+            index.resolve("1", "01", "01", "01"), {"province": 1, "canton": 10, "district": 20, "neighborhood": 30}
+        )
+        self.assertEqual(index.local_code("district", 20), "01")
+
+    def test_resolve_under_province_without_path(self):
+        # Stock Odoo states keep letter codes until the territorial division is imported.
+        index = self._index("SJ")
+        self.assertEqual(
+            index.resolve("San José", "101", "10101", "1010101"),
+            {"province": 1, "canton": 10, "district": 20, "neighborhood": 30},
+        )
+        self.assertEqual(index.resolve("1", "101", "10101"), {"canton": 10, "district": 20})
+
+    def test_resolve_rejects_canton_of_another_province(self):
+        self.assertEqual(self._index("SJ").resolve("San José", "201"), {"province": 1})
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from lxml import etree
+
+from odoo.tests import TransactionCase, tagged
+
+from ..benchmarks.xml_benchmark import CERTIFICATE_PIN, make_test_certificate
+from ..tools.signing import load_signing_material
+from ..tools.xml_builder import HACIENDA_ROOT_TAG, HACIENDA_XMLNS
+from ..tools.xml_stream import DS_NS
+
+
+@tagged("post_install", "-at_install")
+class TestHaciendaSigning(TransactionCase):
+    """The enveloped XAdES signature covers the whole document (``Reference URI=""``).
+
+    Passing ``reference_uri=""`` to signxml 5 fails with "Unable to resolve
+    reference URI: #"; the signer leaves it out instead.
+    """
+
+    def test_signature_references_the_whole_document(self):
+        from signxml import xades
+
+        material = load_signing_material(make_test_certificate(), CERTIFICATE_PIN, HACIENDA_XMLNS)
+        root = etree.Element(etree.QName(HACIENDA_XMLNS, HACIENDA_ROOT_TAG), nsmap={None: HACIENDA_XMLNS})
+        etree.SubElement(root, etree.QName(HACIENDA_XMLNS, "Clave")).text = "1"
+
+        signed = material.sign(root)
+
+        references = signed.findall(f"{{{DS_NS}}}Signature/{{{DS_NS}}}SignedInfo/{{{DS_NS}}}Reference")
+        self.assertEqual(references[0].get("URI"), "")
+        verified = xades.XAdESVerifier().verify(
+            etree.tostring(signed), x509_cert=material.cert_chain[0].decode(), expect_references=3
+        )
+        self.assertEqual(len(verified), 3)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+from ..tools import xml_builder
+
+
+@tagged("post_install", "-at_install")
+class TestHaciendaXmlQueries(AccountTestInvoicingCommon):
+    """The XML inputs of a batch are read in a number of queries that does not depend on its size."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company_data["default_journal_sale"].write(
+            {
+                "cr_use_xml_44": True,
+                "cr_electronic_document_type": "FE",
+                "cr_branch_number": "1",
+                "cr_terminal_number": "1",
+            }
+        )
+
+    def _create_invoices(self, count, lines_per_invoice=1):
+        # Left in draft: posting would send them to Hacienda.
+        partners = [self.partner_a, self.partner_b]
+        products = [self.product_a, self.product_b]
+        invoices = self.env["account.move"]
+        for index in range(count):
+            invoices |= self.init_invoice(
+                "out_invoice",
+                partner=partners[index % 2],
+                invoice_date="2024-01-01",
+                products=[products[line % 2] for line in range(lines_per_invoice)],
+                taxes=self.tax_sale_a,
+            )
+        return invoices
+
+    def _build_xml_trees(self, moves):
+        prefetch = moves._prefetch_hacienda_xml_values()
+        return [
+            xml_builder.build_invoice_tree(
+                move._prepare_hacienda_xml_data(move._get_hacienda_emission_date(), prefetch)
+            )
+            for move in moves
+        ]
+
+    def _count_queries(self, moves):
+        self.env.flush_all()
+        self.env.invalidate_all()
+        count = self.env.cr.sql_log_count
+        self._build_xml_trees(moves)
+        return self.env.cr.sql_log_count - count
+
+    def _assert_same_query_count(self, small, large):
+        # The first build fills the process caches (geo index), shared by both measures.
+        self._build_xml_trees(small)
+        expected = self._count_queries(small)
+        self.env.flush_all()
+        self.env.invalidate_all()
+        with self.assertQueryCount(expected):
+            trees = self._build_xml_trees(large)
+        self.assertEqual(len(trees), len(large))
+        return trees
+
+    def test_query_count_does_not_depend_on_moves(self):
+        self._assert_same_query_count(self._create_invoices(1), self._create_invoices(10))
+
+    def test_query_count_does_not_depend_on_lines(self):
+        small = self._create_invoices(1)
+        large = self._create_invoices(1, lines_per_invoice=20)
+        trees = self._assert_same_query_count(small, large)
+        self.assertEqual(len(trees[0].findall("{*}DetalleServicio/{*}LineaDetalle")), 20)
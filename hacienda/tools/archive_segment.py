@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Append-only archive segments for old electronic documents.
+
+A segment is a plain file of records laid end to end. Each record holds the
+signed XML and the answer of Hacienda of one document::
+
+    magic (4) | codec (1) | body length (4) | body
+
+where the body, compressed as a whole with ``codec``, is the XML length (4)
+followed by the XML and the answer bytes. Records are never rewritten: the
+database keeps ``(segment, offset, length)`` for each of them and readers map
+the segment in memory to slice a record out without reading the rest. Bytes
+left behind by a rolled back transaction are simply never referenced.
+"""
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from .payload_store import CODEC_IDENTITY, CODEC_ZSTD, choose_codec, decode, encode
+
+RECORD_MAGIC = b"HDA1"
+RECORD_HEADER = struct.Struct(">4sBI")
+XML_LENGTH = struct.Struct(">I")
+CODEC_FLAGS = {CODEC_IDENTITY: 0, CODEC_ZSTD: 1}
+FLAG_CODECS = {flag: codec for codec, flag in CODEC_FLAGS.items()}
+# Segments are rolled over before offsets would leave the range of an int4 column.
+MAX_SEGMENT_SIZE = 1 << 30
+MAPPED_SEGMENTS = 16
+
+
+def pack_record(xml, response, preferred_codec):
+    body = XML_LENGTH.pack(len(xml)) + xml + response
+    codec = choose_codec(body, preferred_codec)
+    encoded = encode(body, codec)
+    return RECORD_HEADER.pack(RECORD_MAGIC, CODEC_FLAGS[codec], len(encoded)) + encoded
+
+
+def unpack_record(data):
+    """Return ``(xml, response)`` from the bytes of one record."""
+    magic, flag, length = RECORD_HEADER.unpack_from(data)
+    if magic != RECORD_MAGIC or flag not in FLAG_CODECS:
+        raise ValueError("Invalid archive record")
+    body = decode(bytes(data[RECORD_HEADER.size:RECORD_HEADER.size + length]), FLAG_CODECS[flag])
+    (xml_length,) = XML_LENGTH.unpack_from(body)
+    xml_end = XML_LENGTH.size + xml_length
+    return body[XML_LENGTH.size:xml_end], body[xml_end:]
+
+
+def append_records(path, records):
+    """Append packed ``records`` to the segment at ``path``; return their ``(offset, length)``.
+
+    Offsets start at the current end of the file, so a torn write left by a
+    crash only wastes space. The file is synced before returning, which makes
+    the positions safe to commit.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    positions = []
+    with open(path, "ab") as segment:
+        offset = segment.seek(0, os.SEEK_END)
+        for record in records:
+            segment.write(record)
+            positions.append((offset, len(record)))
+            offset += len(record)
+        segment.flush()
+        os.fsync(segment.fileno())
+    return positions
+
+
+def segment_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class SegmentReader:
+    """Keep the most recently used segments mapped in memory and slice records out of them."""
+
+    def __init__(self, capacity=MAPPED_SEGMENTS):
+        self.capacity = capacity
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _map(self, path, end):
+        mapped = self._maps.get(path)
+        if mapped is not None and len(mapped) >= end:
+            self._maps.move_to_end(path)
+            return mapped
+        if mapped is not None:
+            # The segment grew since it was mapped.
+            del self._maps[path]
+            mapped.close()
+        with open(path, "rb") as segment:
+            mapped = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[path] = mapped
+        while len(self._maps) > self.capacity:
+            _path, oldest = self._maps.popitem(last=False)
+            oldest.close()
+        return mapped
+
+    def read(self, path, offset, length):
+        """Return ``(xml, response)`` of the record at ``offset`` of the segment."""
+        with self._lock:
+            mapped = self._map(path, offset + length)
+            if offset + length > len(mapped):
+                raise ValueError("Archive record beyond the end of the segment")
+            data = mapped[offset:offset + length]
+        return unpack_record(data)
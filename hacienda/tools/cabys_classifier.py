@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Local BM25 classifier that proposes CABYS codes for free text product names.
+
+The index is an in-memory inverted index over the CABYS descriptions: each
+token maps to the documents containing it and their term frequency. Scoring a
+product only touches the postings of its own tokens, so classifying a whole
+product catalogue is a single pass that never compares against every code.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from .text import normalize_search_text
+
+# Spanish function words that carry no meaning for the classification.
+STOPWORDS = frozenset(
+    "a al con de del e el en la las lo los o para por sin su sus u un una unos unas y otros otras otro otra "
+    "excepto incluye n.c.p ncp".split()
+)
+MIN_TOKEN_LENGTH = 2
+
+
+def _stem(token):
+    """Very light Spanish plural folding ("tornillos" -> "tornillo", "panes" -> "pan")."""
+    if len(token) > 4 and token.endswith("es") and token[-3] not in "aeiou":
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [
+        _stem(token)
+        for token in normalize_search_text(text).replace(".", " ").split()
+        if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS and not token.isdigit()
+    ]
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    doc_id: int
+    score: float
+    confidence: float
+
+
+class Bm25Index:
+    """Okapi BM25 over ``(doc_id, text)`` pairs."""
+
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self.postings = defaultdict(list)
+        lengths = []
+        for doc_id, text in documents:
+            index = len(self.doc_ids)
+            tokens = tokenize(text)
+            self.doc_ids.append(doc_id)
+            lengths.append(len(tokens))
+            for token, frequency in Counter(tokens).items():
+                self.postings[token].append((index, frequency))
+        count = len(self.doc_ids)
+        average = (sum(lengths) / count) if count else 0.0
+        # Precompute the length normalisation of every document once.
+        self.norms = [k1 * (1 - b + b * (length / average if average else 0.0)) for length in lengths]
+        self.idf = {
+            token: math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for token, posting in self.postings.items()
+        }
+        # Weight of a query token no document contains, for the coverage of the query.
+        self.unseen_idf = math.log(1 + (count + 0.5) / 0.5)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def search(self, weighted_tokens, limit=3):
+        """Return the ``limit`` best :class:`Suggestion` for ``{token: query weight}``.
+
+        ``confidence`` (0-1) combines how much of the query the best document
+        covers (its score over what an average length document containing each
+        query token once would get) with how clearly it beats the runner-up, so
+        ties between several codes yield a low confidence even when they match
+        every word. Query tokens found in no document count in the coverage
+        with the weight of a token that rare, so a query that is only partly
+        understood never looks fully covered.
+        """
+        scores = defaultdict(float)
+        upper_bound = 0.0
+        k1 = self.k1
+        for token, weight in weighted_tokens.items():
+            idf = self.idf.get(token)
+            if idf is None:
+                upper_bound += weight * self.unseen_idf
+                continue
+            upper_bound += weight * idf
+            for index, frequency in self.postings[token]:
+                scores[index] += weight * idf * frequency * (k1 + 1) / (frequency + self.norms[index])
+        if not scores:
+            return []
+        best = heapq.nlargest(max(limit, 2), scores.items(), key=lambda item: (item[1], -item[0]))
+        top_score = best[0][1]
+        runner_up = best[1][1] if len(best) > 1 else 0.0
+        coverage = min(top_score / upper_bound, 1.0) if upper_bound else 0.0
+        separation = 1.0 - runner_up / top_score
+        suggestions = []
+        for rank, (index, score) in enumerate(best[:limit]):
+            relative = score / top_score
+            confidence = coverage * relative * (0.5 + 0.5 * separation if rank == 0 else 0.5)
+            suggestions.append(Suggestion(self.doc_ids[index], score, round(confidence, 4)))
+        return suggestions
+
+
+def build_query(name, category=None, name_weight=2.0, category_weight=1.0):
+    """Weighted query tokens of a product: its name counts more than its category."""
+    weights = defaultdict(float)
+    for token in tokenize(name):
+        weights[token] += name_weight
+    for token in tokenize(category or ""):
+        weights[token] += category_weight
+    return weights
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Streaming readers for the CABYS catalogue published by the BCCR/Hacienda.
+
+The official release is distributed both as CSV and as XLSX. Both readers yield
+``(code, description, tax_rate_code)`` tuples one row at a time, so a full
+catalogue never has to be materialised as a list, and :func:`iter_chunks` groups
+them for set-based upserts.
+"""
+import re
+from itertools import islice
+
+from .tabular import cell_text, iter_csv, iter_xlsx, match_column
+from .text import normalize_search_text
+
+# Header aliases, compared after removing accents, case and punctuation.
+CODE_HEADERS = ("categoria 9", "codigo cabys", "codigo", "cabys", "code")
+NAME_HEADERS = ("descripcion categoria 9", "descripcion", "nombre", "description")
+TAX_HEADERS = ("impuesto", "tarifa", "iva", "tax")
+
+# Percentage published in the catalogue -> ``account.tax._selection_cr_tax_rate`` code.
+TAX_RATE_CODES = {
+    "13": "08",
+    "8": "07",
+    "4": "04",
+    "2": "03",
+    "1": "02",
+    "0.5": "09",
+    "0": "01",
+}
+EXEMPT_LABELS = ("exento", "exenta")
+
+# Number of leading rows scanned for the header row (the XLSX release has a title block).
+HEADER_SCAN_ROWS = 20
+CABYS_CODE_RE = re.compile(r"^\d{13}$")
+
+
+def _format_percent(value):
+    return ("%.2f" % value).rstrip("0").rstrip(".")
+
+
+def map_tax_rate(value):
+    """Translate the published tax column (``13%``, ``0,5 %``, ``Exento``...) into a rate code."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        # XLSX cells formatted as percentage come back as fractions (0.13).
+        return TAX_RATE_CODES.get(_format_percent(value * 100)) or TAX_RATE_CODES.get(_format_percent(value))
+    text = normalize_search_text(str(value).replace(",", "."))
+    if text.startswith(EXEMPT_LABELS):
+        return "10"
+    try:
+        return TAX_RATE_CODES.get(_format_percent(float(text.replace(" ", ""))))
+    except ValueError:
+        return None
+
+
+def _iter_table(rows):
+    """Locate the header among the first rows, then yield normalised catalogue rows."""
+    columns = None
+    for row_number, row in enumerate(rows):
+        if columns is None:
+            if row_number >= HEADER_SCAN_ROWS:
+                raise ValueError("No se encontró la fila de encabezados del catálogo CABYS.")
+            header = [normalize_search_text(cell) for cell in row]
+            code_index = match_column(header, CODE_HEADERS)
+            name_index = match_column(header, NAME_HEADERS)
+            if code_index is not None and name_index is not None:
+                # The official file lists the description of level 9 right after its code.
+                if header[name_index] != "descripcion categoria 9" and code_index + 1 < len(header):
+                    if header[code_index + 1].startswith("descripcion"):
+                        name_index = code_index + 1
+                columns = (code_index, name_index, match_column(header, TAX_HEADERS))
+            continue
+        code_index, name_index, tax_index = columns
+        code = cell_text(row, code_index)
+        if not CABYS_CODE_RE.match(code):
+            continue
+        name = cell_text(row, name_index)
+        tax = row[tax_index] if tax_index is not None and tax_index < len(row) else None
+        yield code, name or code, map_tax_rate(tax)
+    if columns is None:
+        raise ValueError("No se encontró la fila de encabezados del catálogo CABYS.")
+
+
+def iter_csv_rows(data):
+    """Yield catalogue rows from CSV ``data`` (bytes)."""
+    yield from _iter_table(iter_csv(data))
+
+
+def iter_xlsx_rows(data):
+    """Yield catalogue rows from XLSX ``data`` (bytes)."""
+    yield from _iter_table(iter_xlsx(data))
+
+
+def iter_chunks(rows, size):
+    """Group ``rows`` in lists of ``size``; codes repeated inside a chunk keep their last value."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield list({code: (code, name, tax_rate) for code, name, tax_rate in chunk}.values())
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Parser for the official territorial division file (provinces to barrios).
+
+Each row of the file describes one barrio (or one district when the file stops
+at that level) together with all its parents, as ``code``/``name`` column
+pairs. :func:`collect_division` reduces the rows to one entry per territory,
+keyed by its full path code (``"1"``, ``"101"``, ``"10101"``, ``"1010101"``),
+which is how the importer stores them.
+"""
+from .geo_index import GEO_LEVELS, full_code
+from .tabular import cell_text, match_column
+from .text import normalize_search_text
+
+# Header aliases per level: (code column, name column), normalised like the headers.
+DIVISION_HEADERS = {
+    "province": (
+        ("codigo provincia", "cod provincia", "provincia codigo", "id provincia", "cod prov"),
+        ("nombre provincia", "provincia"),
+    ),
+    "canton": (
+        ("codigo canton", "cod canton", "canton codigo", "id canton", "cod cant"),
+        ("nombre canton", "canton"),
+    ),
+    "district": (
+        ("codigo distrito", "cod distrito", "distrito codigo", "id distrito", "cod dist"),
+        ("nombre distrito", "distrito"),
+    ),
+    "neighborhood": (
+        ("codigo barrio", "cod barrio", "barrio codigo", "id barrio"),
+        ("nombre barrio", "barrio"),
+    ),
+}
+HEADER_SCAN_ROWS = 20
+
+
+def _find_columns(header):
+    columns = {}
+    taken = set()
+    for level in GEO_LEVELS:
+        code_aliases, name_aliases = DIVISION_HEADERS[level]
+        code_index = match_column(header, code_aliases)
+        if code_index is None:
+            break
+        taken.add(code_index)
+        name_index = match_column([cell if i not in taken else "" for i, cell in enumerate(header)], name_aliases)
+        if name_index is not None:
+            taken.add(name_index)
+        columns[level] = (code_index, name_index)
+    # A usable file describes at least provinces, cantons and districts.
+    return columns if len(columns) >= 3 else None
+
+
+def collect_division(rows):
+    """Return ``{level: {full_code: (name, parent_full_code)}}`` from the raw ``rows`` of the file."""
+    division = {level: {} for level in GEO_LEVELS}
+    columns = None
+    for row_number, row in enumerate(rows):
+        if columns is None:
+            if row_number >= HEADER_SCAN_ROWS:
+                break
+            columns = _find_columns([normalize_search_text(cell) for cell in row])
+            continue
+        parent = None
+        for level, (code_index, name_index) in columns.items():
+            code = full_code(parent, cell_text(row, code_index), level)
+            if not code:
+                break
+            name = cell_text(row, name_index) or code
+            division[level].setdefault(code, (name, parent))
+            parent = code
+    if columns is None:
+        raise ValueError("No se encontró la fila de encabezados de la división territorial.")
+    return division
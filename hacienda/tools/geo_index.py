@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Immutable lookup index over the Costa Rican territorial division.
+
+Provinces (``res.country.state``), cantons, districts and neighborhoods are
+loaded once and indexed both by their stored code and by their hierarchical
+path of local codes, e.g. ``(1, 1, 3)`` for district 03 of canton 01 of San
+José. Codes may be stored either as local codes (``"03"``) or as full paths
+(``"10103"``); both resolve to the same key.
+"""
+from types import MappingProxyType
+
+from .text import normalize_search_text
+
+GEO_LEVELS = ("province", "canton", "district", "neighborhood")
+# Digits of the local code of each level in Hacienda's Ubicacion node.
+GEO_CODE_WIDTHS = {"province": 1, "canton": 2, "district": 2, "neighborhood": 2}
+
+
+def _digits(code):
+    return "".join(char for char in str(code or "") if char.isdigit())
+
+
+def local_number(code, parent_code):
+    """Local number of ``code`` below a parent whose stored code is ``parent_code``."""
+    digits = _digits(code)
+    parent_digits = _digits(parent_code)
+    if parent_digits and len(digits) > len(parent_digits) and digits.startswith(parent_digits):
+        digits = digits[len(parent_digits):]
+    return int(digits) if digits else None
+
+
+def full_code(parent_code, code, level):
+    """Full path code of ``code`` (local or already full) below ``parent_code``: ``("1", "1")`` -> ``"101"``."""
+    local = local_number(code, parent_code)
+    if local is None:
+        return ""
+    return _digits(parent_code) + str(local).zfill(GEO_CODE_WIDTHS[level])
+
+
+class GeoIndex:
+    """Read-only mappings between geographic record ids, codes and code paths.
+
+    Each level is given as ``[(record_id, code, parent_id)]`` (``parent_id`` is
+    ignored for provinces); ``province_names`` maps province ids to names for the
+    name based fallback.
+    """
+
+    __slots__ = ("_codes", "_ids_by_code", "_ids_by_path", "_parents", "_paths", "_province_ids_by_name")
+
+    def __init__(self, provinces, cantons, districts, neighborhoods, province_names=None):
+        codes = {}
+        ids_by_code = {}
+        ids_by_path = {}
+        parents = {}
+        paths = {}
+        parent_level = None
+        for level, rows in zip(GEO_LEVELS, (provinces, cantons, districts, neighborhoods)):
+            level_codes = {}
+            level_by_code = {}
+            level_parents = {}
+            level_paths = {}
+            for record_id, code, parent_id in rows:
+                code = code or ""
+                level_codes[record_id] = code
+                if parent_level is not None and parent_id:
+                    level_parents[record_id] = parent_id
+                if code:
+                    level_by_code[code] = record_id
+                if parent_level is None:
+                    local = local_number(code, None)
+                    path = (local,) if local is not None else None
+                else:
+                    parent_path = paths[parent_level].get(parent_id)
+                    local = local_number(code, codes[parent_level].get(parent_id))
+                    path = parent_path + (local,) if parent_path and local is not None else None
+                if path:
+                    level_paths[record_id] = path
+                    ids_by_path[path] = record_id
+            codes[level] = MappingProxyType(level_codes)
+            ids_by_code[level] = MappingProxyType(level_by_code)
+            parents[level] = MappingProxyType(level_parents)
+            paths[level] = MappingProxyType(level_paths)
+            parent_level = level
+        self._codes = MappingProxyType(codes)
+        self._ids_by_code = MappingProxyType(ids_by_code)
+        self._ids_by_path = MappingProxyType(ids_by_path)
+        self._parents = MappingProxyType(parents)
+        self._paths = MappingProxyType(paths)
+        self._province_ids_by_name = MappingProxyType(
+            {normalize_search_text(name): record_id for record_id, name in (province_names or {}).items() if name}
+        )
+
+    def code(self, level, record_id):
+        """Stored code of the record ``record_id`` of ``level``; ``None`` when unknown."""
+        return self._codes[level].get(record_id) if record_id else None
+
+    def local_code(self, level, record_id):
+        """Zero padded local code of the record (``"03"`` for district ``"10103"``); ``None`` when unknown."""
+        path = self._paths[level].get(record_id) if record_id else None
+        return str(path[-1]).zfill(GEO_CODE_WIDTHS[level]) if path else None
+
+    def resolve(self, province=None, canton=None, district=None, neighborhood=None):
+        """Resolve the codes of an address into ``{level: record_id}``.
+
+        Each level is matched by its stored code first (as long as it belongs to
+        the parent already resolved) and then by its local code below that
+        parent. Provinces additionally fall back to their name. Below a parent
+        without a code path (Odoo states keep letter codes such as ``"SJ"``
+        until the division is imported) or that could not be resolved, only the
+        stored code is matched. Resolution stops at the first empty level.
+        """
+        result = {}
+        parent_id = None
+        parent_path = ()
+        parent_code = None
+        for level, value in zip(GEO_LEVELS, (province, canton, district, neighborhood)):
+            if not value:
+                break
+            value = str(value).strip()
+            record_id = self._ids_by_code[level].get(value)
+            if record_id and parent_id and self._parents[level].get(record_id, parent_id) != parent_id:
+                record_id = None
+            if not record_id and parent_path is not None:
+                local = local_number(value, parent_code)
+                record_id = self._ids_by_path.get(parent_path + (local,)) if local is not None else None
+            if not record_id and level == "province":
+                record_id = self._province_ids_by_name.get(normalize_search_text(value))
+            if record_id:
+                result[level] = record_id
+                parent_path = self._paths[level].get(record_id)
+                parent_code = self._codes[level][record_id]
+            else:
+                parent_path = parent_code = None
+            parent_id = record_id
+        return result
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Shared, connection pooled HTTP sessions for the Hacienda endpoints.
+
+Every worker process keeps one :class:`requests.Session` per configuration so
+consecutive calls to ``token``, ``recepcion`` and ``identificacion`` reuse the
+same keep-alive TCP/TLS connections instead of opening a new one each time.
+"""
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Statuses where Hacienda tells it did not process a POST and when to try again.
+POST_RETRY_STATUSES = frozenset({429, 503})
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class JitteredRetry(Retry):
+    """Exponential backoff with "equal jitter" so retries of many documents do not
+    hit Hacienda in lockstep. ``Retry-After`` headers still take precedence."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # A 5xx answer to a POST may come after Hacienda received the document:
+        # resending it could submit it twice, unless a Retry-After asks for it.
+        if method and method.upper() == "POST" and not (
+            status_code in POST_RETRY_STATUSES and has_retry_after
+        ):
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def build_session(pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+    retry = JitteredRetry(
+        total=max_retries,
+        connect=max_retries,
+        # A read error on a POST may mean Hacienda already received the document,
+        # so only failures before the request reached the server are retried.
+        read=0,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(env):
+    """Return the process wide session matching the configuration stored in ``env``."""
+    params = env["ir.config_parameter"].sudo()
+    key = (
+        _to_int(params.get_param("hacienda.http_pool_size"), DEFAULT_POOL_SIZE),
+        _to_int(params.get_param("hacienda.http_max_retries"), DEFAULT_MAX_RETRIES),
+        _to_float(params.get_param("hacienda.http_backoff_factor"), DEFAULT_BACKOFF_FACTOR),
+    )
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = build_session(*key)
+    return session
+
+
+def _to_int(value, default):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_float(value, default):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Single pass aggregation of invoice lines for the Hacienda XML.
+
+The detail lines and the ``ResumenFactura`` need the same per line amounts,
+discounts, taxable/exempt split and tax breakdown. :func:`aggregate_lines`
+walks the snapshot lines once and returns all of them together, reusing the
+line totals already computed by Odoo instead of recomputing the taxes. Lines
+with several taxes carry the amount of each one, computed by Odoo as well.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+# Differences below this are float artefacts of the subtraction, not rounding.
+FLOAT_NOISE = 1e-9
+
+
+@dataclass(frozen=True)
+class TaxInfo:
+    """Hacienda metadata of an ``account.tax``, built once per batch."""
+
+    code: str
+    rate_code: str
+    rate: float
+
+
+@dataclass(frozen=True)
+class TaxShare:
+    code: str
+    rate_code: str
+    rate: float
+    amount: float
+
+
+@dataclass(frozen=True)
+class LineAmounts:
+    line_total: float
+    discount_amount: float
+    subtotal: float
+    total: float
+    tax_amount: float
+    taxes: Tuple[TaxShare, ...]
+
+
+@dataclass
+class InvoiceAggregate:
+    lines: List[LineAmounts] = field(default_factory=list)
+    total_discounts: float = 0.0
+    taxable: float = 0.0
+    exempt: float = 0.0
+    tax_breakdown: Dict[Tuple[str, str], Decimal] = field(default_factory=dict)
+
+
+def split_tax_amount(tax_amount, taxes):
+    """Spread the tax amount of a line over its taxes, weighted by their rates.
+
+    ``taxes`` is a sequence of :class:`TaxInfo`. The last tax takes the rounding
+    remainder so the shares always add up to the amount Odoo computed. Only
+    exact for percentages on a common base, as with a single tax: lines with
+    more come with the amounts of :func:`computed_tax_shares`.
+    """
+    if not taxes:
+        return ()
+    weights = [tax.rate or 0.0 for tax in taxes]
+    total_weight = sum(weights)
+    if not total_weight:
+        weights = [1.0] * len(taxes)
+        total_weight = float(len(taxes))
+    shares = []
+    remaining = tax_amount
+    for index, (tax, weight) in enumerate(zip(taxes, weights)):
+        amount = remaining if index == len(taxes) - 1 else tax_amount * weight / total_weight
+        remaining -= amount
+        shares.append(TaxShare(tax.code, tax.rate_code, tax.rate, amount))
+    return tuple(shares)
+
+
+def computed_tax_shares(tax_amount, tax_amounts, tax_table):
+    """Shares of the per tax ``(tax_id, amount)`` computed by Odoo for a line.
+
+    Amounts computed without rounding (global rounding) may differ from the
+    line tax by a fraction of a cent; the largest share takes the difference
+    so the shares still add up to the line tax.
+    """
+    shares = [
+        TaxShare(tax_table[tax_id].code, tax_table[tax_id].rate_code, tax_table[tax_id].rate, amount)
+        for tax_id, amount in tax_amounts
+    ]
+    difference = tax_amount - sum(share.amount for share in shares)
+    if shares and abs(difference) > FLOAT_NOISE:
+        index = max(range(len(shares)), key=lambda i: abs(shares[i].amount))
+        largest = shares[index]
+        shares[index] = TaxShare(largest.code, largest.rate_code, largest.rate, largest.amount + difference)
+    return tuple(shares)
+
+
+def aggregate_lines(lines, tax_table):
+    """Aggregate snapshot ``lines`` whose ``tax_ids`` are keys of ``tax_table``."""
+    aggregate = InvoiceAggregate()
+    breakdown = aggregate.tax_breakdown
+    for line in lines:
+        quantity = line["quantity"] or 0.0
+        price_unit = line["price_unit"] or 0.0
+        line_total = quantity * price_unit
+        discount_amount = line_total * (line["discount"] or 0.0) / 100.0
+        subtotal = line["price_subtotal"]
+        tax_amount = line["price_total"] - subtotal
+        if line.get("tax_amounts") is not None:
+            taxes = computed_tax_shares(tax_amount, line["tax_amounts"], tax_table)
+        else:
+            taxes = split_tax_amount(tax_amount, [tax_table[tax_id] for tax_id in line["tax_ids"]])
+        aggregate.lines.append(
+            LineAmounts(
+                line_total=line_total,
+                discount_amount=discount_amount,
+                subtotal=subtotal,
+                total=line["price_total"],
+                tax_amount=tax_amount,
+                taxes=taxes,
+            )
+        )
+        aggregate.total_discounts += discount_amount
+        if taxes:
+            aggregate.taxable += subtotal
+        else:
+            aggregate.exempt += subtotal
+        for share in taxes:
+            key = (share.code, share.rate_code)
+            breakdown[key] = breakdown.get(key, Decimal("0.0")) + Decimal(str(share.amount))
+    return aggregate
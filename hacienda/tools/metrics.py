@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""In-process metrics of the e-invoicing pipeline, exported in the Prometheus text format.
+
+Each stage of the pipeline (``prefetch``, ``build``, ``validate``, ``sign``,
+``serialize``, ``store``, ``authenticate``, ``upload``, ``poll``) feeds a
+duration histogram and a counter per outcome, labelled by company when the
+stage works for a single one. Odoo serves requests from several worker processes, so every
+process periodically writes a snapshot of its own metrics to a shared
+directory and the exporter merges all the snapshots it finds there.
+"""
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+STAGES = ("prefetch", "build", "validate", "sign", "serialize", "store", "authenticate", "upload", "poll")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "hacienda"
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+class MetricsRegistry:
+    """Thread safe histograms and counters of one database in the current process."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.log_spans = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # (stage, company) -> [count per bucket..., count above the last bucket, sum]
+        self._histograms = {}
+        # (stage, outcome, company) -> count
+        self._counters = Counter()
+        self._dirty = False
+
+    def _check_fork(self):
+        # A forked worker inherits the parent's numbers, which the parent already exports.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def observe(self, stage, seconds, company=None, outcome="ok", **details):
+        """Record one run of ``stage`` that took ``seconds`` and ended with ``outcome``."""
+        company = str(company) if company else ""
+        with self._lock:
+            self._check_fork()
+            histogram = self._histograms.get((stage, company))
+            if histogram is None:
+                histogram = self._histograms[(stage, company)] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            index = next((i for i, bound in enumerate(DURATION_BUCKETS) if seconds <= bound), len(DURATION_BUCKETS))
+            histogram[index] += 1
+            histogram[-1] += seconds
+            self._counters[(stage, outcome, company)] += 1
+            self._dirty = True
+        if self.log_spans:
+            self._log(stage, company, outcome, seconds, details)
+
+    def count(self, stage, outcome, company=None, amount=1, **details):
+        """Count ``amount`` outcomes of ``stage`` that were not timed, e.g. documents refused before upload."""
+        company = str(company) if company else ""
+        with self._lock:
+            self._check_fork()
+            self._counters[(stage, outcome, company)] += amount
+            self._dirty = True
+        if self.log_spans:
+            self._log(stage, company, outcome, None, dict(details, amount=amount))
+
+    @contextmanager
+    def span(self, stage, company=None, **details):
+        """Time the enclosed block as a run of ``stage``; an exception makes its outcome ``error``."""
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, company, outcome, **details)
+
+    def _log(self, stage, company, outcome, seconds, details):
+        record = {"event": "hacienda.span", "stage": stage, "company": company, "outcome": outcome}
+        if seconds is not None:
+            record["seconds"] = round(seconds, 6)
+        record.update(details)
+        _logger.info("%s", json.dumps(record, default=str, sort_keys=True))
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                "buckets": list(DURATION_BUCKETS),
+                "histograms": [[stage, company, values] for (stage, company), values in self._histograms.items()],
+                "counters": [[stage, outcome, company, n] for (stage, outcome, company), n in self._counters.items()],
+            }
+
+    @property
+    def filename(self):
+        return f"{socket.gethostname()}-{os.getpid()}.json"
+
+    def flush(self):
+        """Write the snapshot of this process to the shared directory if anything changed."""
+        if not self.directory or not self._dirty:
+            return
+        snapshot = self.snapshot()
+        self._dirty = False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(snapshot, handle)
+            os.replace(tmp_path, os.path.join(self.directory, self.filename))
+        except OSError:
+            self._dirty = True
+            _logger.warning("No se pudieron guardar las métricas de Hacienda en %s", self.directory, exc_info=True)
+
+    def collect(self):
+        """Merge the snapshots of every process, this one included."""
+        self.flush()
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json") or name == self.filename:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), encoding="utf-8") as handle:
+                        snapshots.append(json.load(handle))
+                except (OSError, ValueError):
+                    continue  # being replaced or pruned
+        return merge_snapshots(snapshots)
+
+    def prune(self, max_age):
+        """Delete the snapshots not written for ``max_age`` seconds, left by workers that are gone."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return 0
+        limit = time.time() - max_age
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name != self.filename and os.path.getmtime(path) < limit:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+def get_registry(dbname, directory=None):
+    """Return the registry of ``dbname`` in this process."""
+    registry = _registries.get(dbname)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(dbname)
+            if registry is None:
+                registry = _registries[dbname] = MetricsRegistry(directory)
+    if directory and not registry.directory:
+        registry.directory = directory
+    return registry
+
+
+def merge_snapshots(snapshots):
+    histograms = {}
+    counters = Counter()
+    for snapshot in snapshots:
+        if snapshot.get("buckets") != list(DURATION_BUCKETS):
+            continue  # written by another version of the module
+        for stage, company, values in snapshot["histograms"]:
+            merged = histograms.setdefault((stage, company), [0] * len(values))
+            for index, value in enumerate(values):
+                merged[index] += value
+        for stage, outcome, company, n in snapshot["counters"]:
+            counters[(stage, outcome, company)] += n
+    return histograms, counters
+
+
+def _labels(**labels):
+    pairs = []
+    for name, value in labels.items():
+        if value in (None, ""):
+            continue
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(histograms, counters, gauges=()):
+    """Render merged metrics and ``gauges`` as Prometheus text exposition format 0.0.4.
+
+    ``gauges`` is an iterable of ``(name, help, [(labels, value)])``.
+    """
+    duration = f"{METRIC_PREFIX}_stage_duration_seconds"
+    lines = [
+        f"# HELP {duration} Duration of the stages of the electronic invoicing pipeline.",
+        f"# TYPE {duration} histogram",
+    ]
+    for (stage, company), values in sorted(histograms.items()):
+        cumulative = 0
+        for bound, value in zip(DURATION_BUCKETS + (float("inf"),), values[:-1]):
+            cumulative += value
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            lines.append(f"{duration}_bucket{_labels(stage=stage, company=company, le=le)} {cumulative}")
+        lines.append(f"{duration}_sum{_labels(stage=stage, company=company)} {_number(values[-1])}")
+        lines.append(f"{duration}_count{_labels(stage=stage, company=company)} {cumulative}")
+
+    total = f"{METRIC_PREFIX}_stage_total"
+    lines += [
+        f"# HELP {total} Runs of the stages of the electronic invoicing pipeline by outcome.",
+        f"# TYPE {total} counter",
+    ]
+    for (stage, outcome, company), n in sorted(counters.items()):
+        lines.append(f"{total}{_labels(stage=stage, outcome=outcome, company=company)} {n}")
+
+    for name, help_text, samples in gauges:
+        lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}", f"# TYPE {METRIC_PREFIX}_{name} gauge"]
+        for labels, value in samples:
+            lines.append(f"{METRIC_PREFIX}_{name}{_labels(**labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Content addressed file store for the XML payloads exchanged with Hacienda.
+
+Each payload is written once under ``<root>/<first two hex digits>/<sha256>``
+(``.zst`` appended when compressed), so identical payloads share one file and
+a checksum is enough to find the bytes again. Files are written to a temporary
+name and renamed into place, which makes concurrent writers of the same
+content harmless.
+
+Documents too large to be held in memory are written by their producer to a
+file of the ``spool`` directory, under the same root so the file can be
+renamed into place, and stored from there as a :class:`SpooledPayload`.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+try:  # pragma: no cover - optional dependency
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+CODEC_IDENTITY = "identity"
+CODEC_ZSTD = "zstd"
+# Payloads smaller than this are not worth a compression frame.
+MIN_COMPRESS_SIZE = 512
+ZSTD_LEVEL = 10
+SPOOL_DIRECTORY = "spool"
+
+# A payload already written to ``path`` in the spool directory, with the sha256 and size of its bytes.
+SpooledPayload = namedtuple("SpooledPayload", "path checksum size")
+
+
+def checksum(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def choose_codec(data, preferred):
+    return choose_codec_for_size(len(data), preferred)
+
+
+def choose_codec_for_size(size, preferred):
+    if preferred == CODEC_ZSTD and zstandard is not None and size >= MIN_COMPRESS_SIZE:
+        return CODEC_ZSTD
+    return CODEC_IDENTITY
+
+
+def encode(data, codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def decode(data, codec):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("The 'zstandard' library is required to read compressed Hacienda payloads.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+class PayloadStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest, codec):
+        suffix = ".zst" if codec == CODEC_ZSTD else ""
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+    def write(self, digest, data, codec):
+        """Store ``data`` (already encoded with ``codec``) unless the file exists; return its path."""
+        path = self.path(digest, codec)
+        if os.path.exists(path):
+            return path
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return path
+
+    @property
+    def spool_directory(self):
+        return os.path.join(self.root, SPOOL_DIRECTORY)
+
+    def write_file(self, digest, source, codec):
+        """Move the spooled file ``source`` into the store, encoding it with ``codec`` on the way.
+
+        The file is compressed as a stream, never read whole. Returns the size of the stored file.
+        """
+        path = self.path(digest, codec)
+        if os.path.exists(path):
+            os.unlink(source)
+            return os.path.getsize(path)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if codec != CODEC_ZSTD:
+            os.replace(source, path)
+            return os.path.getsize(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with open(source, "rb") as spooled, os.fdopen(fd, "wb") as tmp:
+                size = os.fstat(spooled.fileno()).st_size
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(spooled, tmp, size=size)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        os.unlink(source)
+        return os.path.getsize(path)
+
+    def prune_spool(self, max_age):
+        """Delete the spooled files older than ``max_age`` seconds, left by producers that failed."""
+        directory = self.spool_directory
+        if not os.path.isdir(directory):
+            return 0
+        limit = time.time() - max_age
+        removed = 0
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def read(self, digest, codec):
+        with open(self.path(digest, codec), "rb") as payload:
+            return decode(payload.read(), codec)
+
+    def delete(self, digest, codec):
+        try:
+            os.unlink(self.path(digest, codec))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+
+class RateLimiter:
+    """Thread safe limiter spacing calls to at most ``rate`` per second.
+
+    Each :meth:`acquire` reserves the next free slot under a lock and sleeps
+    outside of it, so concurrent workers queue up fairly without busy waiting.
+    A ``rate`` of 0 (or less) disables the limit.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Process level cache of the material needed to sign Hacienda documents.
+
+Opening a PKCS#12 container runs a deliberately slow key derivation, so the
+decoded key, the certificate chain and a ready XAdES signer are kept per
+company. Entries are keyed by a hash of the certificate bytes and PIN: a new
+certificate uploaded from another worker simply misses the cache.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 32
+C14N_ALGORITHM = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+# SHA-1 digest of the signature policy document published by Hacienda.
+POLICY_DIGEST_VALUE = "Ohixl6upD6av8N7pEvDABhEL6hM="
+CLAIMED_ROLE = "ObligadoTributario"
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class SigningMaterial:
+    __slots__ = ("key_pem", "cert_chain", "signer", "policy_identifier", "lock", "_private_key")
+
+    def __init__(self, key_pem, cert_chain, signer, policy_identifier=None):
+        self.key_pem = key_pem
+        self.cert_chain = cert_chain
+        self.signer = signer
+        self.policy_identifier = policy_identifier
+        self._private_key = None
+        # signxml signers keep per call state and an lxml parser, neither of
+        # which may be shared between threads.
+        self.lock = threading.Lock()
+
+    def sign(self, root):
+        # Without ``reference_uri`` the enveloped signature references the whole
+        # document (URI=""); passing "" explicitly makes signxml 5 look up "#".
+        with self.lock:
+            return self.signer.sign(root, key=self.key_pem, cert=self.cert_chain)
+
+    @property
+    def private_key(self):
+        """The decoded private key, for the signatures built without signxml."""
+        if self._private_key is None:
+            from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+            self._private_key = load_pem_private_key(self.key_pem, password=None)
+        return self._private_key
+
+
+def build_signer(policy_identifier):
+    from signxml import DigestAlgorithm, methods, xades
+
+    return xades.XAdESSigner(
+        method=methods.enveloped,
+        signature_algorithm="rsa-sha256",
+        digest_algorithm="sha256",
+        c14n_algorithm=C14N_ALGORITHM,
+        signature_policy=xades.XAdESSignaturePolicy(
+            Identifier=policy_identifier,
+            Description="",
+            DigestMethod=DigestAlgorithm.SHA1,
+            DigestValue=POLICY_DIGEST_VALUE,
+        ),
+        claimed_roles=[CLAIMED_ROLE],
+        data_object_format=xades.XAdESDataObjectFormat(Description="", MimeType="text/xml"),
+    )
+
+
+def load_signing_material(p12_bytes, pin, policy_identifier):
+    """Decode the PKCS#12 container. Returns ``None`` when it holds no private key."""
+    from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, pkcs12
+
+    private_key, cert, additional = pkcs12.load_key_and_certificates(p12_bytes, (pin or "").encode())
+    if not private_key or not cert:
+        return None
+    key_pem = private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+    cert_chain = [cert.public_bytes(Encoding.PEM)]
+    if additional:
+        cert_chain.extend(c.public_bytes(Encoding.PEM) for c in additional if c)
+    return SigningMaterial(key_pem, cert_chain, build_signer(policy_identifier), policy_identifier)
+
+
+def get_signing_material(dbname, company_id, p12_bytes, pin, policy_identifier):
+    fingerprint = hashlib.sha256(p12_bytes + b"\0" + (pin or "").encode()).hexdigest()
+    key = (dbname, company_id, fingerprint, policy_identifier)
+    with _cache_lock:
+        material = _cache.get(key)
+        if material is not None:
+            _cache.move_to_end(key)
+            return material
+
+    material = load_signing_material(p12_bytes, pin, policy_identifier)
+    if material is None:
+        return None
+    with _cache_lock:
+        _cache[key] = material
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return material
+
+
+def invalidate_signing_material(dbname, company_ids=None):
+    with _cache_lock:
+        for key in list(_cache):
+            if key[0] == dbname and (company_ids is None or key[1] in company_ids):
+                del _cache[key]
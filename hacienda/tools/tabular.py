@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Row iterators over the CSV and XLSX files published by Hacienda and the INEC."""
+import csv
+import io
+
+CSV_DELIMITERS = (",", ";", "\t", "|")
+
+
+def is_xlsx(data, filename=None):
+    return (filename or "").lower().endswith((".xlsx", ".xlsm")) or data[:2] == b"PK"
+
+
+def iter_csv(data):
+    """Yield the rows of CSV ``data`` (bytes) as lists of strings, guessing the delimiter."""
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", errors="replace", newline="")
+    sample = stream.read(64 * 1024)
+    stream.seek(0)
+    # csv.Sniffer gives up on the title rows of the official exports; the most
+    # frequent candidate in the sample is a reliable enough guess.
+    delimiter = max(CSV_DELIMITERS, key=sample.count)
+    yield from csv.reader(stream, delimiter=delimiter)
+
+
+def iter_xlsx(data):
+    """Yield the rows of the first sheet of XLSX ``data`` (bytes) using openpyxl's read-only mode."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def match_column(header, aliases):
+    """Index of the first normalised ``header`` cell equal to (then starting with) an alias."""
+    for alias in aliases:
+        for index, cell in enumerate(header):
+            if cell == alias:
+                return index
+    for alias in aliases:
+        for index, cell in enumerate(header):
+            if cell.startswith(alias):
+                return index
+    return None
+
+
+def cell_text(row, index):
+    """Stripped text of ``row[index]``; integral floats (XLSX numbers) lose their ``.0``."""
+    if index is None or index >= len(row) or row[index] is None:
+        return ""
+    value = row[index]
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
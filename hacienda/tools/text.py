@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Text normalisation shared by the catalogue importers and searches."""
+import re
+import unicodedata
+
+_NON_WORD_RE = re.compile(r"[^a-z0-9.]+")
+
+
+def strip_accents(value):
+    value = unicodedata.normalize("NFKD", str(value or ""))
+    return "".join(char for char in value if not unicodedata.combining(char))
+
+
+def normalize_search_text(value):
+    """Lower case, accent free and single spaced version of ``value`` ("Café  Molido" -> "cafe molido")."""
+    return " ".join(_NON_WORD_RE.sub(" ", strip_accents(value).lower()).split())
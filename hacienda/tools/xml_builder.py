@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""Pure builder for the Hacienda v4.4 invoice XML.
+
+Everything here works on plain data snapshots prepared by
+``account.move._prepare_hacienda_xml_data`` and never touches the ORM, so the
+CPU bound part of the pipeline (tree building, C14N and RSA signing) can run
+in worker processes.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+
+try:  # pragma: no cover - optional dependency provided at runtime
+    from lxml import etree
+except ImportError:  # pragma: no cover - callers raise a user error when needed
+    etree = None
+
+from . import xml_stream
+from .line_aggregation import aggregate_lines
+from .signing import get_signing_material
+from .xml_stream import DS_NS, XADES_NS
+from .xsd_validation import format_issues, get_schema, validate_tree
+
+HACIENDA_XMLNS = "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica"
+HACIENDA_SCHEMA_LOCATION = (
+    "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica "
+    "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica.xsd"
+)
+HACIENDA_ROOT_TAG = "FacturaElectronica"
+XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
+XSD_ERROR = "El XML no cumple el esquema XSD de Hacienda."
+SIGNING_ERROR = "Ocurrió un error firmando el XML con el certificado indicado."
+# Upper bound of the worker processes forked per batch, whatever is configured.
+MAX_XML_WORKERS = 8
+# Below this many jobs per worker, forking costs more than it saves.
+MIN_JOBS_PER_WORKER = 10
+
+
+def format_decimal(value, decimal_places=None, digits=None):
+    if value is None:
+        value = 0.0
+    if isinstance(value, Decimal):
+        decimal_value = value
+    else:
+        decimal_value = Decimal(str(value))
+    if digits is None:
+        digits = decimal_places if decimal_places is not None else 5
+    quantize_pattern = Decimal("1") if digits == 0 else Decimal("1." + "0" * digits)
+    quantized = decimal_value.quantize(quantize_pattern, rounding=ROUND_HALF_UP)
+    return f"{quantized:.{digits}f}"
+
+
+def new_invoice_root():
+    """Empty root element carrying the namespace declarations of the document."""
+    nsmap = {
+        None: HACIENDA_XMLNS,
+        "ds": DS_NS,
+        "xsi": XSI_NS,
+        "xades": XADES_NS,
+    }
+    root = etree.Element(HACIENDA_ROOT_TAG, nsmap=nsmap)
+    root.set(etree.QName(XSI_NS, "schemaLocation"), HACIENDA_SCHEMA_LOCATION)
+    return root
+
+
+def build_invoice_tree(data):
+    root = new_invoice_root()
+    aggregate = aggregate_lines(data["lines"], data["taxes"])
+    _append_header(root, data)
+    _append_party(root, "Emisor", data["emitter"])
+    _append_party(root, "Receptor", data["receiver"])
+    _append_sale_condition(root, data)
+    _append_invoice_lines(root, data, aggregate)
+    _append_summary(root, data, aggregate)
+    _append_other_information(root, data)
+    return root
+
+
+def canonical_root_tags():
+    """Canonical (C14N 1.0) start and end tags of the document root."""
+    canonical = etree.tostring(new_invoice_root(), method="c14n")
+    split = canonical.index(b"></") + 1
+    return canonical[:split], canonical[split:]
+
+
+def iter_canonical_invoice(data):
+    """Yield the canonical form of the children of the unsigned root, piece by piece.
+
+    Pieces are built on a detached parent and serialized one at a time, a
+    single ``LineaDetalle`` each for the lines, so the tree never holds more
+    than one of them. Inside the tags of :func:`canonical_root_tags`, whose
+    default namespace they inherit, the concatenation equals the canonical
+    form of :func:`build_invoice_tree`.
+    """
+    aggregate = aggregate_lines(data["lines"], data["taxes"])
+    scratch = etree.Element(HACIENDA_ROOT_TAG)
+    _append_header(scratch, data)
+    _append_party(scratch, "Emisor", data["emitter"])
+    _append_party(scratch, "Receptor", data["receiver"])
+    _append_sale_condition(scratch, data)
+    yield from _drain_canonical(scratch)
+    yield b"<DetalleServicio>"
+    places = data["currency"]["decimal_places"] if data.get("currency") else None
+    for index, (line, amounts) in enumerate(zip(data["lines"], aggregate.lines), start=1):
+        _append_invoice_line(scratch, index, line, amounts, places)
+        yield from _drain_canonical(scratch)
+    yield b"</DetalleServicio>"
+    _append_summary(scratch, data, aggregate)
+    _append_other_information(scratch, data)
+    yield from _drain_canonical(scratch)
+
+
+def _drain_canonical(parent):
+    for child in list(parent):
+        yield etree.tostring(child, method="c14n")
+        parent.remove(child)
+
+
+def _append_header(root, data):
+    etree.SubElement(root, "Clave").text = data["key"]
+    if data.get("provider_code"):
+        etree.SubElement(root, "ProveedorSistemas").text = data["provider_code"]
+    if data.get("activity_code"):
+        etree.SubElement(root, "CodigoActividadEmisor").text = data["activity_code"]
+    if data.get("receiver_activity_code"):
+        etree.SubElement(root, "CodigoActividadReceptor").text = data["receiver_activity_code"]
+    etree.SubElement(root, "NumeroConsecutivo").text = data["sequence"]
+    etree.SubElement(root, "FechaEmision").text = data["emission_date"]
+
+
+def _append_party(root, tag, party):
+    node = etree.SubElement(root, tag)
+    etree.SubElement(node, "Nombre").text = party["name"] or ""
+    identification = party.get("identification")
+    if identification:
+        identificacion = etree.SubElement(node, "Identificacion")
+        etree.SubElement(identificacion, "Tipo").text = identification["type"]
+        etree.SubElement(identificacion, "Numero").text = identification["number"]
+    if party.get("commercial_name"):
+        etree.SubElement(node, "NombreComercial").text = party["commercial_name"]
+    location = party.get("location")
+    if location:
+        ubicacion = etree.SubElement(node, "Ubicacion")
+        for key, location_tag in (
+            ("province", "Provincia"),
+            ("canton", "Canton"),
+            ("district", "Distrito"),
+            ("neighborhood", "Barrio"),
+            ("other", "OtrasSenas"),
+        ):
+            if location.get(key):
+                etree.SubElement(ubicacion, location_tag).text = location[key]
+    phone = party.get("phone")
+    if phone:
+        telefono = etree.SubElement(node, "Telefono")
+        etree.SubElement(telefono, "CodigoPais").text = phone[0]
+        etree.SubElement(telefono, "NumTelefono").text = phone[1]
+    if party.get("email"):
+        etree.SubElement(node, "CorreoElectronico").text = party["email"]
+
+
+def _append_sale_condition(root, data):
+    condition = data.get("sale_condition") or "01"
+    etree.SubElement(root, "CondicionVenta").text = condition
+    if condition in {"02", "10"} and data.get("credit_term"):
+        etree.SubElement(root, "PlazoCredito").text = str(int(data["credit_term"]))
+
+
+def _append_invoice_lines(root, data, aggregate):
+    detalle = etree.SubElement(root, "DetalleServicio")
+    places = data["currency"]["decimal_places"] if data.get("currency") else None
+    for index, (line, amounts) in enumerate(zip(data["lines"], aggregate.lines), start=1):
+        _append_invoice_line(detalle, index, line, amounts, places)
+
+
+def _append_invoice_line(detalle, index, line, amounts, places):
+    linea = etree.SubElement(detalle, "LineaDetalle")
+    etree.SubElement(linea, "NumeroLinea").text = str(index)
+    if line.get("cabys_code"):
+        etree.SubElement(linea, "CodigoCABYS").text = line["cabys_code"]
+    if line.get("default_code"):
+        codigo_comercial = etree.SubElement(linea, "CodigoComercial")
+        etree.SubElement(codigo_comercial, "Tipo").text = "01"
+        etree.SubElement(codigo_comercial, "Codigo").text = line["default_code"]
+    etree.SubElement(linea, "Cantidad").text = format_decimal(line["quantity"], digits=5)
+    etree.SubElement(linea, "UnidadMedida").text = line["unit"]
+    etree.SubElement(linea, "Detalle").text = line["description"]
+    etree.SubElement(linea, "PrecioUnitario").text = format_decimal(line["price_unit"], places)
+    etree.SubElement(linea, "MontoTotal").text = format_decimal(amounts.line_total, places)
+    etree.SubElement(linea, "MontoDescuento").text = format_decimal(amounts.discount_amount, places)
+    etree.SubElement(linea, "SubTotal").text = format_decimal(amounts.subtotal, places)
+    etree.SubElement(linea, "BaseImponible").text = format_decimal(amounts.subtotal, places)
+    for tax in amounts.taxes:
+        impuestos = etree.SubElement(linea, "Impuesto")
+        etree.SubElement(impuestos, "Codigo").text = tax.code or "00"
+        if tax.rate_code:
+            etree.SubElement(impuestos, "CodigoTarifaIVA").text = tax.rate_code
+        etree.SubElement(impuestos, "Tarifa").text = format_decimal(tax.rate, digits=2)
+        etree.SubElement(impuestos, "Monto").text = format_decimal(tax.amount, places)
+    if amounts.tax_amount and not amounts.taxes:
+        impuestos = etree.SubElement(linea, "Impuesto")
+        etree.SubElement(impuestos, "Codigo").text = "00"
+        etree.SubElement(impuestos, "Monto").text = format_decimal(amounts.tax_amount, places)
+    etree.SubElement(linea, "ImpuestoAsumidoEmisorFabrica").text = "0"
+    etree.SubElement(linea, "ImpuestoNeto").text = format_decimal(amounts.tax_amount, places)
+    etree.SubElement(linea, "MontoTotalLinea").text = format_decimal(amounts.total, places)
+
+
+def _append_summary(root, data, aggregate):
+    resumen = etree.SubElement(root, "ResumenFactura")
+    currency = data.get("currency")
+    places = currency["decimal_places"] if currency else None
+    if currency:
+        codigo_tipo_moneda = etree.SubElement(resumen, "CodigoTipoMoneda")
+        etree.SubElement(codigo_tipo_moneda, "CodigoMoneda").text = currency["name"] or "CRC"
+        etree.SubElement(codigo_tipo_moneda, "TipoCambio").text = format_decimal(currency["rate"] or 1.0)
+    taxable = aggregate.taxable
+    exempt = aggregate.exempt
+    zero = format_decimal(0.0, places)
+    etree.SubElement(resumen, "TotalServGravados").text = format_decimal(taxable, places)
+    etree.SubElement(resumen, "TotalServExentos").text = format_decimal(exempt, places)
+    etree.SubElement(resumen, "TotalServExonerado").text = zero
+    etree.SubElement(resumen, "TotalServNoSujeto").text = zero
+    etree.SubElement(resumen, "TotalMercanciasGravadas").text = zero
+    etree.SubElement(resumen, "TotalMercanciasExentas").text = zero
+    etree.SubElement(resumen, "TotalMercExonerada").text = zero
+    etree.SubElement(resumen, "TotalMercNoSujeta").text = zero
+    etree.SubElement(resumen, "TotalGravado").text = format_decimal(taxable, places)
+    etree.SubElement(resumen, "TotalExento").text = format_decimal(exempt, places)
+    etree.SubElement(resumen, "TotalExonerado").text = zero
+    total_discounts = aggregate.total_discounts
+    etree.SubElement(resumen, "TotalVenta").text = format_decimal(data["amount_untaxed"] + total_discounts, places)
+    etree.SubElement(resumen, "TotalDescuentos").text = format_decimal(total_discounts, places)
+    etree.SubElement(resumen, "TotalVentaNeta").text = format_decimal(data["amount_untaxed"], places)
+    etree.SubElement(resumen, "TotalImpuesto").text = format_decimal(data["amount_tax"], places)
+    etree.SubElement(resumen, "TotalImpAsumEmisorFabrica").text = zero
+    etree.SubElement(resumen, "TotalIVADevuelto").text = zero
+    _append_tax_breakdown(resumen, aggregate, places)
+    _append_payment_methods(resumen, data, places)
+    etree.SubElement(resumen, "TotalComprobante").text = format_decimal(data["amount_total"], places)
+
+
+def _append_tax_breakdown(resumen, aggregate, places):
+    for (tax_code, rate_code), amount in aggregate.tax_breakdown.items():
+        desglose = etree.SubElement(resumen, "TotalDesgloseImpuesto")
+        if tax_code:
+            etree.SubElement(desglose, "Codigo").text = tax_code
+        if rate_code:
+            etree.SubElement(desglose, "CodigoTarifaIVA").text = rate_code
+        etree.SubElement(desglose, "TotalMontoImpuesto").text = format_decimal(amount, places)
+
+
+def _append_payment_methods(resumen, data, places):
+    for payment in data["payments"]:
+        medio = etree.SubElement(resumen, "MedioPago")
+        etree.SubElement(medio, "TipoMedioPago").text = payment["code"]
+        if payment["amount"]:
+            etree.SubElement(medio, "MontoPago").text = format_decimal(payment["amount"], places)
+        if payment["description"]:
+            etree.SubElement(medio, "DetallePago").text = payment["description"]
+
+
+def _append_other_information(root, data):
+    if not data.get("narration"):
+        return
+    otros = etree.SubElement(root, "Otros")
+    etree.SubElement(otros, "OtroTexto").text = data["narration"]
+
+
+def _load_signing_material(signing):
+    """Return ``(material, error)`` for the arguments of :func:`get_signing_material`."""
+    try:
+        material = get_signing_material(*signing)
+    except Exception:  # pragma: no cover - depends on runtime certificates
+        return None, (
+            "No se pudo leer el certificado criptográfico. Verifique que el archivo sea válido y el PIN sea correcto."
+        )
+    if material is None:
+        return None, "El certificado proporcionado no contiene una llave privada válida."
+    return material, None
+
+
+def generate_signed_xml(job):
+    """Build, sign and serialize one snapshot. Entry point of the worker processes.
+
+    ``job`` is ``(data, signing, xsd_directory, spool_directory)`` where
+    ``signing`` holds the arguments of :func:`get_signing_material`,
+    ``xsd_directory`` is the directory of the schemas the tree is validated
+    against before signing, or False to skip the validation, and
+    ``spool_directory`` is set for the invoices to stream with
+    :func:`generate_signed_xml_file`. Returns ``(move_id, xml_bytes, error,
+    timings, validation_errors)`` where ``timings`` maps the stages that ran
+    (``build``, ``validate``, ``sign`` and ``serialize``) to their seconds;
+    after an error the last one is the stage that failed.
+    """
+    data, signing, xsd_directory, spool_directory = job
+    if spool_directory:
+        return generate_signed_xml_file(data, signing, xsd_directory, spool_directory)
+    move_id = data["move_id"]
+    timings = {}
+    started = time.perf_counter()
+    try:
+        root = build_invoice_tree(data)
+    except Exception as exc:  # pragma: no cover - depends on runtime data
+        timings["build"] = time.perf_counter() - started
+        return move_id, None, f"No se pudo generar el XML para Hacienda: {exc}", timings, None
+    built = time.perf_counter()
+    timings["build"] = built - started
+    if xsd_directory is not False:
+        issues = validate_tree(root, xsd_directory)
+        if issues is not None:
+            validated = time.perf_counter()
+            timings["validate"] = validated - built
+            built = validated
+        if issues:
+            return move_id, None, XSD_ERROR, timings, format_issues(issues)
+    material, error = _load_signing_material(signing)
+    if not error:
+        try:
+            signed_root = material.sign(root)
+        except Exception:  # pragma: no cover - signing failures depend on runtime data
+            error = SIGNING_ERROR
+    signed = time.perf_counter()
+    timings["sign"] = signed - built
+    if error:
+        return move_id, None, error, timings, None
+    xml_bytes = etree.tostring(signed_root, encoding="utf-8", xml_declaration=True)
+    timings["serialize"] = time.perf_counter() - signed
+    return move_id, xml_bytes, None, timings, None
+
+
+def generate_signed_xml_file(data, signing, xsd_directory, spool_directory):
+    """Streaming variant of :func:`generate_signed_xml` for invoices with many lines.
+
+    The document goes to a file of ``spool_directory`` one piece at a time
+    (see :mod:`.xml_stream`), so memory does not grow with the number of
+    lines, and the slot of the XML bytes in the result holds the
+    :class:`~.payload_store.SpooledPayload` of the file. The schema is checked
+    while writing but its verdict only comes with the end of the document,
+    signature included: the file of an invalid document is removed and its
+    issues have no line. Timings are reported as ``build`` (writing included),
+    ``sign`` and ``validate``.
+    """
+    move_id = data["move_id"]
+    timings = {}
+    started = time.perf_counter()
+    # Loaded first so that no file is written for a certificate that cannot sign.
+    material, error = _load_signing_material(signing)
+    loaded = time.perf_counter() - started
+    if error:
+        timings["sign"] = loaded
+        return move_id, None, error, timings, None
+    schema = get_schema(HACIENDA_ROOT_TAG, xsd_directory) if xsd_directory is not False else None
+    started = time.perf_counter()
+    spool = xml_stream.CanonicalSpool(spool_directory, schema)
+    try:
+        root_start, root_end = canonical_root_tags()
+        try:
+            spool.write(xml_stream.XML_DECLARATION, canonical=False)
+            spool.write(root_start)
+            for piece in iter_canonical_invoice(data):
+                spool.write(piece)
+        except Exception as exc:  # pragma: no cover - depends on runtime data
+            timings["build"] = time.perf_counter() - started - spool.validation_seconds
+            return move_id, None, f"No se pudo generar el XML para Hacienda: {exc}", timings, None
+        built = time.perf_counter()
+        timings["build"] = built - started - spool.validation_seconds
+        try:
+            signature = xml_stream.build_signature(new_invoice_root(), spool.canonical_digest(root_end), material)
+        except Exception:  # pragma: no cover - signing failures depend on runtime data
+            timings["sign"] = loaded + time.perf_counter() - built
+            return move_id, None, SIGNING_ERROR, timings, None
+        timings["sign"] = loaded + time.perf_counter() - built
+        spool.write(signature, canonical=False)
+        spool.write(root_end, canonical=False)
+        issues = spool.finish()
+        if schema is not None:
+            timings["validate"] = spool.validation_seconds
+        if issues:
+            return move_id, None, XSD_ERROR, timings, format_issues(issues)
+        return move_id, spool.keep(), None, timings, None
+    finally:
+        spool.discard()
+
+
+def generate_signed_xml_batch(jobs, workers):
+    """Run :func:`generate_signed_xml` over ``jobs`` using up to ``workers`` processes.
+
+    The number of processes is capped by :data:`MAX_XML_WORKERS`, the cores
+    of the machine and one per :data:`MIN_JOBS_PER_WORKER` jobs; with one, the
+    jobs run in this process. Workers are forked so they inherit the already
+    imported addon; they only run the pure functions of this module and never
+    use the parent's database connections.
+    """
+    workers = min(workers, MAX_XML_WORKERS, os.cpu_count() or 1, len(jobs) // MIN_JOBS_PER_WORKER)
+    if workers <= 1:
+        return [generate_signed_xml(job) for job in jobs]
+    for xsd_directory in {job[2] for job in jobs} - {False}:
+        # Compiled here once, the schemas are inherited by every forked worker.
+        get_schema(HACIENDA_ROOT_TAG, xsd_directory)
+    chunksize = max(1, len(jobs) // (workers * 4))
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return list(executor.map(generate_signed_xml, jobs, chunksize=chunksize))
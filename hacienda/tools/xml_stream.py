@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Streaming output of very large invoices, signed over the digest of the stream.
+
+The document is written in canonical (C14N 1.0) form, piece by piece, to a
+file of the payload store spool, and hashed on the way. Being canonical
+already, the written bytes are exactly what the enveloped signature digests,
+so the reference digest is known when the last piece is written and the tree
+of the whole document never exists. The XAdES-EPES signature is then built
+by hand with the same structure signxml produces for the in-memory path and
+written before the closing root tag.
+"""
+import base64
+import datetime
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+
+try:  # pragma: no cover - optional dependency provided at runtime
+    from lxml import etree
+except ImportError:  # pragma: no cover - callers raise a user error when needed
+    etree = None
+
+from .payload_store import SpooledPayload
+from .signing import C14N_ALGORITHM, CLAIMED_ROLE, POLICY_DIGEST_VALUE
+from .xsd_validation import ValidationIssue
+
+XML_DECLARATION = b"<?xml version='1.0' encoding='utf-8'?>\n"
+DS_NS = "http://www.w3.org/2000/09/xmldsig#"
+XADES_NS = "http://uri.etsi.org/01903/v1.3.2#"
+RSA_SHA256 = "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"
+SHA256 = "http://www.w3.org/2001/04/xmlenc#sha256"
+SHA1 = "http://www.w3.org/2000/09/xmldsig#sha1"
+ENVELOPED_SIGNATURE = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+SIGNED_PROPERTIES_TYPE = "http://uri.etsi.org/01903#SignedProperties"
+
+
+class CanonicalSpool:
+    """Spool file receiving a document in pieces, with the running digests of its bytes.
+
+    ``write`` hashes the file content and, for canonical pieces, the digest
+    of the enveloped signature reference. With a ``schema``, every piece is
+    also fed to a validating pull parser that forgets each ``LineaDetalle``
+    once it is checked.
+    """
+
+    def __init__(self, directory, schema=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix="xml-", suffix=".tmp")
+        self._handle = os.fdopen(fd, "wb")
+        self._file_digest = hashlib.sha256()
+        self._canonical_digest = hashlib.sha256()
+        self.size = 0
+        self.validation_seconds = 0.0
+        self._parser = None
+        if schema is not None:
+            # The log of the exception raised at the end also holds older errors of this thread.
+            etree.clear_error_log()
+            self._parser = etree.XMLPullParser(
+                events=("end",),
+                tag="{*}LineaDetalle",
+                schema=schema,
+                no_network=True,
+                resolve_entities=False,
+            )
+        self._kept = False
+
+    def write(self, data, canonical=True):
+        self._handle.write(data)
+        self._file_digest.update(data)
+        self.size += len(data)
+        if canonical:
+            self._canonical_digest.update(data)
+        if self._parser is not None:
+            started = time.perf_counter()
+            self._parser.feed(data)
+            for _event, element in self._parser.read_events():
+                element.clear()
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+            self.validation_seconds += time.perf_counter() - started
+
+    def canonical_digest(self, tail=b""):
+        """Digest of the canonical pieces written so far followed by ``tail``."""
+        digest = self._canonical_digest.copy()
+        digest.update(tail)
+        return digest.digest()
+
+    def finish(self):
+        """Close the file and return the schema issues of the whole document (empty without schema).
+
+        Pull parsers only report schema errors when closed, without their position.
+        """
+        self._handle.close()
+        if self._parser is None:
+            return []
+        started = time.perf_counter()
+        try:
+            self._parser.close()
+            issues = []
+        except etree.XMLSyntaxError as exc:
+            issues = [ValidationIssue(None, None, error.message) for error in exc.error_log] or [
+                ValidationIssue(None, None, str(exc))
+            ]
+        self._parser = None
+        self.validation_seconds += time.perf_counter() - started
+        return issues
+
+    def keep(self):
+        """Hand the file over to the caller as a :class:`SpooledPayload`."""
+        self._kept = True
+        return SpooledPayload(self.path, self._file_digest.hexdigest(), self.size)
+
+    def discard(self):
+        if self._kept:
+            return
+        self._handle.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _canonical_b64_digest(element):
+    return _b64(hashlib.sha256(etree.tostring(element, method="c14n")).digest())
+
+
+def _pem_body(pem):
+    """Base64 body of a PEM certificate, with its line breaks, as signxml writes it."""
+    return "".join(pem.decode().splitlines(True)[1:-1])
+
+
+def _integer_b64(value):
+    return _b64(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+def _ds(parent, tag, text=None, **attributes):
+    element = etree.SubElement(parent, etree.QName(DS_NS, tag), attributes)
+    if text is not None:
+        element.text = text
+    return element
+
+
+def _xades(parent, tag, text=None, **attributes):
+    element = etree.SubElement(parent, etree.QName(XADES_NS, tag), attributes)
+    if text is not None:
+        element.text = text
+    return element
+
+
+def build_signature(skeleton, document_digest, material):
+    """Canonical bytes of the enveloped XAdES-EPES signature of a streamed document.
+
+    ``skeleton`` is an empty root with the declarations of the document root,
+    so that the canonical forms of the signed elements, which carry the
+    in-scope namespaces, are those they will have in the document.
+    ``document_digest`` is the sha256 of the canonical document without its
+    signature. The signature is appended to ``skeleton``.
+    """
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    token = uuid.uuid4().hex[:12].upper()
+    signature_id = f"Signature-{token}"
+    reference_id = f"Reference-{token}"
+    properties_id = f"SignedProperties-{token}"
+    key_info_id = f"KeyInfo-{token}"
+
+    signature = _ds(skeleton, "Signature", Id=signature_id)
+    signed_info = _ds(signature, "SignedInfo")
+    _ds(signed_info, "CanonicalizationMethod", Algorithm=C14N_ALGORITHM)
+    _ds(signed_info, "SignatureMethod", Algorithm=RSA_SHA256)
+    reference = _ds(signed_info, "Reference", URI="", Id=reference_id)
+    transforms = _ds(reference, "Transforms")
+    _ds(transforms, "Transform", Algorithm=ENVELOPED_SIGNATURE)
+    _ds(transforms, "Transform", Algorithm=C14N_ALGORITHM)
+    _ds(reference, "DigestMethod", Algorithm=SHA256)
+    _ds(reference, "DigestValue", _b64(document_digest))
+    properties_reference = _ds(signed_info, "Reference", URI=f"#{properties_id}", Type=SIGNED_PROPERTIES_TYPE)
+    _ds(properties_reference, "DigestMethod", Algorithm=SHA256)
+    properties_digest = _ds(properties_reference, "DigestValue")
+    key_info_reference = _ds(signed_info, "Reference", URI=f"#{key_info_id}")
+    _ds(key_info_reference, "DigestMethod", Algorithm=SHA256)
+    key_info_digest = _ds(key_info_reference, "DigestValue")
+    signature_value = _ds(signature, "SignatureValue")
+
+    key_info = _ds(signature, "KeyInfo", Id=key_info_id)
+    numbers = material.private_key.public_key().public_numbers()
+    rsa_key_value = _ds(_ds(key_info, "KeyValue"), "RSAKeyValue")
+    _ds(rsa_key_value, "Modulus", _integer_b64(numbers.n))
+    _ds(rsa_key_value, "Exponent", _integer_b64(numbers.e))
+    x509_data = _ds(key_info, "X509Data")
+    for pem in material.cert_chain:
+        _ds(x509_data, "X509Certificate", _pem_body(pem))
+
+    qualifying = _xades(_ds(signature, "Object"), "QualifyingProperties", Target=f"#{signature_id}")
+    properties = _xades(qualifying, "SignedProperties", Id=properties_id)
+    signature_properties = _xades(properties, "SignedSignatureProperties")
+    signing_time = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    _xades(signature_properties, "SigningTime", signing_time)
+    signing_certificate = _xades(signature_properties, "SigningCertificateV2")
+    for pem in material.cert_chain:
+        cert_digest = _xades(_xades(signing_certificate, "Cert"), "CertDigest")
+        _ds(cert_digest, "DigestMethod", Algorithm=SHA256)
+        _ds(cert_digest, "DigestValue", _b64(hashlib.sha256(base64.b64decode(_pem_body(pem))).digest()))
+    policy_id = _xades(_xades(signature_properties, "SignaturePolicyIdentifier"), "SignaturePolicyId")
+    sig_policy_id = _xades(policy_id, "SigPolicyId")
+    _xades(sig_policy_id, "Identifier", material.policy_identifier)
+    _xades(sig_policy_id, "Description", "")
+    policy_hash = _xades(policy_id, "SigPolicyHash")
+    _ds(policy_hash, "DigestMethod", Algorithm=SHA1)
+    _ds(policy_hash, "DigestValue", POLICY_DIGEST_VALUE)
+    _xades(_xades(_xades(signature_properties, "SignerRole"), "ClaimedRoles"), "ClaimedRole", CLAIMED_ROLE)
+    data_object_format = _xades(
+        _xades(properties, "SignedDataObjectProperties"), "DataObjectFormat", ObjectReference=f"#{reference_id}"
+    )
+    _xades(data_object_format, "Description", "")
+    _xades(data_object_format, "MimeType", "text/xml")
+
+    properties_digest.text = _canonical_b64_digest(properties)
+    key_info_digest.text = _canonical_b64_digest(key_info)
+    signature_value.text = _b64(
+        material.private_key.sign(
+            etree.tostring(signed_info, method="c14n"), padding.PKCS1v15(), hashes.SHA256()
+        )
+    )
+    # Cut out of the canonical skeleton, the signature does not repeat the declarations of the root.
+    canonical = etree.tostring(skeleton, method="c14n")
+    return canonical[canonical.index(b"<ds:Signature"):canonical.rindex(b"</")]
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Offline validation of the generated XML against the Hacienda v4.4 schemas.
+
+The module ships the XML-DSig schema the Hacienda XSD files import, in
+``data/xsd/v4.4``. The XSD files of the document types are published by
+Hacienda and fetched by :func:`download_schemas` (see
+``account.move._cron_sync_hacienda_xsd``) into the directory validation
+reads from, under their official names. Imports are resolved to files of
+the same name in that directory, so compiling never touches the network.
+Each compiled :class:`etree.XMLSchema` is shared by the whole process. lxml
+validators keep their error log on the instance, so the validation of a
+tree and the reading of its errors hold the lock of the schema.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+try:  # pragma: no cover - optional dependency provided at runtime
+    from lxml import etree
+except ImportError:  # pragma: no cover - callers raise a user error when needed
+    etree = None
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_XSD_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "xsd", "v4.4")
+SCHEMA_BASE_URL = "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/"
+XSD_NS = "http://www.w3.org/2001/XMLSchema"
+# Root element of each document type and the file of its schema.
+SCHEMA_FILES = {
+    "FacturaElectronica": "facturaElectronica.xsd",
+    "FacturaElectronicaCompra": "facturaElectronicaCompra.xsd",
+    "FacturaElectronicaExportacion": "facturaElectronicaExportacion.xsd",
+    "NotaCreditoElectronica": "notaCreditoElectronica.xsd",
+    "NotaDebitoElectronica": "notaDebitoElectronica.xsd",
+    "TiqueteElectronico": "tiqueteElectronico.xsd",
+    "ReciboElectronicoPago": "reciboElectronicoPago.xsd",
+    "MensajeReceptor": "mensajeReceptor.xsd",
+}
+DS_SIGNATURE = "{http://www.w3.org/2000/09/xmldsig#}Signature"
+MAX_REPORTED_ISSUES = 20
+
+ValidationIssue = namedtuple("ValidationIssue", "line path message")
+
+# (root name, directory) -> (schema, lock held while validating with it)
+_schemas = {}
+_schemas_lock = threading.Lock()
+_missing_reported = set()
+
+
+def _reset_locks():
+    # A fork may happen while another thread holds a lock; the child would wait for it forever.
+    global _schemas_lock
+    _schemas_lock = threading.Lock()
+    for key, (schema, _lock) in list(_schemas.items()):
+        _schemas[key] = (schema, threading.Lock())
+
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+
+class _LocalResolver(etree.Resolver if etree is not None else object):
+    """Resolve the schema imports and includes to files of the same name in ``directory``."""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def resolve(self, url, public_id, context):
+        path = os.path.join(self.directory, os.path.basename(urlsplit(url).path))
+        if os.path.isfile(path):
+            return self.resolve_filename(path, context)
+        return None
+
+
+def _schema_parser(directory):
+    parser = etree.XMLParser(no_network=True, resolve_entities=False)
+    parser.resolvers.add(_LocalResolver(directory))
+    return parser
+
+
+def _get_schema_entry(root_name, directory=None):
+    directory = directory or DEFAULT_XSD_DIRECTORY
+    key = (root_name, directory)
+    entry = _schemas.get(key)
+    if entry is not None:
+        return entry
+    filename = SCHEMA_FILES.get(root_name)
+    path = os.path.join(directory, filename) if filename else None
+    if not path or not os.path.isfile(path):
+        # Not cached: the file may be downloaded later.
+        if key not in _missing_reported:
+            _missing_reported.add(key)
+            _logger.warning("No se encontró el esquema XSD de %s en %s; se omite la validación", root_name, directory)
+        return None
+    with _schemas_lock:
+        entry = _schemas.get(key)
+        if entry is None:
+            schema = etree.XMLSchema(etree.parse(path, _schema_parser(directory)))
+            entry = _schemas[key] = (schema, threading.Lock())
+    return entry
+
+
+def get_schema(root_name, directory=None):
+    """Return the compiled schema for documents rooted at ``root_name``, or None when it is not available."""
+    entry = _get_schema_entry(root_name, directory)
+    return entry[0] if entry else None
+
+
+def missing_schemas(directory=None):
+    """Names of the schema files of :data:`SCHEMA_FILES` that ``directory`` lacks."""
+    directory = directory or DEFAULT_XSD_DIRECTORY
+    return sorted(
+        filename for filename in set(SCHEMA_FILES.values()) if not os.path.isfile(os.path.join(directory, filename))
+    )
+
+
+def clear_schemas():
+    with _schemas_lock:
+        _schemas.clear()
+        _missing_reported.clear()
+
+
+def _is_schema_document(content):
+    try:
+        root = etree.fromstring(content, etree.XMLParser(no_network=True, resolve_entities=False))
+    except etree.XMLSyntaxError:
+        return False
+    return root.tag == etree.QName(XSD_NS, "schema")
+
+
+def _write_atomic(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def download_schemas(directory, session, timeout=30):
+    """Fill ``directory`` with the schemas it lacks; return the names of the files added.
+
+    The files shipped in :data:`DEFAULT_XSD_DIRECTORY` are copied, the XSD of
+    each document type is fetched from :data:`SCHEMA_BASE_URL`. A download
+    that fails or is not a schema is logged and left for the next run.
+    """
+    os.makedirs(directory, exist_ok=True)
+    added = []
+    if os.path.realpath(directory) != os.path.realpath(DEFAULT_XSD_DIRECTORY):
+        for name in os.listdir(DEFAULT_XSD_DIRECTORY):
+            target = os.path.join(directory, name)
+            if name.endswith(".xsd") and not os.path.exists(target):
+                shutil.copyfile(os.path.join(DEFAULT_XSD_DIRECTORY, name), target)
+                added.append(name)
+    for filename in sorted(set(SCHEMA_FILES.values())):
+        target = os.path.join(directory, filename)
+        if os.path.exists(target):
+            continue
+        try:
+            response = session.get(SCHEMA_BASE_URL + filename, timeout=timeout)
+            response.raise_for_status()
+        except Exception as exc:  # noqa: BLE001 - retried on the next run
+            _logger.warning("No se pudo descargar el esquema XSD %s: %s", filename, exc)
+            continue
+        if not _is_schema_document(response.content):
+            _logger.warning("El archivo descargado %s no es un esquema XSD", filename)
+            continue
+        _write_atomic(target, response.content)
+        added.append(filename)
+    if added:
+        clear_schemas()
+    return added
+
+
+def _is_missing_signature(error):
+    # The tree is validated before signing: the only expected child left is ds:Signature.
+    return "Missing child element(s)" in error.message and DS_SIGNATURE in error.message
+
+
+def _element_path(element):
+    """``/FacturaElectronica/DetalleServicio/LineaDetalle[3]/Cantidad`` style path of ``element``."""
+    steps = []
+    while element is not None:
+        name = etree.QName(element).localname
+        parent = element.getparent()
+        if parent is not None:
+            same = [sibling for sibling in parent if sibling.tag == element.tag]
+            if len(same) > 1:
+                name += f"[{same.index(element) + 1}]"
+        steps.append(name)
+        element = parent
+    return "/" + "/".join(reversed(steps))
+
+
+def _collect_issues(schema, document):
+    if schema.validate(document):
+        return []
+    # Pretty printed documents hold one element per line, which maps lines back to elements.
+    by_line = {}
+    for element in document.iter(etree.Element):
+        by_line.setdefault(element.sourceline, element)
+    return [
+        ValidationIssue(
+            error.line,
+            _element_path(by_line[error.line]) if error.line in by_line else error.path,
+            error.message,
+        )
+        for error in schema.error_log
+        if not _is_missing_signature(error)
+    ]
+
+
+def validate_tree(root, directory=None):
+    """Validate an unsigned tree; return its list of :class:`ValidationIssue`, or None without schema.
+
+    The tree is serialized and parsed again since the builder creates its
+    elements without namespace and only the serialization puts them in the
+    default one. When there are issues, a pretty printed copy is validated to
+    give each of them a meaningful line number.
+    """
+    entry = _get_schema_entry(etree.QName(root).localname, directory)
+    if entry is None:
+        return None
+    schema, lock = entry
+    parser = etree.XMLParser(no_network=True, resolve_entities=False)
+    document = etree.fromstring(etree.tostring(root), parser)
+    with lock:
+        issues = _collect_issues(schema, document)
+    if issues:
+        pretty = etree.fromstring(etree.tostring(root, pretty_print=True), parser)
+        with lock:
+            issues = _collect_issues(schema, pretty) or issues
+    return issues
+
+
+def format_issues(issues):
+    # Issues found while streaming a document have no position.
+    lines = [
+        f"Línea {issue.line} ({issue.path}): {issue.message}" if issue.line else issue.message
+        for issue in issues[:MAX_REPORTED_ISSUES]
+    ]
+    if len(issues) > MAX_REPORTED_ISSUES:
+        lines.append(f"... y {len(issues) - MAX_REPORTED_ISSUES} errores más.")
+    return "\n".join(lines)